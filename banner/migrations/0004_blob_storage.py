@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:55
+
+import ecommerce.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('banner', '0003_popup_popupform'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bannerimage',
+            name='image',
+            field=models.FileField(blank=True, null=True, storage=ecommerce.storage.get_blob_storage, upload_to='banners/'),
+        ),
+        migrations.AlterField(
+            model_name='popup',
+            name='image',
+            field=models.FileField(blank=True, null=True, storage=ecommerce.storage.get_blob_storage, upload_to='banners/'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from ecommerce.storage import get_blob_storage
 
 # Create your models here.
 
@@ -22,7 +23,8 @@ class Banner(models.Model):
 class BannerImage(models.Model):
     banner = models.ForeignKey(
         Banner, related_name='images', on_delete=models.CASCADE)
-    image = models.FileField(upload_to='banners/', null=True, blank=True)
+    image = models.FileField(
+        upload_to='banners/', storage=get_blob_storage, null=True, blank=True)
     image_alt_description = models.TextField(blank=True, null=True)
     link = models.CharField(max_length=255, blank=True, null=True)
     is_active = models.BooleanField(default=True)
@@ -35,7 +37,8 @@ class BannerImage(models.Model):
 
 class PopUp(models.Model):
     title = models.CharField(max_length=255, blank=True, null=True)
-    image = models.FileField(upload_to='banners/', null=True, blank=True)
+    image = models.FileField(
+        upload_to='banners/', storage=get_blob_storage, null=True, blank=True)
     disclaimer = models.TextField(blank=True, null=True)
     enabled_fields = models.JSONField(default=list, blank=True)
     is_active = models.BooleanField(default=True)
@@ -0,0 +1,5 @@
+from ecommerce import storage
+from .models import BannerImage, PopUp
+
+storage.register(BannerImage, 'image')
+storage.register(PopUp, 'image')
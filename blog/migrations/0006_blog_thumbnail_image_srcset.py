@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_alter_blog_options_blog_blog_blog_title_d6be1d_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blog',
+            name='thumbnail_image_srcset',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:55
+
+import ecommerce.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_blog_thumbnail_image_srcset'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blog',
+            name='thumbnail_image',
+            field=models.FileField(blank=True, null=True, storage=ecommerce.storage.get_blob_storage, upload_to='blog/'),
+        ),
+        migrations.AlterField(
+            model_name='testimonial',
+            name='image',
+            field=models.FileField(blank=True, null=True, storage=ecommerce.storage.get_blob_storage, upload_to='testimonial/'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from accounts.models import User
+from ecommerce.storage import get_blob_storage
 from django.utils.text import slugify
 # Create your models here.
 
@@ -36,7 +37,8 @@ class Blog(models.Model):
     meta_title = models.CharField(max_length=255, null=True, blank=True)
     meta_description = models.CharField(max_length=255, null=True, blank=True)
     thumbnail_image = models.FileField(
-        upload_to='blog/', null=True, blank=True)
+        upload_to='blog/', storage=get_blob_storage, null=True, blank=True)
+    thumbnail_image_srcset = models.JSONField(default=dict, blank=True, editable=False)
     thumbnail_image_alt_description = models.CharField(
         max_length=255, null=True, blank=True)
     category = models.ForeignKey(
@@ -77,7 +79,8 @@ class BlogComment(models.Model):
 class Testimonial(models.Model):
     name = models.CharField(max_length=255)
     designation = models.CharField(max_length=255, null=True, blank=True)
-    image = models.FileField(upload_to='testimonial/', null=True, blank=True)
+    image = models.FileField(
+        upload_to='testimonial/', storage=get_blob_storage, null=True, blank=True)
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
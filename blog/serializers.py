@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from ecommerce.renditions import SrcsetField
 from .models import BlogCategory, BlogComment, BlogTag, Blog, Testimonial
 from accounts.serializers import UserSerializer
 
@@ -40,6 +41,7 @@ class BlogCommentSmallSerializer(serializers.ModelSerializer):
 
 
 class BlogSerializer(serializers.ModelSerializer):
+    thumbnail_image_srcset = SrcsetField()
     category = BlogCategorySmallSerializer(read_only=True)
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=BlogCategory.objects.all(),
@@ -59,7 +61,7 @@ class BlogSerializer(serializers.ModelSerializer):
         model = Blog
         fields = [
             'id', 'author', 'title', 'slug', 'description', 'meta_title',
-            'meta_description', 'thumbnail_image', 'thumbnail_image_alt_description',
+            'meta_description', 'thumbnail_image', 'thumbnail_image_srcset', 'thumbnail_image_alt_description',
             'category', 'category_id', 'tags', 'tags_id', 'comments', 'created_at', 'updated_at'
         ]
 
@@ -68,10 +70,11 @@ class BlogSmallSerializer(serializers.ModelSerializer):
     category = BlogCategorySmallSerializer(read_only=True)
     tags = BlogTagSmallSerializer(many=True, read_only=True)
     thumbnail_image = serializers.SerializerMethodField(read_only=True)
+    thumbnail_image_srcset = SrcsetField()
 
     class Meta:
         model = Blog
-        fields = ['id', 'title', 'slug', 'thumbnail_image', 'thumbnail_image_alt_description',
+        fields = ['id', 'title', 'slug', 'thumbnail_image', 'thumbnail_image_srcset', 'thumbnail_image_alt_description',
                   'category', 'tags', 'created_at', 'updated_at']
 
     def get_thumbnail_image(self, obj):
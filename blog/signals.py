@@ -0,0 +1,7 @@
+from ecommerce import renditions, storage
+from .models import Blog, Testimonial
+
+renditions.register(Blog, 'thumbnail_image')
+
+storage.register(Blog, 'thumbnail_image')
+storage.register(Testimonial, 'image')
@@ -8,32 +8,29 @@ from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.db import models
 from rest_framework.response import Response
+from ecommerce.queryset_optimizer import OptimizedQuerysetMixin, optimize_queryset
 
 # Create your views here.
 
 
-class BlogCategoryListCreateView(generics.ListCreateAPIView):
-    queryset = BlogCategory.objects.only(
-        'id', 'title', 'slug', 'created_at', 'updated_at')
+class BlogCategoryListCreateView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = BlogCategory.objects.all()
     serializer_class = BlogCategorySerializer
 
 
-class BlogCategoryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = BlogCategory.objects.only(
-        'id', 'title', 'slug', 'created_at', 'updated_at')
+class BlogCategoryRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = BlogCategory.objects.all()
     serializer_class = BlogCategorySerializer
     lookup_field = 'slug'
 
 
-class BlogTagListCreateView(generics.ListCreateAPIView):
-    queryset = BlogTag.objects.only(
-        'id', 'title', 'created_at', 'updated_at')
+class BlogTagListCreateView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = BlogTag.objects.all()
     serializer_class = BlogTagSerializer
 
 
-class BlogTagRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = BlogTag.objects.only(
-        'id', 'title', 'created_at', 'updated_at')
+class BlogTagRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = BlogTag.objects.all()
     serializer_class = BlogTagSerializer
 
 
@@ -58,11 +55,8 @@ class BlogFilter(django_filters.FilterSet):
         fields = ['category', 'tags']
 
 
-class BlogListCreateView(generics.ListCreateAPIView):
-    queryset = Blog.objects.only(
-        'id', 'title', 'slug', 'thumbnail_image', 'thumbnail_image_alt_description', 'created_at', 'updated_at',
-        'category', 'category__title', 'category__slug'
-    ).select_related('category').prefetch_related('tags')
+class BlogListCreateView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = Blog.objects.all()
     serializer_class = BlogSerializer
     pagination_class = CustomPagination
     filter_backends = [filters.SearchFilter,
@@ -82,11 +76,8 @@ class BlogListCreateView(generics.ListCreateAPIView):
             serializer.save()
 
 
-class BlogRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Blog.objects.only(
-        'id', 'title', 'slug', 'thumbnail_image', 'thumbnail_image_alt_description', 'created_at', 'updated_at',
-        'category', 'category__title', 'category__slug'
-    ).select_related('category').prefetch_related('tags')
+class BlogRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Blog.objects.all()
     serializer_class = BlogSerializer
     lookup_field = 'slug'
 
@@ -95,7 +86,7 @@ class SimilarBlogListView(APIView):
     def get(self, request, slug):
         blog = get_object_or_404(Blog, slug=slug)
         # Get blogs with the same category or overlapping tags, excluding the current blog
-        similar_blogs = Blog.objects.filter(
+        similar_blogs = optimize_queryset(Blog.objects.all(), BlogSmallSerializer).filter(
             models.Q(category=blog.category) |
             models.Q(tags__in=blog.tags.all())
         ).exclude(id=blog.id).distinct()[:4]
@@ -104,9 +95,8 @@ class SimilarBlogListView(APIView):
         return Response(serializer.data)
 
 
-class BlogCommentListCreateView(generics.ListCreateAPIView):
-    queryset = BlogComment.objects.only(
-        'id', 'blog', 'user', 'comment', 'created_at', 'updated_at')
+class BlogCommentListCreateView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = BlogComment.objects.all()
     serializer_class = BlogCommentSerializer
 
     def get_serializer_class(self):
@@ -115,21 +105,18 @@ class BlogCommentListCreateView(generics.ListCreateAPIView):
         return BlogCommentSerializer
 
 
-class BlogCommentRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = BlogComment.objects.only(
-        'id', 'blog', 'user', 'comment', 'created_at', 'updated_at')
+class BlogCommentRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = BlogComment.objects.all()
     serializer_class = BlogCommentSerializer
     lookup_field = 'id'
 
 
-class TestimonialListCreateView(generics.ListCreateAPIView):
-    queryset = Testimonial.objects.only(
-        'id', 'name', 'designation', 'image', 'comment', 'created_at', 'updated_at')
+class TestimonialListCreateView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = Testimonial.objects.all()
     serializer_class = TestimonialSerializer
 
 
-class TestimonialRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Testimonial.objects.only(
-        'id', 'name', 'designation', 'image', 'comment', 'created_at', 'updated_at')
+class TestimonialRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Testimonial.objects.all()
     serializer_class = TestimonialSerializer
     lookup_field = 'id'
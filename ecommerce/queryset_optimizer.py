@@ -0,0 +1,259 @@
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import ForeignObjectRel, Prefetch
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+class QuerysetPlan:
+    """
+    select_related/prefetch_related/only() plan for one model.
+
+    `fields` is the set of concrete fields the serializer reads, or None when
+    something it reads can't be resolved to a column and every column must be
+    loaded.
+    """
+
+    def __init__(self, model, fields=()):
+        self.model = model
+        self.fields = None if fields is None else set(fields)
+        self.related = {}
+        self.prefetch = {}
+
+    def add_field(self, name):
+        if self.fields is not None:
+            self.fields.add(name)
+
+    def load_all_fields(self):
+        self.fields = None
+
+    def child(self, attr):
+        """Returns the plan of the relation `attr`, creating it if needed."""
+        relation = get_relation(self.model, attr)
+        if relation is None:
+            return None
+        plans = self.prefetch if is_to_many(relation) else self.related
+        if attr not in plans:
+            plan = QuerysetPlan(relation.related_model)
+            if isinstance(relation, ForeignObjectRel) and not relation.many_to_many:
+                # The prefetched rows need their FK to be matched to the parent
+                plan.add_field(relation.field.name)
+            plans[attr] = plan
+        return plans[attr]
+
+    def select_related_paths(self, prefix=''):
+        paths = []
+        for attr, plan in self.related.items():
+            path = f'{prefix}{attr}'
+            paths.append(path)
+            paths.extend(plan.select_related_paths(f'{path}__'))
+        return paths
+
+    def only_fields(self, prefix=''):
+        if self.fields is None:
+            return None
+        fields = [f'{prefix}{name}' for name in self.fields]
+        for attr, plan in self.related.items():
+            path = f'{prefix}{attr}'
+            fields.append(path)
+            related_fields = plan.only_fields(f'{path}__')
+            if related_fields is None:
+                # The related model is loaded in full, the parent can still be narrowed
+                continue
+            fields.extend(related_fields)
+        return fields
+
+    def prefetches(self, prefix=''):
+        lookups = []
+        for attr, plan in self.prefetch.items():
+            queryset = plan.apply(plan.model._default_manager.all())
+            lookups.append(Prefetch(f'{prefix}{attr}', queryset=queryset))
+        for attr, plan in self.related.items():
+            lookups.extend(plan.prefetches(f'{prefix}{attr}__'))
+        return lookups
+
+    def apply(self, queryset):
+        select = self.select_related_paths()
+        if select:
+            queryset = queryset.select_related(*select)
+        prefetches = self.prefetches()
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        only = self.only_fields()
+        if only is not None:
+            existing = queryset.query.select_related
+            if existing is True:
+                return queryset
+            # Keep anything the view already select_related() loadable
+            only.extend(flatten_select_related(existing))
+            queryset = queryset.only(*only)
+        return queryset
+
+
+def flatten_select_related(tree, prefix=''):
+    paths = []
+    for attr, children in (tree or {}).items():
+        path = f'{prefix}{attr}'
+        paths.append(path)
+        paths.extend(flatten_select_related(children, f'{path}__'))
+    return paths
+
+
+def get_relation(model, attr):
+    """Finds the relation reachable as `model.<attr>`, forward or reverse."""
+    try:
+        field = model._meta.get_field(attr)
+        if field.is_relation and not isinstance(field, ForeignObjectRel):
+            return field
+    except FieldDoesNotExist:
+        pass
+    for field in model._meta.get_fields():
+        if isinstance(field, ForeignObjectRel) and field.get_accessor_name() == attr:
+            return field
+    return None
+
+
+def is_to_many(relation):
+    return relation.many_to_many or relation.one_to_many
+
+
+def get_concrete_field(model, attr):
+    try:
+        field = model._meta.get_field(attr)
+    except FieldDoesNotExist:
+        return None
+    return field if field.concrete else None
+
+
+def is_forward_single(relation):
+    return not isinstance(relation, ForeignObjectRel) and not relation.many_to_many
+
+
+def traverse(plan, attrs, allow_many=False):
+    """Follows relations, returns the plan of the last one or None."""
+    for attr in attrs:
+        relation = get_relation(plan.model, attr)
+        if relation is None or (is_to_many(relation) and not allow_many):
+            return None
+        if is_forward_single(relation):
+            plan.add_field(attr)
+        plan = plan.child(attr)
+    return plan
+
+
+def add_source(plan, source):
+    """
+    Records that the serializer reads `obj.<source>` (a dotted path).
+
+    A trailing relation is loaded with all its columns since we can't tell
+    which ones the caller uses.
+    """
+    *path, attr = source.split('.')
+    target = traverse(plan, path, allow_many=True)
+    if target is None:
+        plan.load_all_fields()
+        return
+    field = get_concrete_field(target.model, attr)
+    if field is not None and not field.is_relation:
+        target.add_field(attr)
+        return
+    relation = get_relation(target.model, attr)
+    if relation is None:
+        # A property or method, we can't tell which columns it needs
+        target.load_all_fields()
+        return
+    if is_forward_single(relation):
+        target.add_field(attr)
+    target.child(attr).load_all_fields()
+
+
+def add_serializer(plan, serializer):
+    if not isinstance(serializer, serializers.ModelSerializer):
+        plan.load_all_fields()
+        return
+    plan.add_field(plan.model._meta.pk.name)
+    method_sources = getattr(serializer.Meta, 'method_field_sources', {})
+
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        if isinstance(field, serializers.SerializerMethodField):
+            sources = method_sources.get(name)
+            if sources is None:
+                if get_concrete_field(plan.model, name) is not None:
+                    add_source(plan, name)
+                else:
+                    plan.load_all_fields()
+                continue
+            if isinstance(sources, str):
+                sources = [sources]
+            for source in sources:
+                add_source(plan, source)
+            continue
+
+        if field.source == '*':
+            plan.load_all_fields()
+            continue
+
+        *path, attr = field.source_attrs
+        target = traverse(plan, path)
+        if target is None:
+            plan.load_all_fields()
+            continue
+
+        if isinstance(field, (serializers.ListSerializer, serializers.Serializer)):
+            relation = get_relation(target.model, attr)
+            if relation is None:
+                target.load_all_fields()
+                continue
+            if is_forward_single(relation):
+                target.add_field(attr)
+            nested = field.child if isinstance(
+                field, serializers.ListSerializer) else field
+            add_serializer(target.child(attr), nested)
+        elif isinstance(field, serializers.ManyRelatedField):
+            child = target.child(attr)
+            if child is None:
+                target.load_all_fields()
+            elif not isinstance(field.child_relation, serializers.PrimaryKeyRelatedField):
+                child.load_all_fields()
+        elif isinstance(field, serializers.PrimaryKeyRelatedField):
+            # Only needs the FK column
+            target.add_field(attr)
+        else:
+            add_source(target, attr)
+
+
+@lru_cache(maxsize=None)
+def get_queryset_plan(serializer_class):
+    """Builds (once per serializer class) the queryset plan for serializing with it."""
+    serializer = serializer_class()
+    model = serializer.Meta.model
+    plan = QuerysetPlan(model)
+    add_serializer(plan, serializer)
+    return plan
+
+
+def optimize_queryset(queryset, serializer_class):
+    return get_queryset_plan(serializer_class).apply(queryset)
+
+
+class OptimizedQuerysetMixin:
+    """
+    Applies the select_related/prefetch_related/only() plan of the view's
+    serializer to its queryset on read requests, so views don't have to keep
+    hand-written lists in sync with nested serializers.
+    """
+
+    def optimize_queryset(self, queryset):
+        if getattr(self, 'swagger_fake_view', False):
+            return queryset
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return queryset
+        return optimize_queryset(queryset, self.get_serializer_class())
+
+    def filter_queryset(self, queryset):
+        return self.optimize_queryset(super().filter_queryset(queryset))
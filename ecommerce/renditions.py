@@ -0,0 +1,213 @@
+"""
+Resized WebP/JPEG renditions of uploaded images.
+
+A model registers an image field with `register(Model, 'image')`, which
+expects a JSONField named `image_srcset` next to it. Saving a new file
+clears that field and queues the renditions on a small thread pool once the
+transaction commits. They are stored under the hash of the original's
+content, so re-uploading the same picture reuses the files, and the field
+ends up as
+
+    {'source': <original name>, 'webp': {'200': <name>, ...}, 'jpeg': {...}}
+
+which SrcsetField turns into a srcset string per format for the API.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models.signals import post_save, pre_save
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (200, 400, 800)
+# format -> (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+RENDITIONS_DIR = 'renditions'
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def srcset_field_name(field_name):
+    return f'{field_name}_srcset'
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def rendition_name(digest, width, fmt):
+    return f'{RENDITIONS_DIR}/{digest[:2]}/{digest}/{width}.{fmt}'
+
+
+def flatten(image):
+    """RGB copy of `image`, transparent parts on white (for JPEG)."""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_renditions(name, storage=default_storage, source_storage=None):
+    """
+    Writes the renditions of the file `name` in `source_storage` (default
+    `storage`) to `storage`, returns the srcset field value.
+    """
+    with (source_storage or storage).open(name, 'rb') as file:
+        digest = content_hash(file)
+        file.seek(0)
+        image = Image.open(file)
+        # JPEGs can be decoded straight at a fraction of their size
+        largest = max(WIDTHS)
+        if image.width > largest:
+            image.draft('RGB', (largest, round(image.height * largest / image.width)))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+    # Never upscale, an image narrower than every width gets one at its own size
+    widths = [width for width in WIDTHS if width < image.width] or [image.width]
+
+    result = {'source': name}
+    # Largest first, each size is resized from the previous one
+    current = image
+    for width in sorted(widths, reverse=True):
+        height = max(round(image.height * width / image.width), 1)
+        if current.width != width:
+            current = current.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        for fmt, (pil_format, options) in FORMATS.items():
+            target = rendition_name(digest, width, fmt)
+            if not storage.exists(target):
+                buffer = BytesIO()
+                frame = flatten(current) if pil_format == 'JPEG' else current
+                frame.save(buffer, pil_format, **options)
+                storage.save(target, ContentFile(buffer.getvalue()))
+            result.setdefault(fmt, {})[str(width)] = target
+    return result
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_RENDITION_WORKERS', 2),
+                thread_name_prefix='renditions')
+        return _executor
+
+
+def render(model, pk, field_name, name, on_done=None):
+    """Generates the renditions of one stored image and saves them on the row."""
+    srcset_field = srcset_field_name(field_name)
+    # Rows sharing a stored file share its renditions
+    srcset = model._default_manager.filter(**{field_name: name}).exclude(
+        **{srcset_field: {}}).values_list(srcset_field, flat=True).first()
+    try:
+        srcset = srcset or generate_renditions(
+            name, source_storage=model._meta.get_field(field_name).storage)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        # Not an image we can read (an SVG, a PDF...), the original is still served
+        logger.warning('No renditions for %s: %s', name, e)
+        return None
+    # Only if the field still holds this file
+    updated = model._default_manager.filter(pk=pk, **{field_name: name}).update(
+        **{srcset_field: srcset})
+    if updated and on_done:
+        on_done(model._default_manager.get(pk=pk))
+    return srcset
+
+
+def _render_in_worker(*args):
+    try:
+        render(*args)
+    except Exception:
+        logger.exception('Rendering %s failed', args[3])
+    finally:
+        # Worker threads get their own connections, don't leave them open
+        connections.close_all()
+
+
+def schedule(instance, field_name, on_done=None):
+    """Queues the renditions of `instance.<field_name>` after the transaction commits."""
+    args = (type(instance), instance.pk, field_name, getattr(instance, field_name).name, on_done)
+    if getattr(settings, 'IMAGE_RENDITION_WORKERS', 2) <= 0:
+        transaction.on_commit(lambda: render(*args))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_render_in_worker, *args))
+
+
+# (model, field name, on_done) of every registered field
+registry = []
+
+
+def schedule_saved(instances, field_name):
+    """
+    Queues the renditions of rows saved without signals (bulk_create), with
+    the on_done their model registered.
+    """
+    for instance in instances:
+        if not getattr(instance, field_name) or getattr(instance, srcset_field_name(field_name)):
+            continue
+        on_done = next((done for model, name, done in registry
+                        if model is type(instance) and name == field_name), None)
+        schedule(instance, field_name, on_done)
+
+
+def register(model, field_name, on_done=None):
+    """
+    Keeps `<field_name>_srcset` in step with `field_name` on `model`.
+    `on_done(instance)` runs once the renditions are saved.
+    """
+    srcset_field = srcset_field_name(field_name)
+    registry.append((model, field_name, on_done))
+
+    def clear_stale_srcset(sender, instance, raw=False, **kwargs):
+        srcset = getattr(instance, srcset_field) or {}
+        if srcset and srcset.get('source') != getattr(instance, field_name).name:
+            setattr(instance, srcset_field, {})
+
+    def queue_renditions(sender, instance, raw=False, **kwargs):
+        if raw or not getattr(instance, field_name) or getattr(instance, srcset_field):
+            return
+        schedule(instance, field_name, on_done)
+
+    uid = f'renditions:{model._meta.label}.{field_name}'
+    pre_save.connect(clear_stale_srcset, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(queue_renditions, sender=model, weak=False, dispatch_uid=uid)
+
+
+class SrcsetField(serializers.Field):
+    """Renders a `*_srcset` model field as {'webp': '<url> 200w, ...', 'jpeg': ...}."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        return {
+            fmt: ', '.join(f'{default_storage.url(name)} {width}w'
+                           for width, name in sorted(value[fmt].items(), key=lambda item: int(item[0])))
+            for fmt in FORMATS if value.get(fmt)
+        }
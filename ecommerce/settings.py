@@ -140,6 +140,26 @@ DATABASES = {
     }
 }
 
+# Local memory by default (per process). Multi-process deployments should set
+# CACHE_BACKEND=file and a CACHE_LOCATION directory shared by the workers so
+# response cache invalidations are seen everywhere.
+if os.environ.get('CACHE_BACKEND') == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ecommerce',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+
 AUTH_USER_MODEL = 'accounts.User'
 
 # Password validation
@@ -188,6 +208,12 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = Path(BASE_DIR, 'media')
 
+# State kept between runs of the batch commands (not served)
+VAR_ROOT = Path(BASE_DIR, 'var')
+
+# Threads generating image renditions after uploads, 0 renders in the request
+IMAGE_RENDITION_WORKERS = int(os.environ.get('IMAGE_RENDITION_WORKERS', 2))
+
 TINYMCE_DEFAULT_CONFIG = {
     "height": "780",
     "width": "780",
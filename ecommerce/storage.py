@@ -0,0 +1,295 @@
+"""
+Content-addressed media storage.
+
+Fields using `storage=get_blob_storage` store each distinct content once,
+as blobs/<2 hex>/<sha256><ext> whatever name it was uploaded with. Saving
+bytes that are already stored writes nothing and returns the existing name,
+so every row holding the same picture shares one file.
+
+Every blob has a StoredBlob row counting the rows that point at it.
+`register(Model, 'image')` keeps the count in step as rows are saved and
+deleted. Code writing rows with bulk_create or bulk_update calls acquire()
+and release() itself. Unreferenced blobs are only removed by
+collect_garbage() (the collect_stored_blobs command), once they haven't
+been saved for GRACE_PERIOD, so a blob saved for a row that isn't committed
+yet is never deleted under it. delete() leaves blobs alone, other rows may
+still point at the same file.
+
+The file is written before its StoredBlob row, which is saved in the
+caller's transaction. If that rolls back the file stays with no row, so
+collect_garbage() also deletes the files under blobs/ that have had no row
+for GRACE_PERIOD.
+"""
+import hashlib
+import itertools
+import os
+import posixpath
+from collections import Counter, defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+BLOBS_DIR = 'blobs'
+GRACE_PERIOD = timedelta(days=1)
+BATCH_SIZE = 500
+
+
+def blob_name(digest, name):
+    ext = posixpath.splitext(name or '')[1].lower()
+    return f'{BLOBS_DIR}/{digest[:2]}/{digest}{ext}'
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOBS_DIR + '/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Stores files under the hash of their content, a file already stored isn't written again."""
+
+    def save(self, name, content, max_length=None):
+        from products.models import StoredBlob
+
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        name = blob_name(digest.hexdigest(), name)
+        if self.exists(name):
+            # Recently saved again, see sweep_orphans()
+            os.utime(self.path(name))
+        else:
+            name = self._save(name, content)
+        StoredBlob.objects.update_or_create(
+            name=name, defaults={'size': size, 'saved_at': timezone.now()})
+        return name
+
+    def delete(self, name):
+        # FieldFile.delete() on a shared blob, collect_garbage() removes it once unreferenced
+        if is_blob(name):
+            return
+        super().delete(name)
+
+    def purge(self, name):
+        """Deletes the file of a blob, for collect_garbage()."""
+        super().delete(name)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def get_blob_storage():
+    return blob_storage
+
+
+class PrivateStorage(FileSystemStorage):
+    """Files that must not be served: kept under VAR_ROOT/private, with no URL."""
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, Path(settings.VAR_ROOT, 'private'))
+
+    def url(self, name):
+        raise ValueError('Private files have no URL.')
+
+
+private_storage = PrivateStorage()
+
+
+def get_private_storage():
+    return private_storage
+
+
+def _add_references(names, sign):
+    from products.models import StoredBlob
+
+    by_count = defaultdict(list)
+    for name, count in Counter(name for name in names if is_blob(name)).items():
+        by_count[count].append(name)
+    for count, batch in by_count.items():
+        StoredBlob.objects.filter(name__in=batch).update(ref_count=F('ref_count') + sign * count)
+
+
+def acquire(names):
+    """Counts one more reference for each blob name (a name can repeat)."""
+    _add_references(names, 1)
+
+
+def release(names):
+    _add_references(names, -1)
+
+
+def url_hash(url):
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+def find_blobs(urls):
+    """{url: blob name} for the URLs a stored blob was downloaded from."""
+    from products.models import StoredBlob, StoredBlobSource
+
+    hashes = {url_hash(url): url for url in urls if url}
+    if not hashes:
+        return {}
+    found = {hashes[digest]: name for digest, name in StoredBlobSource.objects.filter(
+        url_hash__in=hashes).values_list('url_hash', 'blob__name')}
+    # About to be referenced again, keep the garbage collector off them
+    StoredBlob.objects.filter(name__in=found.values()).update(saved_at=timezone.now())
+    return found
+
+
+def remember_sources(sources):
+    """Records the (url, blob name) pairs of downloaded files for find_blobs."""
+    from products.models import StoredBlob, StoredBlobSource
+
+    sources = {url: name for url, name in sources if url and is_blob(name)}
+    blob_ids = dict(StoredBlob.objects.filter(
+        name__in=set(sources.values())).values_list('name', 'pk'))
+    StoredBlobSource.objects.bulk_create([
+        StoredBlobSource(url=url, url_hash=url_hash(url), blob_id=blob_ids[name])
+        for url, name in sources.items() if name in blob_ids
+    ], ignore_conflicts=True)
+
+
+# (model, field name) of every registered field
+registry = []
+
+
+def register(model, field_name):
+    """Keeps the reference counts of the blobs `model.<field_name>` points at."""
+    registry.append((model, field_name))
+    stored_attr = f'_stored_{field_name}'
+
+    def remember_stored_name(sender, instance, raw=False, update_fields=None, **kwargs):
+        if raw or (update_fields is not None and field_name not in update_fields):
+            instance.__dict__.pop(stored_attr, None)
+            return
+        stored = ''
+        if not instance._state.adding and instance.pk is not None:
+            stored = model._default_manager.filter(pk=instance.pk).values_list(
+                field_name, flat=True).first() or ''
+        setattr(instance, stored_attr, stored)
+
+    def count_references(sender, instance, **kwargs):
+        stored = instance.__dict__.pop(stored_attr, None)
+        name = getattr(instance, field_name).name or ''
+        if stored is not None and name != stored:
+            acquire([name])
+            release([stored])
+
+    def release_references(sender, instance, **kwargs):
+        release([getattr(instance, field_name).name])
+
+    uid = f'blobs:{model._meta.label}.{field_name}'
+    pre_save.connect(remember_stored_name, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(count_references, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(release_references, sender=model, weak=False, dispatch_uid=uid)
+
+
+def referenced_names(names):
+    """The names in `names` some registered field points at."""
+    referenced = set()
+    for model, field_name in registry:
+        referenced.update(model._default_manager.filter(
+            **{f'{field_name}__in': names}).values_list(field_name, flat=True))
+    return referenced
+
+
+def recount():
+    """Sets every reference count from the rows, in case they drifted."""
+    from products.models import StoredBlob
+
+    counts = Counter()
+    for model, field_name in registry:
+        counts.update(model._default_manager.filter(
+            **{f'{field_name}__startswith': BLOBS_DIR + '/'}
+        ).values_list(field_name, flat=True).iterator())
+    by_count = defaultdict(list)
+    for name, count in counts.items():
+        by_count[count].append(name)
+    with transaction.atomic():
+        StoredBlob.objects.exclude(ref_count=0).update(ref_count=0)
+        for count, names in by_count.items():
+            for start in range(0, len(names), BATCH_SIZE):
+                StoredBlob.objects.filter(
+                    name__in=names[start:start + BATCH_SIZE]).update(ref_count=count)
+
+
+def iter_blob_files():
+    """Yields (name, modification time) of the files under blobs/."""
+    root = Path(blob_storage.location, BLOBS_DIR)
+    if not root.is_dir():
+        return
+    for directory in os.scandir(root):
+        if not directory.is_dir():
+            continue
+        for file in os.scandir(directory.path):
+            if file.is_file():
+                yield f'{BLOBS_DIR}/{directory.name}/{file.name}', file.stat().st_mtime
+
+
+def sweep_orphans(grace=GRACE_PERIOD):
+    """
+    Deletes the blob files with no StoredBlob row (their transaction rolled
+    back) not written or saved again within `grace`, returns how many.
+    """
+    from products.models import StoredBlob
+
+    cutoff = (timezone.now() - grace).timestamp()
+    deleted = 0
+    files = iter_blob_files()
+    while batch := dict(itertools.islice(files, BATCH_SIZE)):
+        old = [name for name, mtime in batch.items() if mtime < cutoff]
+        recorded = set(StoredBlob.objects.filter(name__in=old).values_list('name', flat=True))
+        for name in old:
+            if name in recorded:
+                continue
+            try:
+                # Saved again since the directory was read
+                if os.path.getmtime(blob_storage.path(name)) >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            blob_storage.purge(name)
+            deleted += 1
+    return deleted
+
+
+def collect_garbage(grace=GRACE_PERIOD):
+    """
+    Deletes the files of unreferenced blobs not saved within `grace`, and the
+    orphaned ones (see sweep_orphans), returns how many.
+    """
+    from products.models import StoredBlob
+
+    cutoff = timezone.now() - grace
+    names = list(StoredBlob.objects.filter(
+        ref_count__lte=0, saved_at__lt=cutoff).values_list('name', flat=True))
+    deleted = 0
+    for start in range(0, len(names), BATCH_SIZE):
+        batch = names[start:start + BATCH_SIZE]
+        # A count that drifted below the real one must not cost a file
+        referenced = referenced_names(batch)
+        for name in batch:
+            if name in referenced:
+                continue
+            with transaction.atomic():
+                blob = StoredBlob.objects.select_for_update().filter(
+                    name=name, ref_count__lte=0, saved_at__lt=cutoff).first()
+                if blob is None:
+                    continue
+                blob_storage.purge(name)
+                blob.delete()
+            deleted += 1
+    return deleted + sweep_orphans(grace)
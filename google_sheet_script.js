@@ -2,6 +2,8 @@ function myOnOpen() {
     const ui = SpreadsheetApp.getUi();
     ui.createMenu("📤 Product Uploader")
       .addItem("⬆️ Upload Products", "uploadProducts")
+      .addItem("🔁 Sync Products", "syncProducts")
+      .addItem("✅ Validate Products", "validateProducts")
       .addItem("🔄 Reload Categories", "autoFillCategories")
       .addToUi();
     autoFillCategories();  // enable for auto-fetch on open
@@ -16,29 +18,25 @@ function myOnOpen() {
     const isFeaturedCol = 10;  // Column J
   
     try {
-      // Fetch all dropdown data from API
-      const categoryRes = UrlFetchApp.fetch("https://babies-realtor-victim-investigations.trycloudflare.com/api/categories/");
-      const subcategoryRes = UrlFetchApp.fetch("https://babies-realtor-victim-investigations.trycloudflare.com/api/subcategories/");
-      const subsubcategoryRes = UrlFetchApp.fetch("https://babies-realtor-victim-investigations.trycloudflare.com/api/subsubcategories/");
-  
-      const categories = JSON.parse(categoryRes.getContentText());
-      const subcategories = JSON.parse(subcategoryRes.getContentText());
-      const subsubcategories = JSON.parse(subsubcategoryRes.getContentText());
+      // Fetch the whole category hierarchy in one request
+      const treeRes = UrlFetchApp.fetch("https://babies-realtor-victim-investigations.trycloudflare.com/api/category-tree/");
+      const tree = JSON.parse(treeRes.getContentText());
   
       // Extract category names (simple list)
-      const categoryNames = categories.map(c => c.name).filter(Boolean);
+      const categoryNames = tree.map(c => c.name).filter(Boolean);
       
       // Create subcategory list with parent category: "Subcategory (Category)"
-      const subcategoryNames = subcategories.map(sc => {
-        const parentCategory = sc.category ? sc.category.name : 'Unknown';
-        return `${sc.name} (${parentCategory})`;
-      }).filter(Boolean);
-      
+      const subcategoryNames = [];
       // Create sub-subcategory list with parent subcategory: "SubSubcategory (Subcategory)"
-      const subsubcategoryNames = subsubcategories.map(ssc => {
-        const parentSubcategory = ssc.subcategory ? ssc.subcategory.name : 'Unknown';
-        return `${ssc.name} (${parentSubcategory})`;
-      }).filter(Boolean);
+      const subsubcategoryNames = [];
+      tree.forEach(c => {
+        c.subcategories.forEach(sc => {
+          subcategoryNames.push(`${sc.name} (${c.name})`);
+          sc.subsubcategories.forEach(ssc => {
+            subsubcategoryNames.push(`${ssc.name} (${sc.name})`);
+          });
+        });
+      });
   
       if (categoryNames.length === 0 || subcategoryNames.length === 0 || subsubcategoryNames.length === 0) {
         SpreadsheetApp.getUi().alert("⚠️ One or more dropdown lists are empty.");
@@ -96,12 +94,27 @@ function myOnOpen() {
   }
   
   function uploadProducts() {
+    sendProducts({});
+  }
+
+  // Creates new products and updates the changed ones, unchanged rows are skipped by the server
+  function syncProducts() {
+    const ui = SpreadsheetApp.getUi();
+    const answer = ui.alert(
+      "Sync Products", "Deactivate imported products that are no longer in this sheet?", ui.ButtonSet.YES_NO_CANCEL);
+    if (answer === ui.Button.CANCEL || answer === ui.Button.CLOSE) {
+      return;
+    }
+    sendProducts({ mode: "sync", deactivate_missing: answer === ui.Button.YES });
+  }
+
+  function readProductRows() {
     const sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
     const data = sheet.getDataRange().getValues();
     const headers = data[0];
   
     // Convert each row to an object
-    const rows = data.slice(1).map(row => {
+    return data.slice(1).map(row => {
       let obj = {};
       headers.forEach((h, i) => {
         // Convert 'True'/'False' strings to boolean values for is_popular and is_featured
@@ -113,11 +126,14 @@ function myOnOpen() {
       });
       return obj;
     });
-  
+  }
+
+  function sendProducts(importOptions) {
+    const rows = readProductRows();
     const options = {
       method: "post",
       contentType: "application/json",
-      payload: JSON.stringify({ rows }),
+      payload: JSON.stringify(Object.assign({ rows }, importOptions)),
       muteHttpExceptions: true,
     };
   
@@ -125,9 +141,77 @@ function myOnOpen() {
   
     try {
       const res = UrlFetchApp.fetch(url, options);
-      const msg = res.getContentText();
-      SpreadsheetApp.getUi().alert("✅ Upload complete:\n" + msg);
+      if (res.getResponseCode() !== 202) {
+        SpreadsheetApp.getUi().alert("❌ Upload failed:\n" + res.getContentText());
+        return;
+      }
+      // The import runs in the background, poll its job until it finishes
+      const job = JSON.parse(res.getContentText());
+      const status = waitForImportJob(job.status_url);
+      SpreadsheetApp.getUi().alert(formatImportJob(status));
     } catch (err) {
       SpreadsheetApp.getUi().alert("❌ Upload failed:\n" + err.message);
     }
+  }
+
+  // Checks the sheet without importing anything, the server reports what each row would do
+  function validateProducts() {
+    const options = {
+      method: "post",
+      contentType: "application/json",
+      payload: JSON.stringify({ rows: readProductRows(), mode: "sync" }),
+      muteHttpExceptions: true,
+    };
+    const url = "https://babies-realtor-victim-investigations.trycloudflare.com/api/import-products/?dry_run=1";
+
+    try {
+      const res = UrlFetchApp.fetch(url, options);
+      if (res.getResponseCode() !== 200) {
+        SpreadsheetApp.getUi().alert("❌ Validation failed:\n" + res.getContentText());
+        return;
+      }
+      const report = JSON.parse(res.getContentText());
+      const summary = report.summary;
+      let msg = "🔎 Dry run:\n" + summary.create + " to create, " + summary.update + " to update, " +
+        summary.unchanged + " unchanged, " + summary.skip + " skipped, " + summary.error + " errors, " +
+        summary.invalid_image_urls + " invalid image URLs";
+      report.rows
+        .filter(r => r.errors.length || r.invalid_image_urls.length)
+        .slice(0, 20)
+        .forEach(r => {
+          r.errors.forEach(e => { msg += "\nRow " + r.row + ": " + e; });
+          r.invalid_image_urls.forEach(u => { msg += "\nRow " + u.row + ": bad image URL " + u.url; });
+        });
+      SpreadsheetApp.getUi().alert(msg);
+    } catch (err) {
+      SpreadsheetApp.getUi().alert("❌ Validation failed:\n" + err.message);
+    }
+  }
+
+  function waitForImportJob(statusUrl) {
+    // Apps Script stops a run after 6 minutes, give up polling well before that
+    const deadline = Date.now() + 4 * 60 * 1000;
+    let status;
+    do {
+      Utilities.sleep(3000);
+      status = JSON.parse(UrlFetchApp.fetch(statusUrl, { muteHttpExceptions: true }).getContentText());
+      SpreadsheetApp.getActiveSpreadsheet().toast(
+        status.rows_processed + " / " + (status.rows_total || "?") + " rows", "Importing products");
+    } while ((status.status === "pending" || status.status === "running") && Date.now() < deadline);
+    return status;
+  }
+
+  function formatImportJob(status) {
+    if (status.status === "pending" || status.status === "running") {
+      return "⏳ Import still running (" + status.rows_processed + " rows so far).\nCheck again later.";
+    }
+    if (status.status === "failed") {
+      return "❌ Import failed:\n" + status.message;
+    }
+    let msg = "✅ Import complete:\n" + status.products_created + " created, " +
+      status.products_updated + " updated, " + status.products_unchanged + " unchanged, " +
+      status.products_skipped + " skipped, " + status.products_deactivated + " deactivated, " +
+      status.error_count + " errors";
+    status.errors.slice(0, 20).forEach(e => { msg += "\nRow " + e.row + ": " + e.error; });
+    return msg;
   }
\ No newline at end of file
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from order.recommendations import build_bought_together
+
+
+class Command(BaseCommand):
+    help = 'Counts the orders changed since the last run and updates the bought together products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recount every order instead of the ones changed since the last run.')
+
+    def handle(self, *args, **options):
+        count = build_bought_together(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated bought together products for {count} products.'))
@@ -52,6 +52,7 @@ class Order(models.Model):
             models.Index(fields=['user']),
             models.Index(fields=['status']),
             models.Index(fields=['created_at']),
+            models.Index(fields=['updated_at']),
         ]
 
 
@@ -0,0 +1,250 @@
+"""
+"Frequently bought together" mined from order items.
+
+Keeps a sparse product x product co-occurrence matrix (how many orders
+contain both products), the number of orders containing each product and
+the number of orders counted. Orders are streamed in chunks. The counts are
+saved to an .npz file between runs, along with the products counted for
+each order, so each run only reads the orders changed since the last one:
+their old basket is subtracted before the new one is added (nothing for a
+cancelled or deleted order).
+
+Orders are only counted once they haven't changed for SETTLE_AFTER, so an
+order whose items are still being written isn't counted half done.
+"""
+import math
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.utils import timezone
+
+from products.models import Product, ProductRecommendation
+from .models import Order, OrderItem
+
+TOP_K = 12
+ORDER_CHUNK_SIZE = 5000
+# Orders with more distinct products add too many pairs to say much
+MAX_BASKET_SIZE = 50
+# Pairs seen in fewer orders are noise
+MIN_SUPPORT = 2
+MIN_CONFIDENCE = 0.01
+SETTLE_AFTER = timedelta(minutes=10)
+STATE_FILE = 'bought_together.npz'
+
+
+def state_path():
+    return Path(settings.VAR_ROOT, STATE_FILE)
+
+
+class CoPurchaseCounts:
+    """
+    `baskets` is an order x product matrix of the products counted for each
+    order (by id), `counted_until` the timestamp of the last order change
+    counted.
+    """
+
+    def __init__(self, pairs=None, item_counts=None, order_count=0, counted_until=0.0,
+                 baskets=None):
+        self.pairs = pairs if pairs is not None else sparse.csr_matrix((1, 1), dtype=np.int64)
+        self.item_counts = item_counts if item_counts is not None else np.zeros(1, dtype=np.int64)
+        self.order_count = order_count
+        self.counted_until = counted_until
+        self.baskets = baskets if baskets is not None else sparse.csr_matrix(
+            (1, self.pairs.shape[0]), dtype=np.int8)
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or state_path()
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as state:
+            if 'counted_until' not in state:
+                # Written before the baskets were kept, counted again from scratch
+                return cls()
+            pairs = sparse.csr_matrix(
+                (state['data'], state['indices'], state['indptr']), shape=tuple(state['shape']))
+            baskets = sparse.csr_matrix(
+                (np.ones(len(state['basket_indices']), dtype=np.int8),
+                 state['basket_indices'], state['basket_indptr']),
+                shape=tuple(state['basket_shape']))
+            return cls(pairs, state['item_counts'], int(state['order_count']),
+                       float(state['counted_until']), baskets)
+
+    def save(self, path=None):
+        path = Path(path or state_path())
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so a crash never leaves a half written file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(
+                f, data=self.pairs.data, indices=self.pairs.indices, indptr=self.pairs.indptr,
+                shape=np.array(self.pairs.shape), item_counts=self.item_counts,
+                order_count=self.order_count, counted_until=self.counted_until,
+                basket_indices=self.baskets.indices, basket_indptr=self.baskets.indptr,
+                basket_shape=np.array(self.baskets.shape))
+        os.replace(tmp, path)
+
+    def resize(self, size, order_count=0):
+        if size > self.pairs.shape[0]:
+            self.pairs.resize((size, size))
+            self.item_counts = np.concatenate(
+                [self.item_counts, np.zeros(size - len(self.item_counts), dtype=np.int64)])
+        self.baskets.resize((max(order_count, self.baskets.shape[0]), self.pairs.shape[0]))
+
+    def counted_basket(self, order_id):
+        if order_id >= self.baskets.shape[0]:
+            return []
+        start, end = self.baskets.indptr[order_id:order_id + 2]
+        return self.baskets.indices[start:end].tolist()
+
+    def counted_orders(self):
+        return np.flatnonzero(np.diff(self.baskets.indptr)).tolist()
+
+    def recount(self, baskets):
+        """
+        Counts a chunk of changed orders, `baskets` maps each order id to its
+        distinct product ids (none for an order that no longer counts), in
+        place of what was counted for them before. Returns the product ids
+        whose counts changed.
+        """
+        old = [basket for basket in map(self.counted_basket, baskets) if basket]
+        new = [basket for basket in baskets.values() if basket]
+        touched = self.count_baskets(old, -1) | self.count_baskets(new, 1)
+
+        order_ids = np.fromiter(baskets, dtype=np.int64)
+        self.resize(self.pairs.shape[0], int(order_ids.max()) + 1)
+        if old:
+            keep = np.ones(self.baskets.shape[0], dtype=np.int8)
+            keep[order_ids] = 0
+            self.baskets = (sparse.diags(keep, dtype=np.int8) @ self.baskets).tocsr()
+            self.baskets.eliminate_zeros()
+        rows = np.repeat(order_ids, [len(basket) for basket in baskets.values()])
+        cols = np.fromiter((pk for basket in baskets.values() for pk in basket), dtype=np.int64)
+        self.baskets = self.baskets + sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=self.baskets.shape)
+        return touched
+
+    def count_baskets(self, baskets, sign):
+        """Adds (sign 1) or subtracts (sign -1) orders, each a list of distinct product ids."""
+        rows, cols, items = [], [], []
+        for basket in baskets:
+            basket = np.asarray(basket, dtype=np.int64)
+            items.append(basket)
+            if 1 < len(basket) <= MAX_BASKET_SIZE:
+                a, b = np.meshgrid(basket, basket)
+                mask = a != b
+                rows.append(a[mask])
+                cols.append(b[mask])
+        if not items:
+            return set()
+        items = np.concatenate(items)
+        self.resize(int(items.max()) + 1)
+        np.add.at(self.item_counts, items, sign)
+        self.order_count += sign * len(baskets)
+        if rows:
+            rows, cols = np.concatenate(rows), np.concatenate(cols)
+            size = self.pairs.shape[0]
+            # Duplicate pairs are summed by the conversion
+            self.pairs = self.pairs + sparse.coo_matrix(
+                (np.full(len(rows), sign, dtype=np.int64), (rows, cols)), shape=(size, size)).tocsr()
+            self.pairs.eliminate_zeros()
+        return set(items.tolist())
+
+    def forget(self, product_ids):
+        """Drops the counts of products that no longer exist."""
+        if not len(product_ids):
+            return
+        keep = np.ones(self.pairs.shape[0], dtype=np.int64)
+        keep[product_ids] = 0
+        self.item_counts[product_ids] = 0
+        keep = sparse.diags(keep, dtype=np.int64)
+        self.pairs = (keep @ self.pairs @ keep).tocsr()
+        self.pairs.eliminate_zeros()
+        self.baskets = (self.baskets @ keep).astype(np.int8).tocsr()
+        self.baskets.eliminate_zeros()
+
+    def neighbours(self, product_ids, k=TOP_K):
+        """
+        Yields (product id, [(product id, score), ...]) best first.
+
+        The score is the confidence (share of the product's orders that also
+        contain the other one) weighted by the log of the lift, which keeps
+        best sellers from being everyone's top pair.
+        """
+        for pk in product_ids:
+            if pk >= self.pairs.shape[0] or not self.item_counts[pk]:
+                yield pk, []
+                continue
+            row = self.pairs.getrow(pk)
+            support = row.data
+            others = row.indices
+            confidence = support / self.item_counts[pk]
+            lift = support * self.order_count / (self.item_counts[pk] * self.item_counts[others])
+            keep = (support >= MIN_SUPPORT) & (confidence >= MIN_CONFIDENCE) & (lift > 1)
+            scores = confidence[keep] * np.log(lift[keep])
+            others = others[keep]
+            best = np.argsort(-scores, kind='stable')[:k]
+            yield pk, [(int(others[i]), float(scores[i])) for i in best
+                       if math.isfinite(scores[i])]
+
+
+def iter_changed_baskets(after, until):
+    """
+    Yields chunks of {order id: distinct product ids} for the orders last
+    changed in (after, until], with no products for cancelled ones.
+    """
+    orders = Order.objects.filter(updated_at__gt=after, updated_at__lte=until).order_by('id')
+    cursor = 0
+    while True:
+        rows = list(orders.filter(id__gt=cursor).values_list('id', 'status')[:ORDER_CHUNK_SIZE])
+        if not rows:
+            return
+        cursor = rows[-1][0]
+        baskets = {order_id: set() for order_id, status in rows}
+        live = [order_id for order_id, status in rows if status != 'cancelled']
+        for order_id, product_id in OrderItem.objects.filter(
+                order_id__in=live).values_list('order_id', 'product_id').iterator():
+            baskets[order_id].add(product_id)
+        yield {order_id: sorted(basket) for order_id, basket in baskets.items()}
+
+
+def build_bought_together(full=False):
+    """
+    Counts the orders changed since the last run and rewrites the
+    recommendations of the products in them. Returns the number of
+    products written.
+    """
+    built_at = timezone.now()
+    until = built_at - SETTLE_AFTER
+    counts = CoPurchaseCounts() if full else CoPurchaseCounts.load()
+    touched = set()
+    after = datetime.fromtimestamp(counts.counted_until, dt_timezone.utc)
+    for baskets in iter_changed_baskets(after, until):
+        touched |= counts.recount(baskets)
+    counts.counted_until = until.timestamp()
+
+    # Orders deleted after they were counted
+    existing = set(Order.objects.values_list('pk', flat=True).iterator())
+    deleted = [pk for pk in counts.counted_orders() if pk not in existing]
+    if deleted:
+        touched |= counts.recount(dict.fromkeys(deleted, []))
+
+    # Products deleted after their orders were counted
+    existing = set(Product.objects.values_list('pk', flat=True).iterator())
+    counted = np.flatnonzero(counts.item_counts)
+    counts.forget(counted[[pk not in existing for pk in counted.tolist()]])
+
+    if full:
+        ProductRecommendation.objects.filter(
+            kind=ProductRecommendation.BOUGHT_TOGETHER).delete()
+        touched = set(np.flatnonzero(counts.item_counts).tolist())
+    stored = ProductRecommendation.store(
+        ProductRecommendation.BOUGHT_TOGETHER,
+        counts.neighbours(sorted(touched)), built_at)
+    counts.save()
+    return stored
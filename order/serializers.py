@@ -159,6 +159,11 @@ class OrderItemSmallSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['product_id', 'product_name', 'product_slug', 'product_thumbnail_image', 'product_price',
                   'quantity', 'price', 'total_price', 'color', 'size']
+        method_field_sources = {
+            'product_thumbnail_image': 'product.thumbnail_image',
+            'total_price': ['price', 'quantity'],
+            'size': 'size.name',
+        }
 
     def get_total_price(self, obj):
         return obj.total_price
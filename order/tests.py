@@ -1,3 +1,101 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import User
+from products.models import Product, ProductRecommendation
+from .models import Order, OrderItem
+from . import recommendations
+from .recommendations import CoPurchaseCounts, build_bought_together
+
+
+class BoughtTogetherTests(TestCase):
+    def setUp(self):
+        var_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, var_root, ignore_errors=True)
+        settings_override = override_settings(VAR_ROOT=var_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.a, self.b, self.c, self.d = [
+            Product.objects.create(name=name, price=10) for name in 'ABCD']
+        # Counted right away unless a test says otherwise
+        settle = mock.patch.object(recommendations, 'SETTLE_AFTER', timedelta(0))
+        settle.start()
+        self.addCleanup(settle.stop)
+
+    def order(self, *products):
+        order = Order.objects.create(
+            user=self.user, full_name='Buyer', shipping_address='Street',
+            phone_number='1', total_amount=10)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, price=10)
+        return order
+
+    def recommended(self, product):
+        return list(ProductRecommendation.objects.filter(
+            product=product, kind=ProductRecommendation.BOUGHT_TOGETHER,
+        ).order_by('rank').values_list('recommended_id', flat=True))
+
+    def test_incremental_run_skips_products_deleted_since_they_were_counted(self):
+        for _ in range(3):
+            self.order(self.a, self.b)
+        self.order(self.d)
+        self.order(self.d)
+        build_bought_together()
+        self.assertEqual(self.recommended(self.a), [self.b.pk])
+
+        self.b.delete()
+        self.order(self.a, self.c)
+        build_bought_together()
+        self.assertEqual(self.recommended(self.a), [])
+
+        # The state moved on, the next run only counts new orders
+        self.order(self.a, self.c)
+        build_bought_together()
+        self.assertEqual(self.recommended(self.a), [self.c.pk])
+
+    def test_orders_are_counted_once_settled(self):
+        orders = [self.order(self.a, self.b) for _ in range(3)]
+        self.order(self.d)
+        with mock.patch.object(recommendations, 'SETTLE_AFTER', timedelta(minutes=10)):
+            build_bought_together()
+            self.assertEqual(self.recommended(self.a), [])
+            Order.objects.filter(pk__in=[order.pk for order in orders]).update(
+                updated_at=timezone.now() - timedelta(minutes=5))
+            build_bought_together()
+            self.assertEqual(self.recommended(self.a), [])
+        build_bought_together()
+        self.assertEqual(self.recommended(self.a), [self.b.pk])
+
+    def test_changed_orders_are_recounted_like_a_full_run(self):
+        orders = [self.order(self.a, self.b) for _ in range(4)]
+        self.order(self.c, self.d)
+        self.order(self.c, self.d)
+        build_bought_together()
+        self.assertEqual(self.recommended(self.a), [self.b.pk])
+
+        orders[0].status = 'cancelled'
+        orders[0].save()
+        orders[1].delete()
+        # Items replaced like OrderSerializer.update does
+        orders[2].items.all().delete()
+        OrderItem.objects.create(order=orders[2], product=self.c, price=10)
+        OrderItem.objects.create(order=orders[2], product=self.d, price=10)
+        orders[2].save()
+        build_bought_together()
+        self.assertEqual(self.recommended(self.a), [])
+        self.assertEqual(self.recommended(self.c), [self.d.pk])
+        incremental = CoPurchaseCounts.load()
+
+        build_bought_together(full=True)
+        full = CoPurchaseCounts.load()
+        self.assertEqual(incremental.order_count, full.order_count)
+        self.assertEqual(incremental.item_counts.tolist(), full.item_counts.tolist())
+        self.assertTrue(np.array_equal(incremental.pairs.toarray(), full.pairs.toarray()))
+        self.assertEqual(incremental.counted_orders(), full.counted_orders())
@@ -14,7 +14,7 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters as rest_filters
 from django.utils import timezone
 from django.db import models
-from django.db.models import Prefetch
+from ecommerce.queryset_optimizer import OptimizedQuerysetMixin, optimize_queryset
 # Create your views here.
 
 
@@ -45,41 +45,8 @@ class OrderFilter(django_filters.FilterSet):
                   'status', 'date_gte', 'date_lte']
 
 
-class OrderView(ListCreateAPIView):
-    queryset = Order.objects.prefetch_related(
-        Prefetch(
-            'items',
-            queryset=OrderItem.objects.select_related(
-                'product',  # For product_id, product_name, product_slug, product_price
-                'size'     # For size field
-            ).only(
-                'product__id',
-                'product__name',
-                'product__slug',
-                'product__price',
-                'product__thumbnail_image',
-                'quantity',
-                'price',
-                'color',
-                'size__name'
-            )
-        )
-    ).only(
-        'id',
-        'full_name',
-        'order_number',
-        'status',
-        'shipping_address',
-        'city',
-        'state',
-        'zip_code',
-        'phone_number',
-        'email',
-        'total_amount',
-        'delivery_fee',
-        'created_at',
-        'updated_at'
-    ).order_by('-created_at')
+class OrderView(OptimizedQuerysetMixin, ListCreateAPIView):
+    queryset = Order.objects.order_by('-created_at')
 
     serializer_class = OrderSmallSerializer
     filter_backends = [DjangoFilterBackend,
@@ -102,7 +69,10 @@ class OrderDetailView(APIView):
 
     def get_object(self, order_number):
         try:
-            return Order.objects.get(order_number=order_number)
+            queryset = Order.objects.all()
+            if self.request.method == 'GET':
+                queryset = optimize_queryset(queryset, OrderSerializer)
+            return queryset.get(order_number=order_number)
         except Order.DoesNotExist:
             return None
 
@@ -174,7 +144,7 @@ class MyOrderFilter(django_filters.FilterSet):
         fields = ['order_number', 'date_gte', 'date_lte', 'status']
 
 
-class MyOrderView(ListAPIView):
+class MyOrderView(OptimizedQuerysetMixin, ListAPIView):
     permission_classes = [IsAuthenticated]
     pagination_class = CustomPagination
     filter_backends = [DjangoFilterBackend,
@@ -184,40 +154,7 @@ class MyOrderView(ListAPIView):
     serializer_class = OrderSmallSerializer
 
     def get_queryset(self):
-        return Order.objects.prefetch_related(
-            Prefetch(
-                'items',
-                queryset=OrderItem.objects.select_related(
-                    'product',  # For product_id, product_name, product_slug, product_price
-                    'size'     # For size field
-                ).only(
-                    'product__id',
-                    'product__name',
-                    'product__slug',
-                    'product__price',
-                    'product__thumbnail_image',
-                    'quantity',
-                    'price',
-                    'color',
-                    'size__name'
-                )
-            )
-        ).only(
-            'id',
-            'full_name',
-            'order_number',
-            'status',
-            'shipping_address',
-            'city',
-            'state',
-            'zip_code',
-            'phone_number',
-            'email',
-            'total_amount',
-            'delivery_fee',
-            'created_at',
-            'updated_at'
-        ).filter(user=self.request.user)
+        return Order.objects.filter(user=self.request.user)
 
 
 class MyOrderStatusView(APIView):
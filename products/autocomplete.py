@@ -0,0 +1,405 @@
+"""
+In-process prefix index for the search box.
+
+Product, category, subcategory and subsubcategory names are kept in sorted
+arrays (whole names and distinct words) so a prefix lookup is a bisect plus
+a short scan. Prefixes of 3-5 letters are also stored with one letter
+deleted (symmetric delete), which finds names one typo away from the query.
+
+Each process keeps its own copy. The save/delete signals publish their
+changes as numbered deltas in the shared cache, and every process applies
+the deltas it hasn't seen yet. A process only rebuilds from the database
+when it starts or has missed deltas (evicted, or too far behind), and then
+in the background while the old copy keeps answering.
+"""
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 50000
+MAX_SCAN = 2000
+MEMO_SIZE = 1024
+TYPO_PREFIX_LENGTHS = range(3, 6)
+SEQUENCE_KEY = 'autocomplete:sequence'
+DELTA_KEY = 'autocomplete:delta:{}'
+DELTA_TIMEOUT = 24 * 60 * 60
+# Further behind than this, rebuilding is cheaper than catching up
+MAX_DELTAS = 500
+# How long a delta missing from the cache may just not be written yet
+DELTA_WAIT = 10.0
+SYNC_INTERVAL = 1.0
+# Categories first for the same match quality
+KIND_PRIORITY = {'category': 0, 'subcategory': 1, 'subsubcategory': 2, 'product': 3}
+
+
+def normalize(text):
+    text = text or ''
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return text.lower()
+
+
+def tokenize(text):
+    return re.findall(r'\w+', normalize(text))
+
+
+def deletes(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def typo_keys(word):
+    keys = set()
+    for length in TYPO_PREFIX_LENGTHS:
+        if len(word) >= length:
+            keys.update(deletes(word[:length]))
+    return keys
+
+
+class Entry:
+    __slots__ = ('key', 'kind', 'name', 'slug', 'parent_id', 'words', 'text', 'rank')
+
+    def __init__(self, kind, pk, name, slug, parent_id=None, weight=0):
+        self.key = (kind, pk)
+        self.kind = kind
+        self.name = name
+        self.slug = slug
+        self.parent_id = parent_id
+        self.words = tokenize(name)
+        self.text = ' '.join(self.words)
+        # Order among equally good matches, the key keeps it total
+        self.rank = (KIND_PRIORITY[kind], -weight, len(name), self.key)
+
+
+class PrefixIndex:
+    """
+    `names` is sorted on the whole normalized name for "starts with the
+    query" matches. `words` holds the distinct words, sorted, and `postings`
+    maps each word to its entries sorted by rank, so a word prefix lookup
+    only merges the heads of the matching postings. `typos` maps the
+    deletion keys to the words they come from.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self.clear()
+
+    @classmethod
+    def from_entries(cls, entries, max_entries=MAX_ENTRIES):
+        """Builds an index from entries in priority order, sorting each array once."""
+        index = cls(max_entries)
+        for entry in entries:
+            if len(index.entries) >= max_entries:
+                break
+            index.entries[entry.key] = entry
+        postings = defaultdict(list)
+        for entry in index.entries.values():
+            for word in set(entry.words):
+                postings[word].append(entry.rank)
+        for word, posting in postings.items():
+            posting.sort()
+            for key in typo_keys(word):
+                index.typos[key].add(word)
+        index.names = sorted((entry.text, entry.rank) for entry in index.entries.values())
+        index.postings = dict(postings)
+        index.words = sorted(index.postings)
+        return index
+
+    def clear(self):
+        self.entries = {}
+        self.names = []
+        self.words = []
+        self.postings = {}
+        self.typos = defaultdict(set)
+        self.memo = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry):
+        with self.lock:
+            if entry.key in self.entries:
+                self.remove(entry.key)
+            elif len(self.entries) >= self.max_entries:
+                return False
+            self.entries[entry.key] = entry
+            insort(self.names, (entry.text, entry.rank))
+            for word in set(entry.words):
+                if word not in self.postings:
+                    self.postings[word] = []
+                    insort(self.words, word)
+                    for key in typo_keys(word):
+                        self.typos[key].add(word)
+                insort(self.postings[word], entry.rank)
+            self.memo.clear()
+            return True
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            remove_sorted(self.names, (entry.text, entry.rank))
+            for word in set(entry.words):
+                posting = self.postings[word]
+                remove_sorted(posting, entry.rank)
+                if not posting:
+                    del self.postings[word]
+                    remove_sorted(self.words, word)
+                    for typo in typo_keys(word):
+                        words = self.typos.get(typo)
+                        if words is not None:
+                            words.discard(word)
+                            if not words:
+                                del self.typos[typo]
+            self.memo.clear()
+
+    def apply(self, changes):
+        """Applies a delta, a list of ('add', Entry) and ('remove', key)."""
+        with self.lock:
+            for action, value in changes:
+                if action == 'add':
+                    self.add(value)
+                else:
+                    self.remove(value)
+
+    def name_matches(self, text):
+        i = bisect_left(self.names, (text,))
+        ranks = []
+        for name, rank in self.names[i:i + MAX_SCAN]:
+            if not name.startswith(text):
+                break
+            ranks.append(rank)
+        ranks.sort()
+        for rank in ranks:
+            yield self.entries[rank[-1]]
+
+    def word_matches(self, prefix):
+        i = bisect_left(self.words, prefix)
+        postings = []
+        for word in self.words[i:i + MAX_SCAN]:
+            if not word.startswith(prefix):
+                break
+            postings.append(self.postings[word])
+        for rank in heapq.merge(*postings):
+            yield self.entries[rank[-1]]
+
+    def typo_matches(self, word):
+        words = set()
+        prefix = word[:TYPO_PREFIX_LENGTHS[-1]]
+        for variant in deletes(prefix) | {prefix}:
+            words.update(self.typos.get(variant, ()))
+        ranks = sorted({rank for word in words for rank in self.postings[word]})
+        for rank in ranks:
+            yield self.entries[rank[-1]]
+
+    def search(self, query, limit=8):
+        words = tokenize(query)
+        if not words:
+            return []
+        memo_key = (tuple(words), limit)
+        with self.lock:
+            if memo_key in self.memo:
+                return self.memo[memo_key]
+            *leading, last = words
+            # Whole name prefix, then word prefix, then one typo away
+            candidates = [self.name_matches(' '.join(words)),
+                          self.word_matches(last)]
+            if len(last) >= TYPO_PREFIX_LENGTHS[0]:
+                candidates.append(self.typo_matches(last))
+            results = []
+            seen = set()
+            for entry in itertools.chain(*candidates):
+                if entry.key in seen:
+                    continue
+                seen.add(entry.key)
+                # The other words have to start some word of the name
+                if not all(any(word.startswith(lead) for word in entry.words)
+                           for lead in leading):
+                    continue
+                results.append(self.serialize(entry))
+                if len(results) >= limit:
+                    break
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo.clear()
+            self.memo[memo_key] = results
+            return results
+
+    def serialize(self, entry):
+        result = {'type': entry.kind, 'name': entry.name, 'slug': entry.slug}
+        if entry.kind == 'product':
+            # Product urls go through the subsubcategory slug
+            parent = self.entries.get(('subsubcategory', entry.parent_id))
+            result['subsubcategory_slug'] = parent.slug if parent else None
+        return result
+
+
+def remove_sorted(items, item):
+    i = bisect_left(items, item)
+    if i < len(items) and items[i] == item:
+        del items[i]
+
+
+def category_entry(category):
+    return Entry('category', category.pk, category.name, category.slug)
+
+
+def subcategory_entry(subcategory):
+    return Entry('subcategory', subcategory.pk, subcategory.name, subcategory.slug)
+
+
+def subsubcategory_entry(subsubcategory):
+    return Entry('subsubcategory', subsubcategory.pk, subsubcategory.name, subsubcategory.slug)
+
+
+def product_entry(product):
+    weight = int(product.is_popular) + int(product.is_featured)
+    return Entry('product', product.pk, product.name, product.slug,
+                 parent_id=product.subsubcategory_id, weight=weight)
+
+
+_index = PrefixIndex()
+# The last delta applied to _index, None until it is first built
+_state = {'sequence': None, 'checked_at': 0.0, 'missing_since': None, 'building': False}
+_sync_lock = threading.Lock()
+
+
+def build_index():
+    from .models import Product, ProductCategory, ProductSubCategory, ProductSubSubCategory
+
+    def entries():
+        for kind, model in (('category', ProductCategory),
+                            ('subcategory', ProductSubCategory),
+                            ('subsubcategory', ProductSubSubCategory)):
+            for pk, name, slug in model.objects.values_list('pk', 'name', 'slug').iterator():
+                yield Entry(kind, pk, name, slug)
+        # Over the cap, keep the products most likely to be searched for
+        products = Product.objects.filter(is_active=True).order_by(
+            '-is_popular', '-is_featured', '-created_at'
+        ).values_list('pk', 'name', 'slug', 'subsubcategory_id', 'is_popular', 'is_featured')
+        for pk, name, slug, parent_id, is_popular, is_featured in products.iterator():
+            yield Entry('product', pk, name, slug, parent_id=parent_id,
+                        weight=int(is_popular) + int(is_featured))
+
+    return PrefixIndex.from_entries(entries())
+
+
+def current_sequence():
+    sequence = cache.get(SEQUENCE_KEY)
+    if sequence is None:
+        cache.add(SEQUENCE_KEY, 0, None)
+        sequence = cache.get(SEQUENCE_KEY, 0)
+    return sequence
+
+
+def rebuild_in_background():
+    global _index
+    try:
+        # Read first, the deltas published while we build are applied after
+        sequence = current_sequence()
+        index = build_index()
+        with _sync_lock:
+            _index = index
+            _state.update(sequence=sequence, missing_since=None, checked_at=0.0)
+    except Exception:
+        logger.exception('Rebuilding the autocomplete index failed')
+    finally:
+        _state['building'] = False
+        connection.close()
+
+
+def start_rebuild():
+    if not _state['building']:
+        _state['building'] = True
+        threading.Thread(target=rebuild_in_background, daemon=True).start()
+
+
+def catch_up(sequence, now):
+    applied = _state['sequence']
+    if sequence < applied or sequence - applied > MAX_DELTAS:
+        # The cache was cleared, or we are too far behind
+        start_rebuild()
+        return
+    keys = [DELTA_KEY.format(number) for number in range(applied + 1, sequence + 1)]
+    deltas = cache.get_many(keys)
+    for number, key in enumerate(keys, applied + 1):
+        if key not in deltas:
+            # Published right after the sequence was bumped, or evicted
+            if _state['missing_since'] is None:
+                _state['missing_since'] = now
+            elif now - _state['missing_since'] >= DELTA_WAIT:
+                start_rebuild()
+            return
+        _index.apply(deltas[key])
+        _state.update(sequence=number, missing_since=None)
+
+
+def get_index():
+    """Returns this process's index, brought up to date with the other processes' changes."""
+    global _index
+    now = time.monotonic()
+    if now - _state['checked_at'] < SYNC_INTERVAL:
+        return _index
+    # Until the first build everyone waits for it, after that one thread syncs
+    if not _sync_lock.acquire(blocking=_state['sequence'] is None):
+        return _index
+    try:
+        if now - _state['checked_at'] >= SYNC_INTERVAL:
+            _state['checked_at'] = now
+            sequence = current_sequence()
+            if _state['sequence'] is None:
+                _index = build_index()
+                _state['sequence'] = sequence
+            elif sequence != _state['sequence']:
+                catch_up(sequence, now)
+    finally:
+        _sync_lock.release()
+    return _index
+
+
+def publish(changes):
+    """Queues a delta for every process (this one included) once the transaction commits."""
+    def run():
+        cache.add(SEQUENCE_KEY, 0, None)
+        cache.set(DELTA_KEY.format(cache.incr(SEQUENCE_KEY)), changes, DELTA_TIMEOUT)
+        # Our own change shows up on the next lookup
+        _state['checked_at'] = 0.0
+    if changes:
+        transaction.on_commit(run)
+
+
+def index_entry(entry):
+    publish([('add', entry)])
+
+
+def index_entries(entries):
+    publish([('add', entry) for entry in entries])
+
+
+def unindex_entry(kind, pk):
+    publish([('remove', (kind, pk))])
+
+
+def index_product(product):
+    if product.is_active:
+        index_entry(product_entry(product))
+    else:
+        unindex_entry('product', product.pk)
+
+
+def index_products(products):
+    publish([('add', product_entry(product)) if product.is_active
+             else ('remove', ('product', product.pk)) for product in products])
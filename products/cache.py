@@ -0,0 +1,189 @@
+import hashlib
+import time
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+from .models import Wishlist
+
+WISHLIST_CACHE_TIMEOUT = 60 * 60
+RESPONSE_CACHE_TIMEOUT = 60 * 15
+DOWNLOAD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def wishlist_cache_key(user_id):
+    return f'wishlist:product-ids:{user_id}'
+
+
+def get_wishlisted_product_ids(user):
+    """Returns the set of product ids in the user's wishlist, cached per user."""
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    key = wishlist_cache_key(user.pk)
+    product_ids = cache.get(key)
+    if product_ids is None:
+        product_ids = frozenset(
+            Wishlist.objects.filter(user=user).values_list('product_id', flat=True))
+        cache.set(key, product_ids, WISHLIST_CACHE_TIMEOUT)
+    return product_ids
+
+
+def invalidate_wishlisted_product_ids(user):
+    if user is not None and user.is_authenticated:
+        cache.delete(wishlist_cache_key(user.pk))
+
+
+# Tagged response cache
+#
+# Every tag has a random version token in the cache. A cached response keeps
+# the versions of its tags at the time it was built and is only served while
+# they are all unchanged, so invalidating a tag is a single write no matter
+# how many responses carry it. A tag evicted from the cache gets a new token,
+# which only costs a miss.
+
+def tag_key(tag):
+    return f'cache-tag:{tag}'
+
+
+def get_tag_versions(tags):
+    keys = {tag_key(tag): tag for tag in tags}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, uuid.uuid4().hex, None)
+        versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def invalidate_tags(*tags):
+    """Bumps the tags once the current transaction commits."""
+    tags = {tag for tag in tags if tag}
+    if tags:
+        transaction.on_commit(lambda: cache.set_many(
+            {tag_key(tag): uuid.uuid4().hex for tag in tags}, None))
+
+
+def response_cache_key(request):
+    # Query parameters are sorted so ?a=1&b=2 and ?b=2&a=1 share an entry
+    query = sorted((key, request.query_params.getlist(key))
+                   for key in request.query_params)
+    raw = f'{request.get_host()}{request.path}?{query}'
+    return f'response:{hashlib.md5(raw.encode()).hexdigest()}'
+
+
+class CachedListMixin:
+    """
+    Caches the rendered JSON of list GETs (or any `cached_response()`),
+    invalidated through tags.
+
+    `cache_collection_tags` are tags for the listing as a whole (anything
+    that may add, remove or reorder rows), `get_cache_tags()` adds tags for
+    the objects on the page. Views whose output depends on the user set
+    `cache_anonymous_only`.
+
+    Tag versions are read before building, so a change committed while
+    the response is built leaves it stale in the cache rather than fresh.
+    The objects' tags are only known after building: those of the last
+    build of the same response stand in for them, and an object tag that
+    wasn't among them makes the entry unusable until the next build.
+    """
+    cache_timeout = RESPONSE_CACHE_TIMEOUT
+    cache_collection_tags = ()
+    cache_anonymous_only = False
+
+    def get_cache_collection_tags(self):
+        return set(self.cache_collection_tags)
+
+    def get_cache_tags(self, objects):
+        return set()
+
+    def is_response_cacheable(self, request):
+        if request.accepted_renderer.format != 'json':
+            return False
+        return not (self.cache_anonymous_only and request.user.is_authenticated)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, lambda: super(CachedListMixin, self).list(request, *args, **kwargs))
+
+    def cached_response(self, request, build):
+        """Serves `build()`'s response from the cache while its tags are unchanged."""
+        if not self.is_response_cacheable(request):
+            return build()
+
+        key = response_cache_key(request)
+        entry = cache.get(key)
+        versions = get_tag_versions(entry['tags']) if entry is not None else {}
+        if entry is not None and versions == entry['tags']:
+            return self.cached_content_response(request, entry, 'HIT')
+
+        # Read before querying so a change made while we build is not hidden
+        versions.update(get_tag_versions(self.get_cache_collection_tags() - versions.keys()))
+        self._cached_objects = None
+        response = build()
+        if response.status_code != 200:
+            return response
+        # No version from before the build, never matches
+        versions.update(dict.fromkeys(
+            self.get_cache_tags(self._cached_objects or []) - versions.keys()))
+
+        renderer = request.accepted_renderer
+        content_type = f'{request.accepted_media_type}; charset={renderer.charset}' \
+            if renderer.charset else request.accepted_media_type
+        content = renderer.render(response.data, request.accepted_media_type, {
+            'view': self, 'request': request, 'response': response})
+        entry = {
+            'tags': versions,
+            'content': content,
+            'content_type': content_type,
+            'etag': f'"{hashlib.md5(content).hexdigest()}"',
+        }
+        cache.set(key, entry, self.cache_timeout)
+        return self.cached_content_response(request, entry, 'MISS')
+
+    def cached_content_response(self, request, entry, status):
+        if entry['etag'] in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                entry['content'], content_type=entry['content_type'])
+        response['ETag'] = entry['etag']
+        response['X-Cache'] = status
+        return response
+
+    def get_serializer(self, *args, **kwargs):
+        # Remember the page (or the whole list) being serialized for tagging
+        if args and getattr(self, '_cached_objects', False) is None:
+            self._cached_objects = args[0]
+        return super().get_serializer(*args, **kwargs)
+
+
+def cached_download(request, name, tags, build, content_type, timeout=DOWNLOAD_CACHE_TIMEOUT):
+    """
+    Serves the bytes `build()` returns as the attachment `name`, cached
+    under the current versions of `tags` so changing any of them means a
+    new file. The ETag is made from those versions too (a rebuilt workbook
+    isn't byte for byte the same), so a repeat download gets a 304.
+    """
+    versions = get_tag_versions(tags)
+    digest = hashlib.md5(repr(sorted(versions.items())).encode()).hexdigest()
+    key = f'download:{name}:{digest}'
+    entry = cache.get(key)
+    status = 'HIT'
+    if entry is None:
+        entry = {'content': build(), 'last_modified': int(time.time())}
+        cache.set(key, entry, timeout)
+        status = 'MISS'
+
+    etag = f'"{digest}"'
+    response = get_conditional_response(
+        request, etag=etag, last_modified=entry['last_modified'])
+    if response is None:
+        response = HttpResponse(entry['content'], content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{name}"'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    response['X-Cache'] = status
+    return response
@@ -0,0 +1,130 @@
+"""
+Full catalog export in the layout the product import reads, so an export
+can be edited and imported again (in sync mode that only touches the rows
+that changed).
+
+Products are read a page at a time as plain values, with one query each
+for the page's sizes and images, and written out as they are read: CSV goes straight to the
+response, XLSX is written by a write_only workbook (rows go to a temporary
+file, not memory) and streamed once it is saved.
+"""
+import csv
+import tempfile
+from collections import defaultdict
+
+from openpyxl import Workbook
+
+from .importer import is_bundle_ref
+from .models import Product, ProductImage
+
+# Products read per query
+EXPORT_CHUNK_SIZE = 2000
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# The columns of the import template, one row per image of a product with
+# the product's own columns only on its first row
+PRODUCT_COLUMNS = [
+    'Product Name', 'Category', 'Sub Category', 'Sub Sub Category', 'Price', 'Market Price', 'Discount',
+    'Product Stock', 'Is popular', 'Is featured', 'Description', 'Highlight Description', 'Extra Description', 'Specifications', 'Meta Title', 'Meta Description',
+    'Size', 'Thumbnail image', 'Thumbnail Image Alt Description',
+]
+IMAGE_COLUMNS = ['Color', 'Stock (Color)', 'Images', 'Image Alt Description']
+EXPORT_COLUMNS = PRODUCT_COLUMNS + IMAGE_COLUMNS
+
+
+def image_url(source_url, name, field, absolute_uri):
+    # The URL it was imported from, so a sync of the export sees no change,
+    # bundle paths mean nothing outside their bundle though
+    if source_url and not is_bundle_ref(source_url):
+        return source_url
+    return absolute_uri(field.storage.url(name)) if name else ''
+
+
+def iter_product_pages():
+    """
+    Yields the products as pages of value tuples with their sizes and images
+    looked up per page, paging by pk so no cursor stays open while the
+    response is sent.
+    """
+    last = 0
+    while True:
+        page = list(Product.objects.filter(pk__gt=last).order_by('pk').values_list(
+            'pk', 'name', 'category__name', 'subcategory__name', 'subsubcategory__name',
+            'price', 'market_price', 'discount', 'stock', 'is_popular', 'is_featured',
+            'description', 'highlight_description', 'extra_description', 'specifications',
+            'meta_title', 'meta_description', 'thumbnail_image_source_url', 'thumbnail_image',
+            'thumbnail_image_alt_description',
+        )[:EXPORT_CHUNK_SIZE])
+        if not page:
+            return
+        last = page[-1][0]
+        ids = [row[0] for row in page]
+        sizes = defaultdict(list)
+        for product_id, name in Product.size.through.objects.filter(
+                product_id__in=ids).order_by('pk').values_list('product_id', 'size__name'):
+            sizes[product_id].append(name)
+        images = defaultdict(list)
+        for image in ProductImage.objects.filter(product_id__in=ids).order_by('pk').values_list(
+                'product_id', 'color', 'stock', 'image_source_url', 'image',
+                'image_alt_description'):
+            images[image[0]].append(image[1:])
+        yield page, sizes, images
+
+
+def iter_product_rows(absolute_uri):
+    """Yields the rows of every product, `absolute_uri` turns a media URL into a full one."""
+    thumbnail_field = Product._meta.get_field('thumbnail_image')
+    image_field = ProductImage._meta.get_field('image')
+    blank = [''] * len(PRODUCT_COLUMNS)
+    for page, sizes, images in iter_product_pages():
+        for (pk, name, category, subcategory, subsubcategory, price, market_price, discount,
+             stock, is_popular, is_featured, description, highlight_description,
+             extra_description, specifications, meta_title, meta_description,
+             thumbnail_source_url, thumbnail, thumbnail_alt) in page:
+            first = [
+                name, category or '', subcategory or '', subsubcategory or '',
+                price, market_price, discount, stock,
+                'TRUE' if is_popular else 'FALSE',
+                'TRUE' if is_featured else 'FALSE',
+                description or '', highlight_description or '', extra_description or '',
+                specifications or '', meta_title or '', meta_description or '',
+                ', '.join(sizes[pk]),
+                image_url(thumbnail_source_url, thumbnail, thumbnail_field, absolute_uri),
+                thumbnail_alt or '',
+            ]
+            if not images[pk]:
+                yield first + [''] * len(IMAGE_COLUMNS)
+                continue
+            for index, (color, image_stock, source_url, image, alt) in enumerate(images[pk]):
+                yield (first if index == 0 else blank) + [
+                    color or '', image_stock,
+                    image_url(source_url, image, image_field, absolute_uri), alt or '',
+                ]
+
+
+class Echo:
+    """A file-like csv.writer can write to, handing each line back."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    # BOM so Excel opens it as UTF-8, the import reads it the same way
+    yield '\ufeff' + writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_xlsx(rows):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Products')
+    ws.append(EXPORT_COLUMNS)
+    for row in rows:
+        ws.append(row)
+    with tempfile.TemporaryFile() as file:
+        wb.save(file)
+        file.seek(0)
+        while chunk := file.read(STREAM_CHUNK_SIZE):
+            yield chunk
@@ -0,0 +1,1192 @@
+"""
+Product imports (CSV, Excel, Google Sheets and .zip bundles of a sheet with
+its images) run as ImportJobs, and the category sheet import.
+
+The import endpoints only store the upload and create a job, the
+run_import_jobs command picks it up. Rows are streamed from the stored file
+and grouped into products on the fly, then imported a chunk of products
+per transaction and the job records how many input rows are committed, so a
+job whose worker died is picked up again and carries on after the last
+committed chunk. Images are downloaded by an ImageFetcher while the
+previous chunk is written, the ones in a bundle are read from the zip.
+
+Categories and sizes come from a CatalogCache loaded once per job, and a
+chunk's products, size links and images are inserted with one bulk_create
+per table. bulk_create sends no signals, so the search index, autocomplete,
+cached responses and image renditions are updated by products_bulk_created.
+"""
+import codecs
+import csv
+import functools
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from urllib.parse import unquote, urlsplit
+
+import openpyxl
+import pandas as pd
+import requests
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ecommerce import storage
+from .models import (
+    ImportJob, Product, ProductCategory, ProductImage, ProductSubCategory,
+    ProductSubSubCategory, Size)
+from .signals import categories_bulk_created, products_bulk_saved
+
+# Products written per transaction
+CHUNK_SIZE = 25
+DEACTIVATE_BATCH_SIZE = 500
+# Products looked up per query by a dry run
+DRY_RUN_CHUNK_SIZE = 1000
+# A running job not saved for this long lost its worker
+STALE_AFTER = timedelta(minutes=15)
+# Seconds between the saves of a running job, however long a chunk takes
+HEARTBEAT_INTERVAL = 60
+# A failed job is run again (from where it stopped) this many times in all
+MAX_ATTEMPTS = 3
+RETRY_AFTER = timedelta(minutes=5)
+# How long the file of a job that failed for good is kept
+FAILED_FILE_RETENTION = timedelta(days=7)
+
+FETCH_WORKERS = 16
+# Parallel downloads from one host, also the size of its connection pool
+FETCH_PER_HOST = 4
+# (connect, read) seconds
+FETCH_TIMEOUT = (5, 30)
+FETCH_MAX_BYTES = 15 * 1024 * 1024
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 0.5
+FETCH_CHUNK_SIZE = 64 * 1024
+
+# Image cells of a bundle name a file in the zip, by its path or its path in images/
+BUNDLE_IMAGES_DIR = 'images/'
+BUNDLE_SHEET_TYPES = ('.csv', '.xlsx', '.jsonl')
+BUNDLE_PREFIX = 'bundle:'
+
+
+class FetchedFile:
+    """A downloaded file in the fetcher's temporary directory."""
+
+    def __init__(self, url, path, size, content_type):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.content_type = content_type
+
+    @property
+    def filename(self):
+        return unquote(urlsplit(self.url).path.rsplit('/', 1)[-1])
+
+    def open(self):
+        return open(self.path, 'rb')
+
+
+class BundleFile(FetchedFile):
+    """An image of a bundle, read straight from the zip."""
+
+    def __init__(self, url, zip_file, info):
+        super().__init__(url, info.filename, info.file_size, None)
+        self.zip_file = zip_file
+
+    @property
+    def filename(self):
+        return posixpath.basename(self.path)
+
+    def open(self):
+        return self.zip_file.open(self.path)
+
+
+class ImageBundle:
+    """
+    The images of an uploaded .zip bundle. A cell naming a file of the zip
+    resolves to a reference like bundle:images/red.jpg#<crc32>, so a file
+    whose content changed is a changed image for a sync. Nothing is
+    extracted, files are read from the zip when they are stored.
+    """
+
+    def __init__(self, zip_file):
+        self.zip_file = zip_file
+        self.members = {info.filename: info for info in zip_file.infolist() if not info.is_dir()}
+
+    def resolve(self, value):
+        """The reference of the file a cell names, None if the zip has no such file."""
+        path = str(value or '').strip().replace('\\', '/')
+        if not path:
+            return None
+        path = posixpath.normpath(path).lstrip('/')
+        for name in (path, BUNDLE_IMAGES_DIR + path):
+            info = self.members.get(name)
+            if info is not None:
+                return f'{BUNDLE_PREFIX}{name}#{info.CRC:08x}'
+        return None
+
+    def get(self, url):
+        info = self.members.get(url[len(BUNDLE_PREFIX):].rsplit('#', 1)[0])
+        return BundleFile(url, self.zip_file, info) if info else None
+
+
+def is_bundle_ref(url):
+    return bool(url) and url.startswith(BUNDLE_PREFIX)
+
+
+class ImageFetcher:
+    """
+    Downloads the images of one import in parallel.
+
+    One pooled requests.Session is shared by all the workers, each host gets
+    at most FETCH_PER_HOST downloads at a time, and every URL is downloaded
+    once however many rows use it. URLs in `stored_names` already have a
+    copy in the media storage and aren't downloaded at all, and references
+    to the files of `bundle` are read from its zip. Files are streamed to a
+    temporary directory that goes away with the fetcher:
+
+        with ImageFetcher() as fetcher:
+            fetcher.prefetch(urls)
+            ...
+            fetched = fetcher.get(url)  # FetchedFile, or None if it failed
+    """
+
+    def __init__(self, max_workers=FETCH_WORKERS, per_host=FETCH_PER_HOST,
+                 timeout=FETCH_TIMEOUT, max_bytes=FETCH_MAX_BYTES, bundle=None):
+        self.bundle = bundle
+        self.per_host = per_host
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        retry = Retry(total=FETCH_RETRIES, backoff_factor=FETCH_BACKOFF,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=('GET',), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=per_host,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='image-fetcher')
+        self.directory = tempfile.mkdtemp(prefix='import-images-')
+        self.lock = threading.Lock()
+        self.host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        self.futures = {}
+        self.errors = {}
+        # url -> name of its file in the blob storage
+        self.stored_names = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.session.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def submit(self, url):
+        url = clean_url(url)
+        if not url:
+            return None
+        with self.lock:
+            future = self.futures.get(url)
+            if future is None:
+                future = self.futures[url] = self.executor.submit(self.download, url)
+        return future
+
+    def prefetch(self, urls):
+        """Starts downloading `urls` in the background."""
+        for url in urls:
+            if url not in self.stored_names:
+                self.submit(url)
+
+    def get(self, url):
+        """Waits for `url` and returns its FetchedFile, None if the download failed."""
+        if is_bundle_ref(url):
+            return self.open_bundle_file(url)
+        future = self.submit(url)
+        return future.result() if future else None
+
+    def open_bundle_file(self, url):
+        bundle_file = self.bundle.get(url) if self.bundle else None
+        if bundle_file is None:
+            self.errors[url] = 'Not in the bundle'
+        elif bundle_file.size > self.max_bytes:
+            self.errors[url] = f'{bundle_file.size} bytes is over the {self.max_bytes} byte limit'
+        else:
+            return bundle_file
+        print(f"[Image] Failed to read {url}: {self.errors[url]}")
+        return None
+
+    def download(self, url):
+        host = urlsplit(url).hostname
+        with self.lock:
+            slots = self.host_slots[host]
+        try:
+            with slots, self.session.get(url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                length = response.headers.get('Content-Length')
+                if length and length.isdigit() and int(length) > self.max_bytes:
+                    raise ValueError(f'{length} bytes is over the {self.max_bytes} byte limit')
+                fd, path = tempfile.mkstemp(dir=self.directory)
+                size = 0
+                with os.fdopen(fd, 'wb') as file:
+                    for chunk in response.iter_content(FETCH_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise ValueError(f'Over the {self.max_bytes} byte limit')
+                        file.write(chunk)
+                return FetchedFile(url, path, size, response.headers.get('Content-Type'))
+        except (requests.RequestException, ValueError, OSError) as e:
+            self.errors[url] = str(e)
+            print(f"[Image] Failed to download {url}: {e}")
+            return None
+
+
+def clean_url(url):
+    url = str(url or '').strip()
+    if urlsplit(url).scheme not in ('http', 'https'):
+        return None
+    return url
+
+
+def clean_image_ref(value, bundle=None):
+    """The URL of an image cell, or the reference of the bundle file it names."""
+    if bundle is not None:
+        ref = bundle.resolve(value)
+        if ref:
+            return ref
+    return clean_url(value)
+
+
+def is_valid_image_ref(value, bundle=None):
+    ref = clean_image_ref(value, bundle)
+    return bool(ref) and (is_bundle_ref(ref) or bool(urlsplit(ref).netloc))
+
+
+def invalid_image_cells(start, row, image_rows, bundle=None):
+    """
+    (row index, cell) of a product's image cells that are neither a URL nor,
+    with a bundle, one of its files. build_product leaves them out.
+    """
+    cells = [(start, row.get('Thumbnail image'))] + [
+        (index, image_row.get('Images')) for index, image_row in image_rows]
+    return [(index, str(value)) for index, value in cells
+            if value and not is_valid_image_ref(value, bundle)]
+
+
+def invalid_image_error(value, bundle=None):
+    if bundle is not None:
+        return f"Image {value}: not a file of the bundle or an http(s) URL"
+    return f"Image {value}: not an http(s) URL"
+
+
+def clean_name(name):
+    """Removes content within parentheses and trims spaces."""
+    return re.sub(r'\s*\(.*?\)', '', name or '').strip()
+
+
+class CatalogCache:
+    """
+    Categories, subcategories, subsubcategories and sizes by name, loaded
+    once per import so resolving a row doesn't query. Missing ones are
+    created on first use, or with `readonly` stand in as unsaved objects
+    (negative ids for sizes).
+    """
+
+    def __init__(self, readonly=False):
+        self.readonly = readonly
+        # Lowest pk wins when names are duplicated, like get() on the oldest row
+        self.categories = {
+            category.name: category
+            for category in ProductCategory.objects.order_by('-pk')}
+        self.subcategories = {
+            (subcategory.name, subcategory.category_id): subcategory
+            for subcategory in ProductSubCategory.objects.order_by('-pk')}
+        self.subsubcategories = {
+            (subsubcategory.name, subsubcategory.subcategory_id): subsubcategory
+            for subsubcategory in ProductSubSubCategory.objects.order_by('-pk')}
+        self.sizes = dict(Size.objects.order_by('-pk').values_list('name', 'pk'))
+
+    def hierarchy(self, row):
+        category_name = clean_name(row.get('Category'))
+        subcategory_name = clean_name(row.get('Sub Category'))
+        subsubcategory_name = clean_name(row.get('Sub Sub Category'))
+
+        category = self.get_or_create(
+            self.categories, category_name, ProductCategory, name=category_name)
+        subcategory = self.get_or_create(
+            self.subcategories, (subcategory_name, self.parent_key(category)),
+            ProductSubCategory, name=subcategory_name, category=category)
+        subsubcategory = self.get_or_create(
+            self.subsubcategories, (subsubcategory_name, self.parent_key(subcategory)),
+            ProductSubSubCategory, name=subsubcategory_name, subcategory=subcategory)
+        return category, subcategory, subsubcategory
+
+    def parent_key(self, parent):
+        # Unsaved (readonly) parents have no id yet
+        return parent.pk if parent.pk is not None else ('new', parent.name)
+
+    def get_or_create(self, cache, key, model, **fields):
+        obj = cache.get(key)
+        if obj is None:
+            if self.readonly:
+                obj = model(**fields)
+            else:
+                obj = model.objects.create(**fields)
+            cache[key] = obj
+        return obj
+
+    def size_names(self, size_str):
+        return list(dict.fromkeys(s.strip() for s in str(size_str or '').split(',') if s.strip()))
+
+    def size_ids(self, size_str):
+        names = self.size_names(size_str)
+        for name in names:
+            if name not in self.sizes:
+                if self.readonly:
+                    self.sizes[name] = -len(self.sizes) - 1
+                else:
+                    self.sizes[name] = Size.objects.create(name=name).pk
+        return [self.sizes[name] for name in names]
+
+
+# Fields a product row sets, the others keep their defaults
+PRODUCT_ROW_FIELDS = [
+    'name', 'slug', 'price', 'market_price', 'discount', 'stock', 'is_popular',
+    'is_featured', 'description', 'highlight_description', 'extra_description',
+    'specifications', 'meta_title', 'meta_description', 'thumbnail_image_alt_description',
+]
+IMAGE_ROW_FIELDS = ['color', 'stock', 'image_alt_description']
+# Written when a synced row changed
+PRODUCT_UPDATE_FIELDS = PRODUCT_ROW_FIELDS + [
+    'category', 'subcategory', 'subsubcategory', 'import_hash']
+THUMBNAIL_UPDATE_FIELDS = [
+    'thumbnail_image', 'thumbnail_image_srcset', 'thumbnail_image_source_url']
+IMAGE_UPDATE_FIELDS = IMAGE_ROW_FIELDS + ['import_hash', 'image_source_url']
+# Marks a synced product whose rows match what is stored
+UNCHANGED = 'unchanged'
+
+
+@functools.cache
+def excluded_fields(model, fields):
+    return [field.name for field in model._meta.fields if field.name not in fields]
+
+
+def validate_row_fields(instance, fields):
+    # Converts the values like a form would, so a bad cell fails its own row
+    # instead of the chunk's insert
+    instance.clean_fields(exclude=excluded_fields(type(instance), tuple(fields)))
+
+
+def hash_value(value):
+    # 10, "10" and "10.00" are the same price
+    if isinstance(value, Decimal):
+        return format(value.normalize(), 'f')
+    return str(value)
+
+
+def content_hash(values):
+    return hashlib.sha256(json.dumps(values, default=hash_value).encode()).hexdigest()
+
+
+class ImportedProduct:
+    """
+    A product row as an unsaved Product with its sizes and images, written
+    by write_products. For an update, product.pk is the existing product
+    and update_fields says what changed.
+    """
+
+    def __init__(self, start, product, size_ids, thumbnail_url, images):
+        self.start = start
+        self.product = product
+        self.size_ids = size_ids
+        self.thumbnail_url = thumbnail_url
+        # [(row index, unsaved ProductImage, url)] to download and create
+        self.images = images
+        self.update_fields = None
+        # Thumbnail the update replaces
+        self.stored_thumbnail = ''
+        # Existing images whose row changed but not their URL, and the ones no row matches
+        self.updated_images = []
+        self.deleted_image_ids = []
+
+
+def build_product(start, row, image_rows, hierarchy, catalog, bundle=None):
+    category, subcategory, subsubcategory = hierarchy
+    product = Product(
+        name=row.get('Product Name'),
+        slug=slugify(row.get('Product Name')),
+        price=row.get('Price') or 0,
+        market_price=row.get('Market Price') or 0,
+        discount=row.get('Discount') or 0,
+        stock=row.get('Product Stock') or 0,
+        is_popular=str(row.get('Is popular')).lower() == 'true',
+        is_featured=str(row.get('Is featured')).lower() == 'true',
+        description=row.get('Description') or '',
+        highlight_description=row.get('Highlight Description') or row.get(
+            'Product Hightlight Description') or '',
+        extra_description=row.get('Extra Description') or row.get(
+            'Product Extra Description') or '',
+        specifications=row.get('Specifications') or row.get(
+            'Product Specifications') or '',
+        meta_title=row.get('Meta Title') or row.get(
+            'Product Meta Title') or '',
+        meta_description=row.get('Meta Description') or row.get(
+            'Product Meta Description') or '',
+        thumbnail_image_alt_description=row.get(
+            'Thumbnail Image Alt Description') or '',
+        category=category,
+        subcategory=subcategory,
+        subsubcategory=subsubcategory
+    )
+    validate_row_fields(product, PRODUCT_ROW_FIELDS)
+    size_ids = catalog.size_ids(row.get('Size'))
+    thumbnail_url = clean_image_ref(row.get('Thumbnail image'), bundle)
+    # Hashed after cleaning, so 10 and "10" in a cell are the same row
+    product.import_hash = content_hash(
+        [getattr(product, name) for name in PRODUCT_ROW_FIELDS] +
+        [category.pk, subcategory.pk, subsubcategory.pk, sorted(size_ids), thumbnail_url])
+    images = []
+    for index, img_data in image_rows:
+        url = clean_image_ref(img_data.get('Images'), bundle)
+        if url is None:
+            continue
+        image = ProductImage(
+            color=img_data.get('Color', ''),
+            stock=img_data.get('Stock', 0) or img_data.get(
+                'Stock (Color)', 0) or 0,
+            image_alt_description=img_data.get(
+                'Image Alt Description', '') or img_data.get('Image Alt Description') or '',
+            image_source_url=url,
+        )
+        try:
+            validate_row_fields(image, IMAGE_ROW_FIELDS)
+        except ValidationError as e:
+            print(f"[Image] Failed for {product.name}: {e}")
+            continue
+        image.import_hash = content_hash(
+            [getattr(image, name) for name in IMAGE_ROW_FIELDS] + [url])
+        images.append((index, image, url))
+    return ImportedProduct(start, product, size_ids, thumbnail_url, images)
+
+
+def is_stored_file(url, source_url, name, field):
+    """
+    Whether `url` is where a stored file came from, or the file itself
+    (what an export writes for files that weren't imported).
+    """
+    if url == source_url:
+        return True
+    return bool(name) and urlsplit(url).path == urlsplit(field.storage.url(name)).path
+
+
+def plan_update(item, current, current_images, reactivate):
+    """
+    Turns `item` into an update of the existing product `current`, a
+    (pk, import_hash, is_active, thumbnail_image_source_url, thumbnail_image) tuple, with
+    `current_images` its images as (pk, import_hash, source url, file name).
+    Images not added by an import are kept unless a row matches them.
+    Returns False when nothing changed.
+    """
+    pk, import_hash, is_active, thumbnail_source_url, item.stored_thumbnail = current
+    product = item.product
+    product.pk = pk
+    product._state.adding = False
+
+    # Image rows are matched to the stored images by hash, then by URL so
+    # a changed color or stock doesn't download the image again
+    image_field = ProductImage._meta.get_field('image')
+    stored = defaultdict(list)
+    for stored_image in current_images:
+        stored[stored_image[1]].append(stored_image)
+    changed = []
+    for index, image, url in item.images:
+        if image.import_hash and stored.get(image.import_hash):
+            stored[image.import_hash].pop()
+        else:
+            changed.append((index, image, url))
+    leftover = [image for images in stored.values() for image in images]
+    item.images = []
+    for index, image, url in changed:
+        match = next((stored_image for stored_image in leftover
+                      if is_stored_file(url, stored_image[2], stored_image[3], image_field)), None)
+        if match is None:
+            item.images.append((index, image, url))
+            continue
+        leftover.remove(match)
+        image.pk = match[0]
+        image.product_id = pk
+        item.updated_images.append(image)
+    item.deleted_image_ids = [image_pk for image_pk, image_hash, _, _ in leftover if image_hash]
+
+    fields = []
+    if product.import_hash != import_hash:
+        fields += PRODUCT_UPDATE_FIELDS
+    if reactivate and not is_active:
+        fields.append('is_active')
+    else:
+        product.is_active = is_active
+    # Also retries a thumbnail whose download failed last time
+    if item.thumbnail_url and is_stored_file(
+            item.thumbnail_url, None, item.stored_thumbnail, Product._meta.get_field('thumbnail_image')):
+        # The exported URL of the file it already has
+        if item.thumbnail_url != thumbnail_source_url:
+            product.thumbnail_image_source_url = item.thumbnail_url
+            fields.append('thumbnail_image_source_url')
+        item.thumbnail_url = None
+    elif item.thumbnail_url and item.thumbnail_url != thumbnail_source_url:
+        fields += THUMBNAIL_UPDATE_FIELDS
+    else:
+        item.thumbnail_url = None
+    if not (fields or item.images or item.updated_images or item.deleted_image_ids):
+        return False
+    if fields:
+        # bulk_update doesn't set auto_now fields
+        product.updated_at = timezone.now()
+        fields.append('updated_at')
+    item.update_fields = fields
+    return True
+
+
+def store_fetched_file(instance, field_name, fetched, fallback_name):
+    """Stores a downloaded file in the instance's file field without saving the row."""
+    try:
+        with fetched.open() as file:
+            getattr(instance, field_name).save(
+                fetched.filename or fallback_name, File(file), save=False)
+        return True
+    except Exception as e:
+        print(f"[{field_name}] Failed for {getattr(instance, 'name', 'unknown')}: {e}")
+        return False
+
+
+def store_image(instance, field_name, url, fetcher, fallback_name):
+    """
+    Points the file field at the stored copy of `url`, downloading and
+    storing it first if there is none. Returns whether it has a file.
+    """
+    if not url:
+        return False
+    name = fetcher.stored_names.get(url)
+    if name is not None:
+        setattr(instance, field_name, name)
+        return True
+    fetched = fetcher.get(url)
+    if fetched is None or not store_fetched_file(instance, field_name, fetched, fallback_name):
+        return False
+    fetcher.stored_names[url] = getattr(instance, field_name).name
+    return True
+
+
+def store_images(item, fetcher):
+    """
+    Waits for the downloads of an imported product and stores them. Images
+    whose download failed are dropped, an update keeps its old thumbnail.
+    """
+    product = item.product
+    slug = slugify(product.name)
+    if store_image(product, 'thumbnail_image', item.thumbnail_url, fetcher, f"{slug}-thumb.jpg"):
+        product.thumbnail_image_source_url = item.thumbnail_url
+    elif item.thumbnail_url and item.update_fields:
+        item.update_fields = [
+            field for field in item.update_fields if field not in THUMBNAIL_UPDATE_FIELDS]
+    images = []
+    for index, image, url in item.images:
+        if store_image(image, 'image', url, fetcher, f"{slug}.jpg"):
+            images.append((index, image, url))
+    item.images = images
+
+
+def write_products(items):
+    """Writes products with their size links and images, a few queries per table."""
+    created = [item for item in items if item.update_fields is None]
+    updated = [item for item in items if item.update_fields is not None]
+    Product.objects.bulk_create([item.product for item in created])
+    by_fields = defaultdict(list)
+    for item in updated:
+        if item.update_fields:
+            by_fields[tuple(item.update_fields)].append(item.product)
+    for fields, products in by_fields.items():
+        Product.objects.bulk_update(products, fields)
+
+    # Sizes are part of the row, rewritten when it changed
+    resized = [item for item in updated if 'import_hash' in item.update_fields]
+    Product.size.through.objects.filter(
+        product_id__in=[item.product.pk for item in resized]).delete()
+    Product.size.through.objects.bulk_create([
+        Product.size.through(product_id=item.product.pk, size_id=size_id)
+        for item in created + resized for size_id in item.size_ids])
+
+    images = []
+    for item in items:
+        for _, image, _ in item.images:
+            image.product = item.product
+            images.append(image)
+    ProductImage.objects.bulk_create(images)
+    ProductImage.objects.bulk_update(
+        [image for item in updated for image in item.updated_images], IMAGE_UPDATE_FIELDS)
+    ProductImage.objects.filter(
+        pk__in=[pk for item in updated for pk in item.deleted_image_ids]).delete()
+
+    # The delete above released its files through the signals, bulk writes don't send them
+    rethumbed = [item for item in updated if 'thumbnail_image' in item.update_fields]
+    storage.acquire([item.product.thumbnail_image.name for item in created + rethumbed] +
+                    [image.image.name for image in images])
+    storage.release([item.stored_thumbnail for item in rethumbed])
+    # A bundle path only means something within its bundle
+    storage.remember_sources([(url, name) for url, name in (
+        [(item.product.thumbnail_image_source_url, item.product.thumbnail_image.name)
+         for item in created + rethumbed] +
+        [(image.image_source_url, image.image.name) for image in images]
+    ) if not is_bundle_ref(url)])
+
+
+def reset_imported_product(item):
+    # A failed bulk_create may have set some pks already
+    instances = [image for _, image, _ in item.images]
+    if item.update_fields is None:
+        instances.append(item.product)
+    for instance in instances:
+        instance.pk = None
+        instance._state.adding = True
+
+
+def missing_product_ids(seen):
+    """Active imported products whose (name, subcategory id) isn't in `seen`."""
+    return [
+        pk for pk, name, subcategory_id in Product.objects.filter(is_active=True).exclude(
+            import_hash='').values_list('pk', 'name', 'subcategory_id').iterator()
+        if (name, subcategory_id) not in seen]
+
+
+def deactivate_missing_products(seen):
+    """
+    Deactivates the imported products whose (name, subcategory id) isn't in
+    `seen`, returns how many.
+    """
+    missing = missing_product_ids(seen)
+    for start in range(0, len(missing), DEACTIVATE_BATCH_SIZE):
+        batch = missing[start:start + DEACTIVATE_BATCH_SIZE]
+        with transaction.atomic():
+            Product.objects.filter(pk__in=batch).update(is_active=False, updated_at=timezone.now())
+            products_bulk_saved(list(Product.objects.filter(pk__in=batch)))
+    return len(missing)
+
+
+def iter_lines(chunks, encoding='utf-8-sig'):
+    """Decodes byte chunks into lines as they arrive, keeping the line endings."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split('\n')
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def read_csv_rows(file):
+    # ✅ decode with BOM-aware codec, a chunk at a time
+    for row in csv.DictReader(iter_lines(file.chunks())):
+        yield {key.strip(): (value.strip() if isinstance(value, str) else value)
+               for key, value in row.items()}
+
+
+def read_excel_rows(worksheet):
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, ())
+    for row in rows:
+        yield dict(zip(header, row))
+
+
+def read_json_lines(file):
+    for line in iter_lines(file.chunks(), 'utf-8'):
+        if line.strip():
+            yield json.loads(line)
+
+
+@contextmanager
+def read_rows(file, name):
+    """
+    Yields (rows, row count or None) for an open file, its type taken from
+    `name`. Rows are read as they are consumed, so memory doesn't grow with
+    the file.
+    """
+    name = name.lower()
+    if name.endswith('.csv'):
+        yield read_csv_rows(file), None
+    elif name.endswith(('.xlsx', '.xls')):
+        wb = openpyxl.load_workbook(file, read_only=True)
+        try:
+            ws = wb.active
+            yield read_excel_rows(ws), (ws.max_row - 1 if ws.max_row else None)
+        finally:
+            wb.close()
+    elif name.endswith('.jsonl'):
+        yield read_json_lines(file), None
+    else:
+        raise ValueError('Unsupported file type. Use CSV or Excel.')
+
+
+def is_bundle_sheet(info):
+    name = info.filename
+    return (not info.is_dir() and name.lower().endswith(BUNDLE_SHEET_TYPES)
+            and not name.startswith((BUNDLE_IMAGES_DIR, '__MACOSX/'))
+            and not posixpath.basename(name).startswith('.'))
+
+
+@contextmanager
+def read_bundle(file):
+    """
+    Yields (rows, row count or None, ImageBundle) for a .zip holding one
+    sheet (CSV, Excel or JSON lines) and its images, the sheet being read
+    out of the zip as it is consumed.
+    """
+    with zipfile.ZipFile(file) as zip_file:
+        sheets = [info for info in zip_file.infolist() if is_bundle_sheet(info)]
+        if len(sheets) != 1:
+            raise ValueError('The zip must hold one CSV or Excel sheet next to its images/ folder.')
+        with zip_file.open(sheets[0]) as sheet, \
+                read_rows(File(sheet), sheets[0].filename) as (rows, total):
+            yield rows, total, ImageBundle(zip_file)
+
+
+@contextmanager
+def read_upload(file, name):
+    """Yields (rows, row count or None, ImageBundle or None) for a sheet or a .zip bundle."""
+    if name.lower().endswith('.zip'):
+        with read_bundle(file) as upload:
+            yield upload
+    else:
+        with read_rows(file, name) as (rows, total):
+            yield rows, total, None
+
+
+@contextmanager
+def open_rows(job):
+    with job.file.open('rb') as file, \
+            read_upload(file, job.original_name or job.file.name) as upload:
+        yield upload
+
+
+def iter_product_groups(rows):
+    """
+    Yields (start, end, product row, [(index, image row), ...]) where a row
+    with a product name starts a product and the rows after it without one
+    add more images to it. start/end are row indexes, end is exclusive.
+    """
+    group = None
+    index = -1
+    for index, row in enumerate(rows):
+        if row.get('Product Name'):
+            if group:
+                yield group[0], index, group[1], group[2]
+            group = (index, row, [(index, row)])
+        elif group:
+            group[2].append((index, row))
+    if group:
+        yield group[0], index + 1, group[1], group[2]
+
+
+def row_number(index):
+    """Spreadsheet row number of data row `index`, the header is row 1."""
+    return index + 2
+
+
+def lookup_existing(groups, hierarchies, sync):
+    """
+    The products of a chunk that already exist (same name and subcategory),
+    as {(name, subcategory id): (pk, import_hash, is_active,
+    thumbnail_image_source_url, thumbnail_image)}, and when syncing their
+    images as {product id: [(pk, import_hash, source url, file name)]}.
+    """
+    existing = {}
+    for pk, name, subcategory_id, *current in Product.objects.filter(
+            name__in={str(row.get('Product Name')) for _, _, row, _ in groups},
+            subcategory__in={hierarchy[1].pk for hierarchy in hierarchies.values()},
+    ).order_by('-pk').values_list(
+            'pk', 'name', 'subcategory_id', 'import_hash', 'is_active',
+            'thumbnail_image_source_url', 'thumbnail_image'):
+        existing[(name, subcategory_id)] = (pk, *current)
+    current_images = defaultdict(list)
+    if sync and existing:
+        for pk, product_id, *image in ProductImage.objects.filter(
+                product__in=[current[0] for current in existing.values()],
+        ).values_list('pk', 'product_id', 'import_hash', 'image_source_url', 'image'):
+            current_images[product_id].append((pk, *image))
+    return existing, current_images
+
+
+def resolve_chunk(job, groups, fetcher, catalog, uncommitted):
+    """
+    Builds the products of a chunk of groups, works out which are new (or
+    changed, when syncing) and starts downloading their images.
+    `uncommitted` holds the (name, subcategory id) of products queued but
+    not written yet.
+    """
+    sync = job.mode == ImportJob.SYNC
+    hierarchies = {}
+    resolved = []
+    for start, end, row, image_rows in groups:
+        try:
+            hierarchies[start] = catalog.hierarchy(row)
+        except Exception as e:
+            resolved.append((start, None, e))
+    existing, current_images = lookup_existing(groups, hierarchies, sync)
+
+    keys = set()
+    for start, end, row, image_rows in groups:
+        if start not in hierarchies:
+            continue
+        # Reported like a dry run does, whatever happens to the product
+        resolved.extend(
+            (index, None, invalid_image_error(value, fetcher.bundle))
+            for index, value in invalid_image_cells(start, row, image_rows, fetcher.bundle))
+        key = (str(row.get('Product Name')), hierarchies[start][1].pk)
+        if key in keys or key in uncommitted or (key in existing and not sync):
+            resolved.append((start, None, None))
+            continue
+        try:
+            item = build_product(start, row, image_rows, hierarchies[start], catalog, fetcher.bundle)
+        except Exception as e:
+            resolved.append((start, None, e))
+            continue
+        keys.add(key)
+        current = existing.get(key)
+        if current and not plan_update(
+                item, current, current_images[current[0]], job.deactivate_missing):
+            resolved.append((start, UNCHANGED, None))
+            continue
+        resolved.append((start, item, None))
+
+    # Only the URLs nothing was stored from yet are downloaded
+    urls = {url for _, item, _ in resolved if isinstance(item, ImportedProduct)
+            for url in [item.thumbnail_url] + [url for _, _, url in item.images] if url}
+    fetcher.stored_names.update(storage.find_blobs(
+        url for url in urls - fetcher.stored_names.keys() if not is_bundle_ref(url)))
+    fetcher.prefetch(urls)
+    resolved.sort(key=lambda entry: entry[0])
+    return resolved, groups[-1][1], keys
+
+
+def commit_chunk(job, resolved, end, keys, fetcher):
+    """Writes the new and changed products of a chunk and moves the job past it, all or nothing."""
+    items = []
+    for start, item, error in resolved:
+        if error is not None:
+            job.add_error(row_number(start), error)
+            continue
+        if item is None:
+            job.products_skipped += 1
+            continue
+        if item is UNCHANGED:
+            job.products_unchanged += 1
+            continue
+        urls = [(start, item.thumbnail_url)] + [(index, url) for index, _, url in item.images]
+        store_images(item, fetcher)
+        for index, url in urls:
+            if url in fetcher.errors:
+                job.add_error(row_number(index), f"Image {url}: {fetcher.errors[url]}")
+        items.append(item)
+
+    written = []
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                write_products(items)
+            written = items
+        except DatabaseError:
+            # Write them one at a time to find the rows at fault
+            for item in items:
+                reset_imported_product(item)
+                try:
+                    with transaction.atomic():
+                        write_products([item])
+                except DatabaseError as e:
+                    job.add_error(row_number(item.start), e)
+                    continue
+                written.append(item)
+        job.products_created += sum(item.update_fields is None for item in written)
+        job.products_updated += sum(item.update_fields is not None for item in written)
+        job.rows_processed = end
+        job.save()
+    products_bulk_saved(
+        [item.product for item in written],
+        [image for item in written for _, image, _ in item.images])
+
+
+def iter_chunks(groups, size=CHUNK_SIZE):
+    chunk = []
+    for group in groups:
+        chunk.append(group)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def track_product_keys(groups, catalog, seen):
+    """Passes the groups through, adding the (name, subcategory id) of each to `seen`."""
+    for group in groups:
+        try:
+            seen.add((str(group[2].get('Product Name')), catalog.hierarchy(group[2])[1].pk))
+        except Exception:
+            pass
+        yield group
+
+
+class JobHeartbeat:
+    """
+    Touches a running job's updated_at every HEARTBEAT_INTERVAL from a
+    thread, so a chunk whose images take long to download isn't taken for
+    an abandoned job by another worker.
+    """
+
+    def __init__(self, job):
+        self.job_id = job.pk
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(HEARTBEAT_INTERVAL):
+                try:
+                    ImportJob.objects.filter(pk=self.job_id, status=ImportJob.RUNNING).update(
+                        updated_at=timezone.now())
+                except DatabaseError:
+                    # Tried again on the next beat
+                    pass
+        finally:
+            connection.close()
+
+
+def run_import_job(job):
+    """Imports the rows of `job` after job.rows_processed, marks it done or failed."""
+    try:
+        with JobHeartbeat(job), open_rows(job) as (rows, total, bundle), \
+                ImageFetcher(bundle=bundle) as fetcher:
+            job.rows_total = total
+            catalog = CatalogCache()
+            groups = iter_product_groups(rows)
+            seen = set()
+            deactivate = job.mode == ImportJob.SYNC and job.deactivate_missing
+            if deactivate:
+                # Including the rows committed before a restart
+                groups = track_product_keys(groups, catalog, seen)
+            # Rows of committed chunks are read but not imported again
+            groups = (group for group in groups if group[1] > job.rows_processed)
+            pending = None
+            # The next chunk's images download while the previous one is written
+            for chunk in iter_chunks(groups):
+                resolved = resolve_chunk(job, chunk, fetcher, catalog, pending[2] if pending else ())
+                if pending:
+                    commit_chunk(job, *pending, fetcher)
+                pending = resolved
+            if pending:
+                commit_chunk(job, *pending, fetcher)
+            # An empty file doesn't deactivate the whole catalog
+            if deactivate and seen:
+                job.products_deactivated = deactivate_missing_products(seen)
+        job.rows_total = job.rows_processed = max(job.rows_total or 0, job.rows_processed)
+        job.status = ImportJob.DONE
+        # Supplier sheets aren't kept once the job is over, a failed job
+        # keeps its file to be retried (see delete_failed_import_files)
+        job.file.delete(save=False)
+    except Exception as e:
+        job.status = ImportJob.FAILED
+        job.message = str(e)
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def dry_run_import(rows, mode=ImportJob.CREATE, deactivate_missing=False, bundle=None):
+    """
+    What importing `rows` (and the images of `bundle`) would do, without
+    writing or downloading anything.
+    Returns {'summary': {...}, 'rows': [{'row', 'product', 'action', ...}]}
+    with an entry per product, action being create, update, unchanged,
+    skip (the product exists, or is earlier in the file) or error.
+    """
+    sync = mode == ImportJob.SYNC
+    catalog = CatalogCache(readonly=True)
+    report = []
+    seen = set()
+    for groups in iter_chunks(iter_product_groups(rows), DRY_RUN_CHUNK_SIZE):
+        hierarchies = {}
+        for start, end, row, image_rows in groups:
+            try:
+                hierarchies[start] = catalog.hierarchy(row)
+            except Exception as e:
+                report.append({'row': row_number(start), 'product': row.get('Product Name'),
+                               'errors': [str(e)], 'new_sizes': [], 'new_categories': [],
+                               'invalid_image_urls': [], 'action': 'error'})
+        existing, current_images = lookup_existing(groups, hierarchies, sync)
+
+        for start, end, row, image_rows in groups:
+            if start not in hierarchies:
+                continue
+            hierarchy = hierarchies[start]
+            entry = {'row': row_number(start), 'product': row.get('Product Name'), 'errors': [],
+                     'new_sizes': []}
+            labels = ['Category', 'Sub Category', 'Sub Sub Category']
+            entry['new_categories'] = [
+                f'{label}: {level.name}' for label, level in zip(labels, hierarchy) if level.pk is None]
+            entry['invalid_image_urls'] = [
+                {'row': row_number(index), 'url': url}
+                for index, url in invalid_image_cells(start, row, image_rows, bundle)]
+            report.append(entry)
+
+            key = (str(row.get('Product Name')), catalog.parent_key(hierarchy[1]))
+            if key in seen or (key in existing and not sync):
+                entry['action'] = 'skip'
+                continue
+            seen.add(key)
+            try:
+                item = build_product(start, row, image_rows, hierarchy, catalog, bundle)
+            except Exception as e:
+                entry['action'] = 'error'
+                entry['errors'].append(str(e))
+                continue
+            entry['new_sizes'] = [
+                name for name in catalog.size_names(row.get('Size')) if catalog.sizes[name] < 0]
+            current = existing.get(key)
+            if current is None:
+                entry['action'] = 'create'
+            elif plan_update(item, current, current_images[current[0]], deactivate_missing):
+                entry['action'] = 'update'
+            else:
+                entry['action'] = 'unchanged'
+
+    report.sort(key=lambda entry: entry['row'])
+    summary = dict.fromkeys(['create', 'update', 'unchanged', 'skip', 'error'], 0)
+    summary.update(Counter(entry['action'] for entry in report))
+    summary['invalid_image_urls'] = sum(len(entry['invalid_image_urls']) for entry in report)
+    if sync and deactivate_missing and seen:
+        summary['deactivate'] = len(missing_product_ids(seen))
+    return {'mode': mode, 'summary': summary, 'rows': report}
+
+
+def claim_import_job():
+    """
+    Marks the oldest pending, abandoned or failed (with attempts left) job
+    as running and returns it.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = ImportJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status=ImportJob.PENDING)
+            | Q(status=ImportJob.RUNNING, updated_at__lt=now - STALE_AFTER)
+            | (Q(status=ImportJob.FAILED, attempts__lt=MAX_ATTEMPTS,
+                 finished_at__lt=now - RETRY_AFTER) & ~Q(file=''))
+        ).order_by('created_at').first()
+        if job is None:
+            return None
+        job.status = ImportJob.RUNNING
+        job.started_at = job.started_at or now
+        job.finished_at = None
+        job.message = ''
+        job.attempts += 1
+        job.save()
+    return job
+
+
+def delete_failed_import_files():
+    """Deletes the files of the jobs that failed their last attempt a while ago."""
+    jobs = ImportJob.objects.filter(
+        status=ImportJob.FAILED, attempts__gte=MAX_ATTEMPTS,
+        finished_at__lt=timezone.now() - FAILED_FILE_RETENTION).exclude(file='')
+    count = 0
+    for job in jobs.iterator():
+        job.file.delete()
+        count += 1
+    return count
+
+
+# Category①/②/③ columns of the taxonomy sheet
+CATEGORY_COLUMNS = ['Category①', 'Category②', 'Category③']
+
+
+def create_missing_categories(model, wanted, parent_field=None):
+    """
+    Inserts the (name[, parent id]) rows of the `wanted` DataFrame that
+    `model` doesn't have yet. Returns the created objects and `wanted` with
+    the pk of every row.
+    """
+    keys = ['name'] + ([parent_field] if parent_field else [])
+    existing = pd.DataFrame(list(model.objects.order_by('pk').values_list(*keys, 'pk')),
+                            columns=keys + ['pk'])
+    # Names can repeat, the oldest row wins like get() on it would
+    existing = existing.drop_duplicates(subset=keys)
+    merged = wanted.merge(existing, on=keys, how='left')
+    missing = merged['pk'].isna()
+    created = model.objects.bulk_create([
+        model(slug=slugify(row['name']), **row) for row in merged.loc[missing, keys].to_dict('records')])
+    if created:
+        merged.loc[missing, 'pk'] = [obj.pk for obj in created]
+    return created, merged.astype({'pk': 'int64'})
+
+
+def import_categories(df):
+    """
+    Creates the categories, subcategories and subsubcategories of a taxonomy
+    sheet that don't exist yet, one bulk insert per level. Returns how many
+    of each were created.
+    """
+    levels = df.reindex(columns=CATEGORY_COLUMNS).astype('string')
+    levels = levels.apply(lambda column: column.str.strip()).replace('', pd.NA).astype(object)
+    levels.columns = ['category', 'subcategory', 'subsubcategory']
+    levels = levels.dropna(subset=['category'])
+
+    with transaction.atomic():
+        categories, ids = create_missing_categories(
+            ProductCategory, levels[['category']].drop_duplicates().rename(columns={'category': 'name'}))
+        levels = levels.merge(
+            ids.rename(columns={'name': 'category', 'pk': 'category_id'}), on='category')
+
+        wanted = levels.dropna(subset=['subcategory'])[['subcategory', 'category_id']]
+        subcategories, ids = create_missing_categories(
+            ProductSubCategory, wanted.drop_duplicates().rename(columns={'subcategory': 'name'}),
+            'category_id')
+        levels = levels.merge(
+            ids.rename(columns={'name': 'subcategory', 'pk': 'subcategory_id'}),
+            on=['subcategory', 'category_id'])
+
+        wanted = levels.dropna(subset=['subsubcategory'])[['subsubcategory', 'subcategory_id']]
+        subsubcategories, _ = create_missing_categories(
+            ProductSubSubCategory, wanted.drop_duplicates().rename(columns={'subsubcategory': 'name'}),
+            'subcategory_id')
+        categories_bulk_created(categories, subcategories, subsubcategories)
+    return {
+        'categories': len(categories),
+        'subcategories': len(subcategories),
+        'subsubcategories': len(subsubcategories),
+    }
@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from ecommerce import renditions
+
+
+class Command(BaseCommand):
+    help = 'Generates the missing image renditions (product, category and blog images).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate every image, e.g. after changing the widths.')
+        parser.add_argument('--workers', type=int,
+                            default=getattr(settings, 'IMAGE_RENDITION_WORKERS', 2) or 1)
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model, field_name, on_done in renditions.registry:
+            rows = model._default_manager.exclude(**{field_name: ''}).exclude(
+                **{f'{field_name}__isnull': True})
+            if not options['force']:
+                rows = rows.filter(**{renditions.srcset_field_name(field_name): {}})
+            jobs.extend((model, pk, field_name, name, on_done)
+                        for pk, name in rows.values_list('pk', field_name).iterator())
+
+        def run(job):
+            try:
+                return renditions.render(*job) is not None
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            done = sum(executor.map(run, jobs))
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated renditions for {done} of {len(jobs)} images.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from products.similarity import build_similar_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the similar products of the products that changed since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild every product, e.g. nightly to refresh the term weights.')
+
+    def handle(self, *args, **options):
+        count = build_similar_products(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated similar products for {count} products.'))
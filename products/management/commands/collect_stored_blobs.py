@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from ecommerce import storage
+
+
+class Command(BaseCommand):
+    help = 'Deletes the shared media files no row points at any more.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true',
+                            help='Recompute the reference counts from the rows first.')
+        parser.add_argument('--grace-hours', type=float,
+                            default=storage.GRACE_PERIOD.total_seconds() / 3600,
+                            help='Keep unreferenced files saved within this many hours.')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            storage.recount()
+        deleted = storage.collect_garbage(timedelta(hours=options['grace_hours']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced files.'))
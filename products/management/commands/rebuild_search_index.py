@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from products.models import Product
+from products.search import reindex_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for all products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        pks = list(Product.objects.using(using).values_list('pk', flat=True))
+        reindex_products(pks, using=using)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {len(pks)} products.'))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from products.importer import claim_import_job, delete_failed_import_files, run_import_job
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued product imports, waiting for new ones unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once there are no more jobs to run.')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between checks for new jobs.')
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_import_job()
+            if job is None:
+                delete_failed_import_files()
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+            self.stdout.write(f'Running import {job.pk} (attempt {job.attempts})...')
+            job = run_import_job(job)
+            self.stdout.write(self.style.SUCCESS(
+                f'Import {job.pk} {job.status}: {job.products_created} created, '
+                f'{job.products_updated} updated, {job.products_unchanged} unchanged, '
+                f'{job.products_skipped} skipped, {job.products_deactivated} deactivated, '
+                f'{job.error_count} errors.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from products.trending import update_trending_scores
+
+
+class Command(BaseCommand):
+    help = 'Adds the orders, wishlist additions and reviews since the last run to the trending scores.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute every score, e.g. after changing the weights.')
+
+    def handle(self, *args, **options):
+        count = update_trending_scores(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated trending scores for {count} products.'))
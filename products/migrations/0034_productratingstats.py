@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_stats(apps, schema_editor):
+    ProductReview = apps.get_model('products', 'ProductReview')
+    ProductRatingStats = apps.get_model('products', 'ProductRatingStats')
+
+    rows = ProductReview.objects.values('product_id').annotate(
+        reviews_count=Count('id'),
+        rating_sum=Sum('rating'),
+        rating_1=Count('id', filter=Q(rating__lte=1)),
+        rating_2=Count('id', filter=Q(rating=2)),
+        rating_3=Count('id', filter=Q(rating=3)),
+        rating_4=Count('id', filter=Q(rating=4)),
+        rating_5=Count('id', filter=Q(rating__gte=5)),
+    ).order_by()
+    ProductRatingStats.objects.bulk_create([
+        ProductRatingStats(
+            average_rating=row['rating_sum'] / row['reviews_count'], **row)
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0033_product_extra_description_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRatingStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to='products.product')),
+                ('reviews_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('average_rating', models.FloatField(db_index=True, default=0)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_rating_stats,
+                             migrations.RunPython.noop),
+    ]
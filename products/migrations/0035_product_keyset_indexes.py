@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0034_productratingstats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='products_pr_name_9ff0a3_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='products_pr_created_52f0d7_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='products_pr_price_9b1a5f_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='products_pr_name_37bd5c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='products_pr_created_3be21c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='products_pr_price_dbec84_idx'),
+        ),
+    ]
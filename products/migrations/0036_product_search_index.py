@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from products.search import DOCUMENT_FIELDS, create_search_index, get_backend
+
+    connection = schema_editor.connection
+    create_search_index(connection)
+    backend = get_backend(connection)
+    if backend is None:
+        return
+    Product = apps.get_model('products', 'Product')
+    rows = Product.objects.using(connection.alias).values_list('pk', *DOCUMENT_FIELDS)
+    backend.index(connection, list(rows))
+
+
+def drop_search_index(apps, schema_editor):
+    from products.search import drop_search_index
+
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0035_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0036_product_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', 'created_at', 'id'], name='products_pr_product_d9f37a_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0038_productrecommendation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productrecommendation',
+            name='kind',
+            field=models.CharField(choices=[('similar', 'Similar'), ('bought_together', 'Bought together')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0042_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='deactivate_missing',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='mode',
+            field=models.CharField(choices=[('create', 'Create'), ('sync', 'Sync')], default='create', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='products_deactivated',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='products_unchanged',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='products_updated',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumbnail_image_source_url',
+            field=models.URLField(blank=True, editable=False, max_length=2000),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='image_source_url',
+            field=models.URLField(blank=True, editable=False, max_length=2000),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:55
+
+import django.db.models.deletion
+import django.utils.timezone
+import ecommerce.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0043_import_sync'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='thumbnail_image',
+            field=models.FileField(blank=True, null=True, storage=ecommerce.storage.get_blob_storage, upload_to='products/thumbnails/'),
+        ),
+        migrations.AlterField(
+            model_name='productcategory',
+            name='image',
+            field=models.FileField(blank=True, null=True, storage=ecommerce.storage.get_blob_storage, upload_to='categories/'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.FileField(storage=ecommerce.storage.get_blob_storage, upload_to='products/'),
+        ),
+        migrations.AlterField(
+            model_name='productsubcategory',
+            name='image',
+            field=models.FileField(blank=True, null=True, storage=ecommerce.storage.get_blob_storage, upload_to='subcategories/'),
+        ),
+        migrations.AlterField(
+            model_name='productsubsubcategory',
+            name='image',
+            field=models.FileField(blank=True, null=True, storage=ecommerce.storage.get_blob_storage, upload_to='subsubcategories/'),
+        ),
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('saved_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ref_count', 'saved_at'], name='products_st_ref_cou_3436d7_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StoredBlobSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField()),
+                ('url_hash', models.CharField(max_length=64, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sources', to='products.storedblob')),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:29
+
+import ecommerce.storage
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def move_import_files(apps, schema_editor):
+    # Out of the served media: files of unfinished jobs move, the rest go
+    ImportJob = apps.get_model('products', 'ImportJob')
+    for job in ImportJob.objects.exclude(file=''):
+        name = job.file.name
+        if not default_storage.exists(name):
+            continue
+        if job.status in ('pending', 'running'):
+            with default_storage.open(name, 'rb') as file:
+                job.file.name = ecommerce.storage.private_storage.save(name, file)
+        else:
+            job.file.name = ''
+        default_storage.delete(name)
+        job.save(update_fields=['file'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0044_storedblob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importjob',
+            name='file',
+            field=models.FileField(blank=True, storage=ecommerce.storage.get_private_storage, upload_to='imports/'),
+        ),
+        migrations.RunPython(move_import_files, migrations.RunPython.noop),
+    ]
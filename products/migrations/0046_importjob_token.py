@@ -0,0 +1,31 @@
+import uuid
+
+from django.db import migrations, models
+
+
+def fill_tokens(apps, schema_editor):
+    ImportJob = apps.get_model('products', 'ImportJob')
+    for job in ImportJob.objects.filter(token__isnull=True):
+        job.token = uuid.uuid4()
+        job.save(update_fields=['token'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0045_import_private_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='token',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='importjob',
+            name='token',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
@@ -1,13 +1,19 @@
-from django.db import models
+import uuid
+
+from django.db import models, transaction
+from django.utils import timezone
 from django.utils.text import slugify
 from accounts.models import User
+from ecommerce.storage import get_blob_storage, get_private_storage
 
 
 class ProductCategory(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(null=True, blank=True, db_index=True)
     description = models.TextField(blank=True)
-    image = models.FileField(upload_to='categories/', null=True, blank=True)
+    image = models.FileField(
+        upload_to='categories/', storage=get_blob_storage, null=True, blank=True)
+    image_srcset = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return self.name
@@ -21,7 +27,9 @@ class ProductSubCategory(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(null=True, blank=True, db_index=True)
     description = models.TextField(blank=True)
-    image = models.FileField(upload_to='subcategories/', null=True, blank=True)
+    image = models.FileField(
+        upload_to='subcategories/', storage=get_blob_storage, null=True, blank=True)
+    image_srcset = models.JSONField(default=dict, blank=True, editable=False)
     category = models.ForeignKey(
         ProductCategory, related_name='subcategories', on_delete=models.CASCADE)
 
@@ -41,7 +49,8 @@ class ProductSubSubCategory(models.Model):
     slug = models.SlugField(null=True, blank=True, db_index=True)
     description = models.TextField(blank=True)
     image = models.FileField(
-        upload_to='subsubcategories/', null=True, blank=True)
+        upload_to='subsubcategories/', storage=get_blob_storage, null=True, blank=True)
+    image_srcset = models.JSONField(default=dict, blank=True, editable=False)
     subcategory = models.ForeignKey(
         ProductSubCategory, related_name='subsubcategories', on_delete=models.CASCADE, null=True, blank=True)
 
@@ -73,12 +82,16 @@ class Color(models.Model):
 
 
 class ProductImage(models.Model):
-    image = models.FileField(upload_to='products/')
+    image = models.FileField(upload_to='products/', storage=get_blob_storage)
+    image_srcset = models.JSONField(default=dict, blank=True, editable=False)
     image_alt_description = models.TextField(blank=True, null=True)
     color = models.CharField(max_length=100, blank=True, null=True)
     stock = models.PositiveIntegerField(default=0, null=True, blank=True)
     product = models.ForeignKey(
         'Product', related_name='images', on_delete=models.CASCADE)
+    # Set by imports: hash of the image row and the URL the file came from
+    import_hash = models.CharField(max_length=64, blank=True, editable=False)
+    image_source_url = models.URLField(max_length=2000, blank=True, editable=False)
 
     def __str__(self):
         return f"Image for {self.product.name}"
@@ -97,8 +110,12 @@ class Product(models.Model):
         max_digits=10, decimal_places=2, default=0.00, null=True, blank=True)
     stock = models.PositiveIntegerField(default=0, null=True, blank=True)
     thumbnail_image = models.FileField(
-        upload_to='products/thumbnails/', null=True, blank=True)
+        upload_to='products/thumbnails/', storage=get_blob_storage, null=True, blank=True)
+    thumbnail_image_srcset = models.JSONField(default=dict, blank=True, editable=False)
     thumbnail_image_alt_description = models.TextField(blank=True, null=True)
+    # Set by imports: hash of the product row and the URL the thumbnail came from
+    import_hash = models.CharField(max_length=64, blank=True, editable=False)
+    thumbnail_image_source_url = models.URLField(max_length=2000, blank=True, editable=False)
     category = models.ForeignKey(
         ProductCategory, related_name='products', on_delete=models.CASCADE, null=True, blank=True)
     subcategory = models.ForeignKey(
@@ -107,6 +124,9 @@ class Product(models.Model):
         ProductSubSubCategory, related_name='products', on_delete=models.CASCADE, null=True, blank=True)
     is_popular = models.BooleanField(default=False)
     is_featured = models.BooleanField(default=False)
+    # Decayed order/wishlist/review activity, see products/trending.py
+    trending_score = models.FloatField(default=0, editable=False)
+    trending_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
     discount = models.DecimalField(
         max_digits=5, decimal_places=2, default=0.00, null=True, blank=True)
     is_active = models.BooleanField(default=True)
@@ -123,10 +143,12 @@ class Product(models.Model):
         ordering = ['-created_at']
         unique_together = ('name', 'subsubcategory')
         indexes = [
-            models.Index(fields=['name']),
+            # id is the keyset pagination tie-breaker
+            models.Index(fields=['name', 'id']),
             models.Index(fields=['slug']),
-            models.Index(fields=['created_at']),
-            models.Index(fields=['price']),
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['trending_score', 'id']),
             models.Index(fields=['is_popular']),
             models.Index(fields=['is_featured']),
         ]
@@ -147,6 +169,62 @@ class ProductReview(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.product.name}"
 
+    class Meta:
+        indexes = [
+            # Latest reviews of a product and their keyset pagination
+            models.Index(fields=['product', 'created_at', 'id']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Run inside a transaction so the rating stats updated from post_save
+        # are committed (or rolled back) together with the review itself.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class ProductRatingStats(models.Model):
+    product = models.OneToOneField(
+        Product, related_name='rating_stats', on_delete=models.CASCADE, primary_key=True)
+    reviews_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(default=0, db_index=True)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.product_id} - {self.average_rating:.2f} ({self.reviews_count})"
+
+    @classmethod
+    def record(cls, product_id, rating, delta):
+        """Adds (delta=1) or removes (delta=-1) a single rating for a product."""
+        if delta > 0:
+            stats, _ = cls.objects.select_for_update().get_or_create(
+                product_id=product_id)
+        else:
+            # Never create a row while removing, the product may be getting deleted
+            stats = cls.objects.select_for_update().filter(
+                product_id=product_id).first()
+            if stats is None:
+                return None
+
+        star = min(max(rating, 1), 5)
+        stats.reviews_count = max(stats.reviews_count + delta, 0)
+        stats.rating_sum = max(stats.rating_sum + delta * rating, 0)
+        field = f'rating_{star}'
+        setattr(stats, field, max(getattr(stats, field) + delta, 0))
+        stats.average_rating = (
+            stats.rating_sum / stats.reviews_count if stats.reviews_count else 0)
+        stats.save()
+        return stats
+
+    @property
+    def distribution(self):
+        return {star: getattr(self, f'rating_{star}') for star in range(1, 6)}
+
 
 class Wishlist(models.Model):
     user = models.ForeignKey(
@@ -157,3 +235,173 @@ class Wishlist(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name}"
+
+
+class ProductRecommendation(models.Model):
+    """Precomputed top neighbours of a product, rebuilt in batch."""
+    SIMILAR = 'similar'
+    BOUGHT_TOGETHER = 'bought_together'
+    KIND_CHOICES = [
+        (SIMILAR, 'Similar'),
+        (BOUGHT_TOGETHER, 'Bought together'),
+    ]
+
+    product = models.ForeignKey(
+        Product, related_name='recommendations', on_delete=models.CASCADE)
+    recommended = models.ForeignKey(
+        Product, related_name='recommended_in', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+    # Set to the start of the build that wrote the row
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} ({self.kind} #{self.rank})"
+
+    @classmethod
+    def store(cls, kind, neighbours, built_at, batch_size=500):
+        """
+        Replaces the recommendations of each product in `neighbours`, an
+        iterable of (product id, [(recommended id, score), ...]) best first.
+        Products deleted since they were counted are skipped, and so are
+        recommendations of deleted or inactive products. Returns the number
+        of products written.
+        """
+        batch = []
+        stored = 0
+
+        def flush():
+            ids = {pk for pk, _ in batch} | {
+                recommended_id for _, items in batch for recommended_id, _ in items}
+            active = dict(Product.objects.filter(pk__in=ids).values_list('pk', 'is_active'))
+            with transaction.atomic():
+                cls.objects.filter(
+                    kind=kind, product_id__in=[pk for pk, _ in batch]).delete()
+                cls.objects.bulk_create([
+                    cls(product_id=pk, recommended_id=recommended_id, kind=kind,
+                        score=score, rank=rank, updated_at=built_at)
+                    for pk, items in batch if pk in active
+                    for rank, (recommended_id, score) in enumerate(
+                        item for item in items if active.get(item[0]))
+                ], batch_size=1000)
+
+        for item in neighbours:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush()
+                stored += len(batch)
+                batch = []
+        if batch:
+            flush()
+            stored += len(batch)
+        return stored
+
+    class Meta:
+        unique_together = ('product', 'kind', 'recommended')
+        indexes = [
+            models.Index(fields=['product', 'kind', 'rank']),
+        ]
+
+
+class ImportJob(models.Model):
+    """A product import run in the background by the run_import_jobs command."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    # create only adds new products, sync also updates the changed ones
+    CREATE = 'create'
+    SYNC = 'sync'
+    MODE_CHOICES = [
+        (CREATE, 'Create'),
+        (SYNC, 'Sync'),
+    ]
+    # Kept per job, the rest are only counted
+    MAX_ERRORS = 500
+
+    # CSV, Excel, a .zip of a sheet and its images, or the Google Sheet rows as JSON.
+    # Not served. Deleted once the job is done, or a while after it failed for good
+    file = models.FileField(upload_to='imports/', storage=get_private_storage, blank=True)
+    original_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default=CREATE)
+    # Sync only: deactivate imported products that are no longer in the file
+    deactivate_missing = models.BooleanField(default=False)
+    rows_total = models.PositiveIntegerField(null=True, blank=True)
+    # Input rows committed so far, a restarted job carries on from here
+    rows_processed = models.PositiveIntegerField(default=0)
+    products_created = models.PositiveIntegerField(default=0)
+    products_skipped = models.PositiveIntegerField(default=0)
+    products_updated = models.PositiveIntegerField(default=0)
+    products_unchanged = models.PositiveIntegerField(default=0)
+    products_deactivated = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    # [{'row': spreadsheet row number, 'error': message}, ...]
+    errors = models.JSONField(default=list, blank=True)
+    message = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True)
+    # In the status URL instead of the id, so only whoever queued the job can follow it
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Saved with every chunk and by the worker's heartbeat, a running job that
+    # stops updating has crashed
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Import {self.pk} ({self.status})"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def add_error(self, row, error):
+        self.error_count += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append({'row': row, 'error': str(error)})
+
+
+class StoredBlob(models.Model):
+    """
+    A file of the content-addressed media storage (ecommerce.storage),
+    shared by every row storing the same bytes.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    # Rows pointing at it, the file is deleted some time after this drops to 0
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    saved_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'saved_at']),
+        ]
+
+
+class StoredBlobSource(models.Model):
+    """A URL a blob was downloaded from, imports reuse the blob instead of fetching it again."""
+    url = models.TextField()
+    url_hash = models.CharField(max_length=64, unique=True)
+    blob = models.ForeignKey(
+        StoredBlob, related_name='sources', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.url
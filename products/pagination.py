@@ -0,0 +1,212 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    """
+    Cheap row count for a queryset: the planner's estimate on PostgreSQL,
+    an exact COUNT(*) elsewhere.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination seeking on a `(field, pk)` key instead of OFFSET.
+
+    Pages cost the same however deep the client goes and stay stable while
+    rows are inserted. Cursors are opaque base64 tokens carrying the key of
+    the row to continue from. The total is only computed (approximately)
+    when `?include_total=1` is passed.
+
+    NULLs sort as the largest value in both directions, matching the default
+    btree order on PostgreSQL so the `(field, id)` indexes can be scanned.
+    """
+    page_size = 18
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    total_query_param = 'include_total'
+    # ?ordering= value -> key field, '-' prefix for descending
+    orderings = {}
+    default_ordering = None
+    nullable_fields = ()
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset):
+        ordering = request.query_params.get(self.ordering_query_param)
+        if ordering not in self.orderings:
+            ordering = self.default_ordering
+        return ordering
+
+    def encode_cursor(self, obj, reverse):
+        value = getattr(obj, self.field)
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        payload = {'o': self.ordering, 'v': value, 'k': obj.pk}
+        if reverse:
+            payload['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(
+            payload, separators=(',', ':')).encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            token += '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+            if payload['o'] != self.ordering:
+                raise ValueError
+            return payload['v'], payload['k'], bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_order_by(self, descending):
+        if descending:
+            return [F(self.field).desc(nulls_first=True), '-pk']
+        return [F(self.field).asc(nulls_last=True), 'pk']
+
+    def get_seek_filter(self, value, pk, descending):
+        field = self.field
+        nullable = field in self.nullable_fields
+        if value is None:
+            if descending:
+                return Q(**{f'{field}__isnull': True, 'pk__lt': pk}) | Q(**{f'{field}__isnull': False})
+            return Q(**{f'{field}__isnull': True, 'pk__gt': pk})
+        # Written as a range plus tie-break so the index range starts at the cursor
+        if descending:
+            return Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | Q(pk__lt=pk))
+        seek = Q(**{f'{field}__gte': value}) & (Q(**{f'{field}__gt': value}) | Q(pk__gt=pk))
+        if nullable:
+            seek |= Q(**{f'{field}__isnull': True})
+        return seek
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset)
+        key = self.orderings[self.ordering]
+        self.field = key.lstrip('-')
+        descending = key.startswith('-')
+
+        self.total = None
+        if request.query_params.get(self.total_query_param) in ('1', 'true', 'True'):
+            self.total = estimate_count(queryset)
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor[2])
+        # Walking backwards is the same query with the order flipped
+        scan_descending = descending != reverse
+        queryset = queryset.order_by(*self.get_order_by(scan_descending))
+        if cursor:
+            queryset = queryset.filter(self.get_seek_filter(
+                cursor[0], cursor[1], scan_descending))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_url = self.previous_url = None
+        if results:
+            if has_more or reverse:
+                self.next_url = self.encode_cursor(results[-1], reverse=False)
+            if cursor and (has_more or not reverse):
+                self.previous_url = self.encode_cursor(results[0], reverse=True)
+        elif cursor and reverse:
+            self.next_url = remove_query_param(
+                self.base_url, self.cursor_query_param)
+        return results
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.next_url,
+            'previous': self.previous_url,
+            'results': data,
+        }
+        if self.total is not None:
+            response['count'] = self.total
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        properties = {
+            'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+            'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+            'count': {'type': 'integer'},
+            'results': schema,
+        }
+        return {'type': 'object', 'required': ['results'], 'properties': properties}
+
+
+class ProductCursorPagination(KeysetPagination):
+    orderings = {
+        '-created_at': '-created_at',
+        'created_at': 'created_at',
+        'price': 'price',
+        '-price': '-price',
+        'name': 'name',
+        '-name': '-name',
+        'rating': 'rating',
+        '-rating': '-rating',
+        'trending': '-trending_score',
+        # The search_rank annotated by ProductSearchFilter
+        'relevance': '-search_rank',
+    }
+    default_ordering = '-created_at'
+    nullable_fields = ('price',)
+
+    def get_ordering(self, request, queryset):
+        ordering = super().get_ordering(request, queryset)
+        if 'search_rank' not in queryset.query.annotations:
+            return self.default_ordering if ordering == 'relevance' else ordering
+        # Search results come best match first unless asked otherwise
+        if request.query_params.get(self.ordering_query_param) not in self.orderings:
+            return 'relevance'
+        return ordering
+
+
+class ReviewCursorPagination(KeysetPagination):
+    page_size = 10
+    orderings = {
+        '-created_at': '-created_at',
+        'created_at': 'created_at',
+    }
+    default_ordering = '-created_at'
@@ -0,0 +1,224 @@
+"""
+Full-text product search.
+
+PostgreSQL keeps a weighted `search_vector` tsvector column on
+products_product behind a GIN index, SQLite keeps an FTS5 shadow table keyed
+by product id. Both are filled from the same plain-text document (HTML
+stripped) whenever a product is saved, and searched through
+ProductSearchFilter. Other databases fall back to DRF's icontains search.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+from rest_framework import filters
+from .cache import invalidate_tags
+
+# Most to least important, weighted A-D on PostgreSQL
+DOCUMENT_FIELDS = ('name', 'highlight_description',
+                   'description', 'specifications')
+SEARCH_CONFIG = 'english'
+FTS_TABLE = 'products_product_fts'
+BM25_WEIGHTS = (10.0, 4.0, 2.0, 1.0)
+INDEX_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def document_values(values):
+    return [strip_tags(value or '') for value in values]
+
+
+class PostgresSearchBackend:
+    vector = """
+        setweight(to_tsvector(%s::regconfig, %s), 'A') ||
+        setweight(to_tsvector(%s::regconfig, %s), 'B') ||
+        setweight(to_tsvector(%s::regconfig, %s), 'C') ||
+        setweight(to_tsvector(%s::regconfig, %s), 'D')
+    """
+    query = 'websearch_to_tsquery(%s::regconfig, %s)'
+
+    def create(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'ALTER TABLE products_product ADD COLUMN IF NOT EXISTS search_vector tsvector')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS products_product_search_vector_idx '
+                'ON products_product USING GIN (search_vector)')
+
+    def drop(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'ALTER TABLE products_product DROP COLUMN IF EXISTS search_vector')
+
+    def index(self, connection, rows):
+        params = []
+        for pk, *values in rows:
+            document = []
+            for value in document_values(values):
+                document.extend((SEARCH_CONFIG, value))
+            params.append((*document, pk))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE products_product SET search_vector = {self.vector} WHERE id = %s', params)
+
+    def remove(self, connection, pks):
+        # The column goes away with the row
+        pass
+
+    def search(self, queryset, terms):
+        params = (SEARCH_CONFIG, ' '.join(terms))
+        return queryset.filter(RawSQL(
+            f'products_product.search_vector @@ {self.query}', params, output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            f'ts_rank_cd(products_product.search_vector, {self.query})', params, output_field=FloatField()
+        )).order_by('-search_rank', '-created_at')
+
+
+class SQLiteSearchBackend:
+
+    def create(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+                f"{', '.join(DOCUMENT_FIELDS)}, tokenize='porter unicode61')")
+
+    def drop(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    def index(self, connection, rows):
+        rows = [(pk, *document_values(values)) for pk, *values in rows]
+        self.remove(connection, [row[0] for row in rows])
+        placeholders = ', '.join(['%s'] * (len(DOCUMENT_FIELDS) + 1))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(DOCUMENT_FIELDS)}) VALUES ({placeholders})", rows)
+
+    def remove(self, connection, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in pks])
+
+    def search(self, queryset, terms):
+        # Quote every term so user input can't use FTS5 query syntax
+        match = ' '.join('"%s"' % term.replace('"', '""') for term in terms)
+        weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+        return queryset.filter(RawSQL(
+            f'products_product.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)',
+            (match,), output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            f'(SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = products_product.id)',
+            (match,), output_field=FloatField()
+        )).order_by('-search_rank', '-created_at')
+
+
+_sqlite_fts_tables = {}
+
+
+def get_backend(connection):
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    if connection.vendor == 'sqlite':
+        # SQLite builds without FTS5 skip the table in the migration
+        if connection.alias not in _sqlite_fts_tables:
+            _sqlite_fts_tables[connection.alias] = \
+                FTS_TABLE in connection.introspection.table_names()
+        if _sqlite_fts_tables[connection.alias]:
+            return SQLiteSearchBackend()
+    return None
+
+
+def create_search_index(connection):
+    if connection.vendor == 'postgresql':
+        PostgresSearchBackend().create(connection)
+    elif connection.vendor == 'sqlite':
+        try:
+            SQLiteSearchBackend().create(connection)
+        except Exception as e:
+            logger.warning('FTS5 unavailable, using icontains search: %s', e)
+    _sqlite_fts_tables.pop(connection.alias, None)
+
+
+def drop_search_index(connection):
+    if connection.vendor == 'postgresql':
+        PostgresSearchBackend().drop(connection)
+    elif connection.vendor == 'sqlite':
+        SQLiteSearchBackend().drop(connection)
+    _sqlite_fts_tables.pop(connection.alias, None)
+
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_indexing():
+    """
+    Collects products saved inside the block and indexes them once on exit,
+    so imports that save a product several times only build its document once.
+    """
+    if getattr(_deferred, 'pending', None) is not None:
+        yield
+        return
+    _deferred.pending = {}
+    try:
+        yield
+    finally:
+        pending, _deferred.pending = _deferred.pending, None
+        for using, pks in pending.items():
+            reindex_products(pks, using=using)
+        if pending:
+            # Responses cached during the block searched the old index
+            invalidate_tags('products')
+
+
+def reindex_products(pks, using='default'):
+    from .models import Product
+
+    pks = list(pks)
+    connection = connections[using]
+    backend = get_backend(connection)
+    if backend is None:
+        return
+    for start in range(0, len(pks), INDEX_BATCH_SIZE):
+        rows = Product.objects.using(using).filter(
+            pk__in=pks[start:start + INDEX_BATCH_SIZE]).values_list('pk', *DOCUMENT_FIELDS)
+        backend.index(connection, list(rows))
+
+
+def index_product(product):
+    using = product._state.db or 'default'
+    pending = getattr(_deferred, 'pending', None)
+    if pending is not None:
+        pending.setdefault(using, set()).add(product.pk)
+        return
+    connection = connections[using]
+    backend = get_backend(connection)
+    if backend is not None:
+        backend.index(connection, [
+            (product.pk, *(getattr(product, field) for field in DOCUMENT_FIELDS))])
+
+
+def unindex_product(product):
+    connection = connections[product._state.db or 'default']
+    backend = get_backend(connection)
+    if backend is not None:
+        backend.remove(connection, [product.pk])
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """`?search=` ranked by the full-text index where the database has one."""
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        backend = get_backend(connections[queryset.db])
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+        return backend.search(queryset, terms)
@@ -1,11 +1,29 @@
 from rest_framework import serializers
 from accounts.serializers import UserSerializer
-from .models import Product, ProductCategory, ProductImage, ProductSubSubCategory, Wishlist, ProductReview, ProductSubCategory, Size, Color, ProductSubSubCategory
-from django.db.models import Avg
+from .models import Product, ProductCategory, ProductImage, ProductSubSubCategory, Wishlist, ProductReview, ProductSubCategory, Size, Color, ProductSubSubCategory, ProductRatingStats, ImportJob
 from rest_framework.validators import UniqueTogetherValidator
+from ecommerce.renditions import SrcsetField
+from .cache import get_wishlisted_product_ids
+
+# Reviews embedded in the product detail
+LATEST_REVIEWS_COUNT = 5
+# Import bookkeeping (supplier URLs and sync hashes) and the raw trending
+# score (only meaningful to ?ordering=trending), never sent to clients
+PRIVATE_PRODUCT_FIELDS = [
+    'import_hash', 'thumbnail_image_source_url', 'trending_score', 'trending_updated_at',
+]
+
+
+def get_rating_stats(product):
+    """Returns the denormalized rating stats of a product, or None if it has no reviews yet."""
+    try:
+        return product.rating_stats
+    except ProductRatingStats.DoesNotExist:
+        return None
 
 
 class CategorySerializer(serializers.ModelSerializer):
+    image_srcset = SrcsetField()
 
     class Meta:
         model = ProductCategory
@@ -14,10 +32,11 @@ class CategorySerializer(serializers.ModelSerializer):
 
 class CategorySmallSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = SrcsetField()
 
     class Meta:
         model = ProductCategory
-        fields = ['id', 'name', 'slug', 'image', 'description']
+        fields = ['id', 'name', 'slug', 'image', 'image_srcset', 'description']
 
     def get_image(self, obj):
         if obj.image:
@@ -33,6 +52,7 @@ class CategoryListSerializer(serializers.ModelSerializer):
 
 class SubCategorySerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = SrcsetField()
 
     class Meta:
         model = ProductSubCategory
@@ -52,11 +72,12 @@ class SubCategoryListSerializer(serializers.ModelSerializer):
 
 class SubCategorySmallSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = SrcsetField()
     category = CategorySmallSerializer(read_only=True)
 
     class Meta:
         model = ProductSubCategory
-        fields = ['id', 'name', 'slug', 'description', 'image', 'category']
+        fields = ['id', 'name', 'slug', 'description', 'image', 'image_srcset', 'category']
 
     def get_image(self, obj):
         if obj.image:
@@ -72,6 +93,7 @@ class SubSubCategoryListSerializer(serializers.ModelSerializer):
 
 class SubSubCategorySerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = SrcsetField()
     subcategory_id = serializers.PrimaryKeyRelatedField(
         queryset=ProductSubCategory.objects.all(),
         write_only=True,
@@ -83,7 +105,7 @@ class SubSubCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductSubSubCategory
         fields = ['id', 'name', 'slug', 'description',
-                  'image', 'subcategory_id']
+                  'image', 'image_srcset', 'subcategory_id']
 
     def get_image(self, obj):
         if obj.image:
@@ -93,11 +115,12 @@ class SubSubCategorySerializer(serializers.ModelSerializer):
 
 class SubSubCategorySmallSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = SrcsetField()
     subcategory = SubCategoryListSerializer(read_only=True)
 
     class Meta:
         model = ProductSubSubCategory
-        fields = ['id', 'name', 'slug', 'subcategory', 'image', 'description']
+        fields = ['id', 'name', 'slug', 'subcategory', 'image', 'image_srcset', 'description']
 
     def get_image(self, obj):
         if obj.image:
@@ -119,10 +142,11 @@ class ColorSerializer(serializers.ModelSerializer):
 
 class ProductImageSmallSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = SrcsetField()
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'image_alt_description',
+        fields = ['id', 'image', 'image_srcset', 'image_alt_description',
                   'color', 'stock', 'product']
 
     def get_image(self, obj):
@@ -136,12 +160,14 @@ class ProductImageSmallSerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = SrcsetField()
     is_in_stock = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'image_alt_description',
+        fields = ['id', 'image', 'image_srcset', 'image_alt_description',
                   'color', 'stock', 'product', 'is_in_stock']
+        method_field_sources = {'is_in_stock': 'stock'}
 
     def get_image(self, obj):
         request = self.context.get('request')
@@ -191,17 +217,19 @@ class ProductSerializer(serializers.ModelSerializer):
         allow_null=True
     )
     thumbnail_image = serializers.SerializerMethodField()
+    thumbnail_image_srcset = SrcsetField()
     is_wishlisted = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = PRIVATE_PRODUCT_FIELDS
         validators = [
             UniqueTogetherValidator(
                 queryset=Product.objects.all(),
                 fields=['name', 'subsubcategory_id']
             )
         ]
+        method_field_sources = {'is_wishlisted': []}
 
     def get_thumbnail_image(self, obj):
         if obj.thumbnail_image:
@@ -209,12 +237,15 @@ class ProductSerializer(serializers.ModelSerializer):
         return None
 
     def get_is_wishlisted(self, obj):
-        if not self.context.get('request').user.is_authenticated:
+        request = self.context.get('request')
+        if not request or not request.user.is_authenticated:
             return False
-        user = self.context.get('request').user
-        if user:
-            return Wishlist.objects.filter(user=user, product=obj).exists()
-        return False
+        wishlisted = self.context.get('wishlisted_product_ids')
+        if wishlisted is None:
+            # Not provided by the view, load it once for the whole serializer tree
+            wishlisted = get_wishlisted_product_ids(request.user)
+            self.context['wishlisted_product_ids'] = wishlisted
+        return obj.pk in wishlisted
 
     def create(self, validated_data):
         request = self.context.get('request')
@@ -265,7 +296,8 @@ class ProductSerializer(serializers.ModelSerializer):
         # Update thumbnail image if provided
         if thumbnail_image:
             if instance.thumbnail_image:
-                instance.thumbnail_image.delete()
+                # A shared blob stays, the save below releases it
+                instance.thumbnail_image.delete(save=False)
             instance.thumbnail_image = thumbnail_image
 
         # Remove size from validated_data as we'll handle it separately
@@ -296,7 +328,7 @@ class ProductSerializer(serializers.ModelSerializer):
                     product_image = ProductImage.objects.get(
                         id=image_id, product=instance)
                     if image_file:
-                        product_image.image.delete()
+                        product_image.image.delete(save=False)
                         product_image.image = image_file
                         product_image.image_alt_description = image_file.name
                     if color is not None:
@@ -333,32 +365,51 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     size = SizeSerializer(many=True, read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
     thumbnail_image = serializers.SerializerMethodField()
+    thumbnail_image_srcset = SrcsetField()
     category = CategorySerializer(read_only=True)
     subcategory = SubCategorySerializer(read_only=True)
     subsubcategory = SubSubCategorySerializer(read_only=True)
-    reviews = ProductReviewSmallSerializer(
-        many=True, read_only=True, source='productreview_set')
+    # Only the latest reviews, the rest come from /products/<slug>/reviews/
+    reviews = serializers.SerializerMethodField()
     reviews_count = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
+    rating_distribution = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = PRIVATE_PRODUCT_FIELDS
+        method_field_sources = {
+            'reviews': [],
+            'reviews_count': 'rating_stats',
+            'average_rating': 'rating_stats',
+            'rating_distribution': 'rating_stats',
+        }
 
     def get_thumbnail_image(self, obj):
         if obj.thumbnail_image:
             return f'/media/{obj.thumbnail_image.name}'
         return None
 
+    def get_reviews(self, obj):
+        reviews = obj.productreview_set.select_related('user').order_by(
+            '-created_at', '-id')[:LATEST_REVIEWS_COUNT]
+        return ProductReviewSmallSerializer(reviews, many=True, context=self.context).data
+
     def get_reviews_count(self, obj):
-        return ProductReview.objects.only('id').filter(product=obj).count()
+        stats = get_rating_stats(obj)
+        return stats.reviews_count if stats else 0
 
     def get_average_rating(self, obj):
-        return ProductReview.objects.only('id').filter(product=obj).aggregate(
-            avg_rating=Avg('rating'))['avg_rating'] or 0
+        stats = get_rating_stats(obj)
+        return stats.average_rating if stats else 0
+
+    def get_rating_distribution(self, obj):
+        stats = get_rating_stats(obj)
+        return stats.distribution if stats else {star: 0 for star in range(1, 6)}
 
 
 class ProductSmallSerializer(serializers.ModelSerializer):
+    thumbnail_image_srcset = SrcsetField()
     category = CategorySerializer(read_only=True)
     subcategory = SubCategorySerializer(read_only=True)
     subsubcategory = SubSubCategorySerializer(read_only=True)
@@ -366,7 +417,7 @@ class ProductSmallSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'name', 'slug', 'market_price',
-                  'price', 'thumbnail_image', 'meta_title', 'meta_description', 'category', 'subcategory', 'subsubcategory']
+                  'price', 'thumbnail_image', 'thumbnail_image_srcset', 'meta_title', 'meta_description', 'category', 'subcategory', 'subsubcategory']
 
 
 class WishlistSerializer(serializers.ModelSerializer):
@@ -384,6 +435,7 @@ class WishlistSerializer(serializers.ModelSerializer):
 
 
 class ProductListSerializer(serializers.ModelSerializer):
+    thumbnail_image_srcset = SrcsetField()
     images = ProductImageSmallSerializer(many=True, read_only=True)
     category = CategoryListSerializer(read_only=True)
     subcategory = SubCategoryListSerializer(read_only=True)
@@ -397,23 +449,31 @@ class ProductListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = [
-            'id', 'name', 'slug', 'price', 'market_price', 'thumbnail_image', 'thumbnail_image_alt_description', 'stock',
+            'id', 'name', 'slug', 'price', 'market_price', 'thumbnail_image', 'thumbnail_image_srcset', 'thumbnail_image_alt_description', 'stock',
             'reviews_count', 'average_rating', 'category', 'subcategory', 'subsubcategory', 'is_featured', 'is_popular', 'is_active', 'is_color_available', 'is_size_available',
             'images', 'size'
         ]
+        method_field_sources = {
+            'reviews_count': 'rating_stats',
+            'average_rating': 'rating_stats',
+            'is_color_available': 'images.color',
+            'is_size_available': 'size',
+        }
 
     def get_reviews_count(self, obj):
-        return ProductReview.objects.only('id').filter(product=obj).count()
+        stats = get_rating_stats(obj)
+        return stats.reviews_count if stats else 0
 
     def get_average_rating(self, obj):
-        return ProductReview.objects.only('id').filter(product=obj).aggregate(
-            avg_rating=Avg('rating'))['avg_rating'] or 0
+        stats = get_rating_stats(obj)
+        return stats.average_rating if stats else 0
 
+    # Both read the prefetched relations instead of querying per product
     def get_is_color_available(self, obj):
-        return obj.images.filter(color__isnull=False).exclude(color='').exists()
+        return any(image.color for image in obj.images.all())
 
     def get_is_size_available(self, obj):
-        return obj.size.exists()
+        return len(obj.size.all()) > 0
 
 
 class ProductReviewSerializer(serializers.ModelSerializer):
@@ -443,3 +503,12 @@ class ProductReviewDetailSerializer(serializers.ModelSerializer):
 
 class ImportSerializer(serializers.Serializer):
     file = serializers.FileField()
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportJob
+        fields = ['id', 'status', 'mode', 'deactivate_missing', 'original_name', 'rows_total',
+                  'rows_processed', 'products_created', 'products_updated', 'products_unchanged',
+                  'products_skipped', 'products_deactivated', 'error_count', 'errors',
+                  'message', 'created_at', 'started_at', 'finished_at', 'updated_at']
@@ -0,0 +1,201 @@
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .cache import invalidate_tags
+from .search import index_product, reindex_products, unindex_product
+from . import autocomplete
+from ecommerce import renditions, storage
+from .models import (
+    Product, ProductCategory, ProductImage, ProductRatingStats, ProductReview,
+    ProductSubCategory, ProductSubSubCategory, Size)
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_stored_rating(sender, instance, **kwargs):
+    # Keep what is currently stored so an update can move the old vote out
+    instance._stored_rating = None
+    if instance.pk:
+        instance._stored_rating = ProductReview.objects.filter(
+            pk=instance.pk).values_list('product_id', 'rating').first()
+
+
+@receiver(post_save, sender=ProductReview)
+def update_rating_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    stored = getattr(instance, '_stored_rating', None)
+    if stored:
+        ProductRatingStats.record(stored[0], stored[1], -1)
+    ProductRatingStats.record(instance.product_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=ProductReview)
+def update_rating_stats_on_delete(sender, instance, **kwargs):
+    ProductRatingStats.record(instance.product_id, instance.rating, -1)
+
+
+# Response cache invalidation
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_tags(sender, instance, **kwargs):
+    invalidate_tags('products', f'product:{instance.pk}')
+
+
+@receiver(m2m_changed, sender=Product.size.through)
+def invalidate_product_size_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_tags('products', f'product:{instance.pk}')
+    elif pk_set:
+        invalidate_tags('products', *(f'product:{pk}' for pk in pk_set))
+    else:
+        # clear() from the size side doesn't say which products were affected
+        invalidate_tags('products', f'size:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_product_image_tags(sender, instance, **kwargs):
+    invalidate_tags('product-images', f'product:{instance.product_id}')
+
+
+@receiver([post_save, post_delete], sender=ProductReview)
+def invalidate_product_review_tags(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_rating', None)
+    invalidate_tags('product-ratings', f'product:{instance.product_id}',
+                    f'product:{stored[0]}' if stored else None)
+
+
+@receiver([post_save, post_delete], sender=ProductCategory)
+def invalidate_category_tags(sender, instance, **kwargs):
+    invalidate_tags('categories', f'category:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=ProductSubCategory)
+def invalidate_subcategory_tags(sender, instance, **kwargs):
+    invalidate_tags('subcategories', f'subcategory:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=ProductSubSubCategory)
+def invalidate_subsubcategory_tags(sender, instance, **kwargs):
+    invalidate_tags('subsubcategories', f'subsubcategory:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Size)
+def invalidate_size_tags(sender, instance, **kwargs):
+    invalidate_tags('sizes', f'size:{instance.pk}')
+
+
+# Full-text search index
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_product(instance)
+
+
+# Autocomplete index
+
+@receiver(post_save, sender=Product)
+def update_autocomplete_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.index_product(instance)
+
+
+@receiver(post_save, sender=ProductCategory)
+def update_autocomplete_category(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.index_entry(autocomplete.category_entry(instance))
+
+
+@receiver(post_save, sender=ProductSubCategory)
+def update_autocomplete_subcategory(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.index_entry(autocomplete.subcategory_entry(instance))
+
+
+@receiver(post_save, sender=ProductSubSubCategory)
+def update_autocomplete_subsubcategory(sender, instance, raw=False, **kwargs):
+    if not raw:
+        autocomplete.index_entry(autocomplete.subsubcategory_entry(instance))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_delete, sender=ProductSubCategory)
+@receiver(post_delete, sender=ProductSubSubCategory)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    kind = {
+        Product: 'product',
+        ProductCategory: 'category',
+        ProductSubCategory: 'subcategory',
+        ProductSubSubCategory: 'subsubcategory',
+    }[sender]
+    autocomplete.unindex_entry(kind, instance.pk)
+
+
+# Image renditions, cached responses are refreshed once they are ready
+
+def product_thumbnail_rendered(product):
+    invalidate_tags('products', f'product:{product.pk}')
+
+
+def product_image_rendered(image):
+    invalidate_tags('product-images', f'product:{image.product_id}')
+
+
+def category_image_rendered(category):
+    invalidate_tags('categories', f'category:{category.pk}')
+
+
+def subcategory_image_rendered(subcategory):
+    invalidate_tags('subcategories', f'subcategory:{subcategory.pk}')
+
+
+def subsubcategory_image_rendered(subsubcategory):
+    invalidate_tags('subsubcategories', f'subsubcategory:{subsubcategory.pk}')
+
+
+renditions.register(Product, 'thumbnail_image', product_thumbnail_rendered)
+renditions.register(ProductImage, 'image', product_image_rendered)
+renditions.register(ProductCategory, 'image', category_image_rendered)
+renditions.register(ProductSubCategory, 'image', subcategory_image_rendered)
+renditions.register(ProductSubSubCategory, 'image', subsubcategory_image_rendered)
+
+
+# Reference counts of the shared image files
+
+storage.register(Product, 'thumbnail_image')
+storage.register(ProductImage, 'image')
+storage.register(ProductCategory, 'image')
+storage.register(ProductSubCategory, 'image')
+storage.register(ProductSubSubCategory, 'image')
+
+
+def products_bulk_saved(products, images=()):
+    """
+    What the signals above do for products and images written with
+    bulk_create, bulk_update or update(), which send no signals.
+    """
+    if not products and not images:
+        return
+    invalidate_tags('products', 'product-images', *(f'product:{product.pk}' for product in products))
+    reindex_products([product.pk for product in products])
+    autocomplete.index_products(products)
+    renditions.schedule_saved(products, 'thumbnail_image')
+    renditions.schedule_saved(images, 'image')
+
+
+def categories_bulk_created(categories, subcategories, subsubcategories):
+    """What the signals above do for categories inserted with bulk_create."""
+    invalidate_tags('categories' if categories else None,
+                    'subcategories' if subcategories else None,
+                    'subsubcategories' if subsubcategories else None)
+    autocomplete.index_entries(
+        [autocomplete.category_entry(category) for category in categories] +
+        [autocomplete.subcategory_entry(subcategory) for subcategory in subcategories] +
+        [autocomplete.subsubcategory_entry(subsubcategory) for subsubcategory in subsubcategories])
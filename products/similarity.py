@@ -0,0 +1,196 @@
+"""
+Content-based similar products.
+
+Each active product gets a TF-IDF vector over its name, description and
+specifications (sparse, L2 normalised). The similarity of two products
+blends the cosine of those vectors with how much of the category path they
+share and how close their prices are. The top neighbours of every product
+are stored as ProductRecommendation rows by the build_similar_products
+command.
+"""
+import re
+
+import numpy as np
+from scipy import sparse
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import Product, ProductRecommendation
+
+TOP_K = 12
+# Name words count as much as this many description words
+NAME_BOOST = 3
+TEXT_WEIGHT = 0.6
+PATH_WEIGHT = 0.25
+PRICE_WEIGHT = 0.15
+# Share of the path score for a matching category, subcategory, subsubcategory
+PATH_LEVEL_WEIGHTS = (0.2, 0.3, 0.5)
+# Prices this many times apart score exp(-1)
+PRICE_BAND = 1.5
+CHUNK_SIZE = 256
+# Cap on the cells of a chunk's score matrix (8 bytes each), large catalogs
+# score fewer rows at a time
+CHUNK_CELLS = 1 << 22
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from has in is it its of on or that the to with'.split())
+
+
+def tokenize(text):
+    return [token for token in re.findall(r'[a-z0-9]+', strip_tags(text or '').lower())
+            if len(token) > 1 and token not in STOP_WORDS]
+
+
+class SimilarityIndex:
+    """Feature matrices for a set of products, see load_index()."""
+
+    def __init__(self, rows):
+        # rows: (id, name, description, specifications,
+        #        category_id, subcategory_id, subsubcategory_id, price)
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.positions = {pk: i for i, pk in enumerate(self.ids.tolist())}
+        self.vectors = self.build_vectors(rows)
+        self.vectors_t = self.vectors.T.tocsr()
+        # 0 never matches, the path comparison masks it out
+        self.paths = np.array([[row[4] or 0, row[5] or 0, row[6] or 0] for row in rows],
+                              dtype=np.int64).reshape(len(rows), 3)
+        prices = np.array([float(row[7] or 0) for row in rows])
+        self.has_price = prices > 0
+        self.log_prices = np.log(np.where(self.has_price, prices, 1.0))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def build_vectors(rows):
+        vocabulary = {}
+        indptr, indices, data = [0], [], []
+        for _, name, description, specifications, *_ in rows:
+            counts = {}
+            for token in tokenize(name):
+                counts[token] = counts.get(token, 0) + NAME_BOOST
+            for token in tokenize(description) + tokenize(specifications):
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                indices.append(vocabulary.setdefault(token, len(vocabulary)))
+                data.append(count)
+            indptr.append(len(indices))
+        tf = sparse.csr_matrix(
+            (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), indptr),
+            shape=(len(rows), max(len(vocabulary), 1)))
+        # Sublinear term frequency, smoothed idf
+        tf.data = 1 + np.log(tf.data)
+        df = np.bincount(tf.indices, minlength=tf.shape[1])
+        idf = np.log((1 + len(rows)) / (1 + df)) + 1
+        tfidf = tf @ sparse.diags(idf)
+        norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return (sparse.diags(1 / norms) @ tfidf).tocsr()
+
+    def chunk_size(self):
+        return max(1, min(CHUNK_SIZE, CHUNK_CELLS // max(len(self), 1)))
+
+    def scores(self, positions):
+        """Blended similarity of the products at `positions` (rows) to every product."""
+        positions = np.asarray(positions, dtype=np.int64)
+        # Built in place so a chunk holds one dense matrix plus the price one
+        scores = np.zeros((len(positions), len(self)))
+        for level, weight in enumerate(PATH_LEVEL_WEIGHTS):
+            own = self.paths[positions, level][:, None]
+            match = (own == self.paths[None, :, level]) & (own > 0)
+            np.add(scores, PATH_WEIGHT * weight, out=scores, where=match)
+
+        price = np.subtract.outer(self.log_prices[positions], self.log_prices)
+        np.abs(price, out=price)
+        price *= -1 / np.log(PRICE_BAND)
+        np.exp(price, out=price)
+        price *= PRICE_WEIGHT
+        has_price = self.has_price[positions][:, None] & self.has_price[None, :]
+        np.add(scores, price, out=scores, where=has_price)
+        del price, has_price
+
+        # Text scores stay sparse, only products sharing a term get one
+        text = (self.vectors[positions] @ self.vectors_t).tocoo()
+        scores[text.row, text.col] += TEXT_WEIGHT * text.data
+        # A product is not its own neighbour
+        scores[np.arange(len(positions)), positions] = -np.inf
+        return scores
+
+    def neighbours(self, positions, k=TOP_K):
+        """Yields (product id, [(neighbour id, score), ...]) best first."""
+        k = min(k, len(self) - 1)
+        positions = np.asarray(positions, dtype=np.int64)
+        size = self.chunk_size()
+        for start in range(0, len(positions), size):
+            chunk = positions[start:start + size]
+            if k <= 0:
+                for position in chunk:
+                    yield int(self.ids[position]), []
+                continue
+            scores = self.scores(chunk)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for row, position in enumerate(chunk):
+                best = top[row][np.argsort(-scores[row, top[row]], kind='stable')]
+                yield int(self.ids[position]), [
+                    (int(self.ids[i]), float(scores[row, i])) for i in best]
+
+
+def load_index():
+    rows = list(Product.objects.filter(is_active=True).order_by('id').values_list(
+        'id', 'name', 'description', 'specifications',
+        'category_id', 'subcategory_id', 'subsubcategory_id', 'price'))
+    return SimilarityIndex(rows)
+
+
+def affected_positions(index, since):
+    """
+    Positions whose neighbours may have changed since the last build:
+    changed products, products listing a changed or deleted product, and
+    products a changed product now beats the weakest neighbour of.
+    """
+    similar = ProductRecommendation.objects.filter(kind=ProductRecommendation.SIMILAR)
+    changed_ids = list(Product.objects.filter(
+        updated_at__gt=since).values_list('id', flat=True))
+    affected = {index.positions[pk] for pk in changed_ids if pk in index.positions}
+    changed = sorted(affected)
+
+    listing = similar.filter(recommended_id__in=changed_ids).values_list(
+        'product_id', flat=True).distinct()
+    affected.update(index.positions[pk] for pk in listing if pk in index.positions)
+
+    expected = min(TOP_K, len(index) - 1)
+    stats = {row['product_id']: row for row in similar.values('product_id').annotate(
+        count=Count('id'), weakest=Min('score'))}
+    weakest = np.full(len(index), -np.inf)
+    for pk, position in index.positions.items():
+        row = stats.get(pk)
+        if row is None or row['count'] < expected:
+            affected.add(position)
+        else:
+            weakest[position] = row['weakest']
+
+    # Similarity is symmetric, so the changed rows give every product's score
+    # against the changed ones
+    size = index.chunk_size()
+    for start in range(0, len(changed), size):
+        best = index.scores(changed[start:start + size]).max(axis=0)
+        affected.update(np.flatnonzero(best > weakest).tolist())
+    return sorted(affected)
+
+
+def build_similar_products(full=False):
+    """Rebuilds the stored similar products, only the affected ones unless `full`."""
+    built_at = timezone.now()
+    similar = ProductRecommendation.objects.filter(kind=ProductRecommendation.SIMILAR)
+    since = similar.aggregate(last=Max('updated_at'))['last']
+
+    # Deactivated products neither get nor appear in recommendations, the
+    # lists that shrink here are picked up as affected
+    similar.filter(Q(product__is_active=False) | Q(recommended__is_active=False)).delete()
+    index = load_index()
+    if full or since is None:
+        positions = list(range(len(index)))
+    else:
+        positions = affected_positions(index, since)
+    return ProductRecommendation.store(
+        ProductRecommendation.SIMILAR, index.neighbours(positions), built_at)
@@ -1,3 +1,515 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from accounts.models import User
+from ecommerce import storage
+from . import autocomplete, importer
+from .cache import invalidate_tags
+from .models import (
+    ImportJob, Product, ProductCategory, ProductImage, ProductRatingStats, ProductReview,
+    ProductSubCategory, ProductSubSubCategory, Size, StoredBlob)
+from .views import ProductListCreateView
+
+
+class MediaTestCase(TestCase):
+    """Runs with MEDIA_ROOT in a temporary directory."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class SharedBlobTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        category = ProductCategory.objects.create(name='Toys')
+        subcategory = ProductSubCategory.objects.create(name='Cars', category=category)
+        self.subsubcategory = ProductSubSubCategory.objects.create(
+            name='Trucks', subcategory=subcategory)
+        self.first, self.second = [
+            Product.objects.create(
+                name=name, price=10, subsubcategory=self.subsubcategory,
+                thumbnail_image=SimpleUploadedFile(f'{name}.jpg', b'same bytes'))
+            for name in ['First', 'Second']]
+
+    def test_replacing_a_shared_thumbnail_keeps_the_other_products_file(self):
+        shared = self.second.thumbnail_image.name
+        self.assertEqual(self.first.thumbnail_image.name, shared)
+        self.assertEqual(StoredBlob.objects.get(name=shared).ref_count, 2)
+
+        response = APIClient().patch(
+            f'/api/products/{self.subsubcategory.slug}/{self.first.slug}/',
+            {'thumbnail_image': SimpleUploadedFile('new.jpg', b'other bytes')},
+            format='multipart')
+
+        self.assertEqual(response.status_code, 200)
+        self.first.refresh_from_db()
+        self.assertNotEqual(self.first.thumbnail_image.name, shared)
+        self.assertTrue(storage.blob_storage.exists(shared))
+        self.assertEqual(StoredBlob.objects.get(name=shared).ref_count, 1)
+        self.assertEqual(StoredBlob.objects.get(name=self.first.thumbnail_image.name).ref_count, 1)
+
+    def test_garbage_collection_removes_blobs_once_unreferenced(self):
+        shared = self.first.thumbnail_image.name
+        self.first.delete()
+        self.second.delete()
+        self.assertEqual(StoredBlob.objects.get(name=shared).ref_count, 0)
+        self.assertTrue(storage.blob_storage.exists(shared))
+
+        self.assertEqual(storage.collect_garbage(grace=-storage.GRACE_PERIOD), 1)
+        self.assertFalse(storage.blob_storage.exists(shared))
+
+    def test_garbage_collection_removes_blobs_whose_row_was_rolled_back(self):
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            product = Product.objects.create(
+                name='Third', price=10, subsubcategory=self.subsubcategory,
+                thumbnail_image=SimpleUploadedFile('third.jpg', b'third bytes'))
+            raise DatabaseError('rolled back')
+        orphan = product.thumbnail_image.name
+        self.assertTrue(storage.blob_storage.exists(orphan))
+        self.assertFalse(StoredBlob.objects.filter(name=orphan).exists())
+
+        # Could still be committed by a transaction that is running
+        self.assertEqual(storage.collect_garbage(), 0)
+        self.assertEqual(storage.collect_garbage(grace=-storage.GRACE_PERIOD), 1)
+        self.assertFalse(storage.blob_storage.exists(orphan))
+        self.assertTrue(storage.blob_storage.exists(self.first.thumbnail_image.name))
+
+
+class ProductFieldTests(MediaTestCase):
+    def test_internal_columns_are_not_serialized(self):
+        category = ProductCategory.objects.create(name='Toys')
+        subcategory = ProductSubCategory.objects.create(name='Cars', category=category)
+        subsubcategory = ProductSubSubCategory.objects.create(name='Trucks', subcategory=subcategory)
+        product = Product.objects.create(
+            name='Truck', price=10, subsubcategory=subsubcategory, import_hash='abc',
+            thumbnail_image_source_url='https://supplier.example/truck.jpg', trending_score=1.5)
+        client = APIClient()
+
+        detail = client.get(f'/api/products/{subsubcategory.slug}/{product.slug}/').json()
+        listed = client.get('/api/products/?ordering=trending&cursor=').json()['results'][0]
+        for fields in [detail, listed]:
+            self.assertEqual(fields['name'], 'Truck')
+            for name in ['import_hash', 'thumbnail_image_source_url',
+                         'trending_score', 'trending_updated_at']:
+                self.assertNotIn(name, fields)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, url):
+        """The names of every page following the next links, and the responses."""
+        names, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append(response.json())
+            names += [product['name'] for product in pages[-1]['results']]
+            url = pages[-1]['next']
+        return names, pages
+
+    def create_products(self):
+        prices = [5, None, 3, None, 5, 1, 2]
+        for index, price in enumerate(prices):
+            Product.objects.create(name=f'Product {index}', price=price)
+        # Ascending with NULLs last, ties by pk
+        ascending = [f'Product {index}' for index, price in sorted(
+            enumerate(prices), key=lambda item: (item[1] is None, item[1] or 0, item[0]))]
+        return ascending
+
+    def walk_back(self, url):
+        names = []
+        while url:
+            page = self.client.get(url).json()
+            names = [product['name'] for product in page['results']] + names
+            url = page['previous']
+        return names
+
+    def test_pages_seek_past_null_keys_in_both_directions(self):
+        ascending = self.create_products()
+        names, pages = self.walk('/api/products/?ordering=price&cursor=&page_size=2')
+        self.assertEqual(names, ascending)
+        self.assertEqual(len(pages), 4)
+        self.assertIsNone(pages[0]['previous'])
+
+        # NULLs are the largest value, so they come first descending
+        names, pages = self.walk('/api/products/?ordering=-price&cursor=&page_size=2')
+        self.assertEqual(names, ascending[::-1])
+
+    def test_previous_cursors_walk_back_to_the_first_page(self):
+        ascending = self.create_products()
+        names, pages = self.walk('/api/products/?ordering=price&cursor=&page_size=3')
+        self.assertEqual(self.walk_back(pages[-1]['previous']) + [
+            product['name'] for product in pages[-1]['results']], ascending)
+        # The first page reached going back links forward again
+        first = self.client.get(pages[1]['previous']).json()
+        self.assertEqual([product['name'] for product in first['results']], ascending[:3])
+        self.assertIsNotNone(first['next'])
+
+    def test_invalid_and_foreign_cursors_are_not_found(self):
+        self.create_products()
+        _, pages = self.walk('/api/products/?ordering=price&cursor=&page_size=2')
+        cursor = pages[0]['next'].split('cursor=')[1].split('&')[0]
+        for url in ['/api/products/?cursor=not-a-cursor',
+                    '/api/products/?cursor=e30',
+                    f'/api/products/?ordering=name&cursor={cursor}']:
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+        self.assertEqual(self.client.get(
+            f'/api/products/?ordering=price&cursor={cursor}').status_code, 200)
+
+    def test_total_is_only_counted_when_asked_for(self):
+        self.create_products()
+        page = self.client.get('/api/products/?cursor=&page_size=2').json()
+        self.assertNotIn('count', page)
+        page = self.client.get('/api/products/?cursor=&page_size=2&include_total=1').json()
+        self.assertEqual(page['count'], 7)
+        self.assertEqual(len(page['results']), 2)
+
+    def test_search_pages_keep_the_rank_order(self):
+        # Oldest first, so newest-first is the reverse of the rank order
+        for name, description in [('Truck red', ''), ('Truck blue', ''), ('Lamp', 'truck'),
+                                  ('Chair', 'truck lamp'), ('Table', '')]:
+            Product.objects.create(name=name, price=10, description=description)
+        ranked = [product['name'] for product in self.client.get(
+            '/api/products/?search=truck').json()['results']]
+        self.assertEqual(len(ranked), 4)
+        self.assertEqual(set(ranked[:2]), {'Truck red', 'Truck blue'})
+
+        names, pages = self.walk('/api/products/?search=truck&cursor=&page_size=1')
+        self.assertEqual(names, ranked)
+        # Back from the last page
+        response = self.client.get(pages[-1]['previous'])
+        self.assertEqual([product['name'] for product in response.json()['results']], ranked[-2:-1])
+
+
+class RatingStatsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(User.objects.create_user(username='reviewer', password='x'))
+        category = ProductCategory.objects.create(name='Toys')
+        subcategory = ProductSubCategory.objects.create(name='Cars', category=category)
+        self.subsubcategory = ProductSubSubCategory.objects.create(
+            name='Trucks', subcategory=subcategory)
+        self.truck, self.lamp = [
+            Product.objects.create(name=name, price=10, subsubcategory=self.subsubcategory)
+            for name in ['Truck', 'Lamp']]
+
+    def review(self, product, rating):
+        response = self.client.post('/api/product-reviews/', {
+            'product_id': product.pk, 'rating': rating, 'review': 'Fine'})
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def stats(self, product_id):
+        stats = ProductRatingStats.objects.filter(product_id=product_id).first()
+        if stats is None:
+            return None
+        return stats.reviews_count, stats.average_rating, stats.distribution
+
+    def test_stats_follow_reviews_being_created_updated_and_deleted(self):
+        first = self.review(self.truck, 5)
+        self.review(self.truck, 3)
+        self.assertEqual(self.stats(self.truck.pk), (2, 4.0, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1}))
+
+        self.client.patch(f'/api/product-reviews/{first}/', {'rating': 1})
+        self.assertEqual(self.stats(self.truck.pk), (2, 2.0, {1: 1, 2: 0, 3: 1, 4: 0, 5: 0}))
+
+        # Moved to another product, the vote moves with it
+        self.client.patch(f'/api/product-reviews/{first}/', {'product_id': self.lamp.pk})
+        self.assertEqual(self.stats(self.truck.pk), (1, 3.0, {1: 0, 2: 0, 3: 1, 4: 0, 5: 0}))
+        self.assertEqual(self.stats(self.lamp.pk), (1, 1.0, {1: 1, 2: 0, 3: 0, 4: 0, 5: 0}))
+
+        self.client.delete(f'/api/product-reviews/{first}/')
+        self.assertEqual(self.stats(self.lamp.pk), (0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}))
+        detail = self.client.get(
+            f'/api/products/{self.subsubcategory.slug}/{self.truck.slug}/').json()
+        self.assertEqual((detail['reviews_count'], detail['average_rating']), (1, 3.0))
+
+    def test_deleting_a_product_leaves_no_stats_behind(self):
+        self.review(self.truck, 4)
+        product_id = self.truck.pk
+        self.truck.delete()
+        self.assertFalse(ProductReview.objects.exists())
+        self.assertIsNone(self.stats(product_id))
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        category = ProductCategory.objects.create(name='Toys')
+        subcategory = ProductSubCategory.objects.create(name='Cars', category=category)
+        self.subsubcategory = ProductSubSubCategory.objects.create(
+            name='Trucks', subcategory=subcategory)
+        self.size = Size.objects.create(name='Small')
+        self.truck = Product.objects.create(
+            name='Truck', price=10, category=category, subcategory=subcategory,
+            subsubcategory=self.subsubcategory)
+        self.truck.size.add(self.size)
+
+    def get(self, url='/api/products/', **headers):
+        response = self.client.get(url, headers=headers)
+        self.assertIn(response.status_code, (200, 304))
+        return response
+
+    def warm(self):
+        # The first build doesn't know the objects' tags yet, see CachedListMixin
+        self.assertServed('MISS')
+        self.assertServed('MISS')
+        self.assertServed('HIT')
+
+    def assertServed(self, status, **headers):
+        response = self.get(**headers)
+        self.assertEqual(response['X-Cache'], status)
+        return response.json()['results'][0] if response.status_code == 200 else None
+
+    def test_list_is_served_from_the_cache_until_a_listed_product_changes(self):
+        self.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.truck.name = 'Red truck'
+            self.truck.save()
+        self.assertEqual(self.assertServed('MISS')['name'], 'Red truck')
+        self.assertServed('HIT')
+
+    def test_object_tags_refresh_the_list_when_related_rows_change(self):
+        self.warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.subsubcategory.name = 'Lorries'
+            self.subsubcategory.save()
+        self.assertEqual(self.assertServed('MISS')['subsubcategory']['name'], 'Lorries')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.size.name = 'Tiny'
+            self.size.save()
+        self.assertEqual(self.assertServed('MISS')['size'][0]['name'], 'Tiny')
+
+    def test_rolled_back_changes_leave_the_tags_alone(self):
+        self.warm()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError), transaction.atomic():
+                self.truck.save()
+                raise ValueError
+        self.assertEqual(callbacks, [])
+        self.assertServed('HIT')
+
+    def test_a_change_committed_while_building_leaves_the_entry_stale(self):
+        get_serializer = ProductListCreateView.get_serializer
+
+        def created_meanwhile(view, *args, **kwargs):
+            # Committed by another request once the (empty) page was read
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.create(name='Zebra', price=10)
+            return get_serializer(view, *args, **kwargs)
+
+        with mock.patch.object(ProductListCreateView, 'get_serializer', created_meanwhile):
+            self.assertEqual(self.get('/api/products/?name=Zebra').json()['results'], [])
+        response = self.get('/api/products/?name=Zebra')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([product['name'] for product in response.json()['results']], ['Zebra'])
+
+    def test_signed_in_users_share_the_cached_list_and_etags(self):
+        self.warm()
+        etag = self.get()['ETag']
+        self.client.force_authenticate(User.objects.create_user(username='shopper', password='x'))
+        self.assertServed('HIT')
+        response = self.get(If_None_Match=etag)
+        self.assertEqual((response.status_code, response['X-Cache']), (304, 'HIT'))
+
+
+class ExportRoundTripTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        category = ProductCategory.objects.create(name='Toys')
+        subcategory = ProductSubCategory.objects.create(name='Cars', category=category)
+        subsubcategory = ProductSubSubCategory.objects.create(name='Trucks', subcategory=subcategory)
+        # Added by hand, nothing about them came from an import
+        for index in range(3):
+            product = Product.objects.create(
+                name=f'Truck {index}', price='10.50', category=category, subcategory=subcategory,
+                subsubcategory=subsubcategory,
+                thumbnail_image=SimpleUploadedFile('thumb.jpg', f'thumb {index}'.encode()))
+            for color in ['red', 'blue']:
+                ProductImage.objects.create(
+                    product=product, color=color, stock=2,
+                    image=SimpleUploadedFile('image.jpg', f'{color} {index}'.encode()))
+        self.client = APIClient()
+
+    def sync_export(self):
+        export = b''.join(self.client.get('/api/download/products/?format=csv').streaming_content)
+        response = self.client.post('/api/product/bulk-upload/', {
+            'file': SimpleUploadedFile('products.csv', export), 'mode': 'sync'}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        job = importer.run_import_job(importer.claim_import_job())
+        self.assertEqual(job.status, ImportJob.DONE, job.message)
+        self.assertEqual(job.errors, [])
+        return job
+
+    def test_syncing_an_export_keeps_the_catalog_as_it_is(self):
+        images = set(ProductImage.objects.values_list('pk', 'image'))
+        thumbnails = set(Product.objects.values_list('pk', 'thumbnail_image'))
+
+        job = self.sync_export()
+        # Adopted by the import the first time, without downloading anything
+        self.assertEqual((job.products_created, job.products_updated), (0, 3))
+        self.assertEqual(set(ProductImage.objects.values_list('pk', 'image')), images)
+        self.assertEqual(set(Product.objects.values_list('pk', 'thumbnail_image')), thumbnails)
+
+        job = self.sync_export()
+        self.assertEqual((job.products_created, job.products_updated, job.products_unchanged),
+                         (0, 0, 3))
+        self.assertEqual(set(ProductImage.objects.values_list('pk', 'image')), images)
+
+
+class BundleImportTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as bundle:
+            bundle.writestr('products.csv', (
+                'Product Name,Category,Sub Category,Sub Sub Category,Price,Thumbnail image,Color,Images\n'
+                'Truck,Toys,Cars,Trucks,10,thumb.jpg,red,red.jpg\n'
+                ',,,,,,blue,missing.jpg\n'))
+            bundle.writestr('images/thumb.jpg', b'thumb')
+            bundle.writestr('images/red.jpg', b'red')
+        self.bundle = buffer.getvalue()
+        self.client = APIClient()
+
+    def upload(self, url):
+        return self.client.post(url, {
+            'file': SimpleUploadedFile('products.zip', self.bundle)}, format='multipart')
+
+    def test_import_reports_the_image_cells_the_dry_run_does(self):
+        report = self.upload('/api/product/bulk-upload/?dry_run=1').data
+        invalid = [(image['row'], image['url'])
+                   for entry in report['rows'] for image in entry['invalid_image_urls']]
+        self.assertEqual(invalid, [(3, 'missing.jpg')])
+
+        self.assertEqual(self.upload('/api/product/bulk-upload/').status_code, 202)
+        job = importer.run_import_job(importer.claim_import_job())
+        self.assertEqual(job.status, ImportJob.DONE, job.message)
+        self.assertEqual(job.products_created, 1)
+        self.assertEqual([(error['row'], error['error'].split(':')[0]) for error in job.errors],
+                         [(3, 'Image missing.jpg')])
+        self.assertEqual(ProductImage.objects.get().color, 'red')
+
+
+class AutocompleteSyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reset_index()
+        self.addCleanup(self.reset_index)
+
+    def reset_index(self):
+        autocomplete._index = autocomplete.PrefixIndex()
+        autocomplete._state.update(sequence=None, checked_at=0.0, missing_since=None)
+
+    def test_changes_are_applied_as_deltas_without_a_rebuild(self):
+        kept = Product.objects.create(name='Red truck', price=10)
+        removed = Product.objects.create(name='Blue truck', price=10)
+        index = autocomplete.get_index()
+        self.assertEqual(len(index), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Zebra lamp', price=10)
+            removed.delete()
+        with mock.patch.object(autocomplete, 'build_index', side_effect=AssertionError):
+            self.assertIs(autocomplete.get_index(), index)
+        self.assertEqual([result['slug'] for result in index.search('truck')], [kept.slug])
+        self.assertEqual([result['name'] for result in index.search('zebr')], ['Zebra lamp'])
+        # One typo away
+        self.assertEqual([result['name'] for result in index.search('zerba')], ['Zebra lamp'])
+
+    def test_bulk_build_matches_adding_one_by_one(self):
+        entries = [autocomplete.Entry('product', pk, name, f'p-{pk}', weight=pk % 2)
+                   for pk, name in enumerate(['Red truck', 'Red lamp', 'Blue truck', 'Truck bed'])]
+        built = autocomplete.PrefixIndex.from_entries(entries)
+        added = autocomplete.PrefixIndex()
+        for entry in entries:
+            added.add(entry)
+        for name in ['names', 'words', 'postings', 'typos']:
+            self.assertEqual(getattr(built, name), getattr(added, name), name)
+
+
+class ImportJobRetryTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        rows = ''.join(f'Truck {index},Toys,Cars,Trucks,10\n' for index in range(60))
+        self.job = ImportJob.objects.create(
+            file=SimpleUploadedFile('products.csv', (
+                'Product Name,Category,Sub Category,Sub Sub Category,Price\n' + rows).encode()),
+            original_name='products.csv')
+        self.addCleanup(lambda: self.job.file and self.job.file.delete(save=False))
+
+    def fail_once(self, chunk):
+        resolve_chunk = importer.resolve_chunk
+        calls = []
+
+        def resolve(*args):
+            calls.append(args)
+            if len(calls) == chunk:
+                raise DatabaseError('connection dropped')
+            return resolve_chunk(*args)
+        return mock.patch.object(importer, 'resolve_chunk', side_effect=resolve)
+
+    def test_a_failed_job_is_resumed_from_where_it_stopped(self):
+        # The next chunk is resolved before the previous one is written
+        with self.fail_once(chunk=3):
+            job = importer.run_import_job(importer.claim_import_job())
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertEqual((job.rows_processed, job.products_created), (importer.CHUNK_SIZE, 25))
+        self.assertTrue(job.file.storage.exists(job.file.name))
+        # Not right away
+        self.assertIsNone(importer.claim_import_job())
+
+        ImportJob.objects.filter(pk=job.pk).update(
+            finished_at=timezone.now() - importer.RETRY_AFTER)
+        job = importer.run_import_job(importer.claim_import_job())
+        self.assertEqual(job.status, ImportJob.DONE, job.message)
+        self.assertEqual((job.attempts, job.products_created, job.products_skipped), (2, 60, 0))
+        self.assertEqual(Product.objects.count(), 60)
+        self.assertFalse(job.file)
+
+    def test_the_file_of_a_job_that_failed_for_good_is_deleted_later(self):
+        name = self.job.file.name
+        ImportJob.objects.filter(pk=self.job.pk).update(
+            status=ImportJob.FAILED, attempts=importer.MAX_ATTEMPTS, finished_at=timezone.now())
+        self.assertIsNone(importer.claim_import_job())
+        self.assertEqual(importer.delete_failed_import_files(), 0)
+
+        ImportJob.objects.filter(pk=self.job.pk).update(
+            finished_at=timezone.now() - importer.FAILED_FILE_RETENTION)
+        self.assertEqual(importer.delete_failed_import_files(), 1)
+        self.assertFalse(self.job.file.storage.exists(name))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.file.name, '')
+
+
+class ImportJobHeartbeatTests(TransactionTestCase):
+    def test_a_running_job_is_not_reclaimed_while_its_worker_is_alive(self):
+        job = ImportJob.objects.create(status=ImportJob.RUNNING, attempts=1)
+        stale = timezone.now() - importer.STALE_AFTER - timedelta(minutes=1)
+        ImportJob.objects.filter(pk=job.pk).update(updated_at=stale)
+
+        with mock.patch.object(importer, 'HEARTBEAT_INTERVAL', 0.01), importer.JobHeartbeat(job):
+            # A chunk downloading for longer than STALE_AFTER
+            deadline = time.monotonic() + 5
+            while ImportJob.objects.get(pk=job.pk).updated_at == stale and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertIsNone(importer.claim_import_job())
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
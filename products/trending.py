@@ -0,0 +1,97 @@
+"""
+Trending score from recent orders, wishlist additions and reviews.
+
+Every event is worth `weight * exp(-age / tau)`. Instead of decaying all
+scores on every run, the score is kept in log space against a fixed epoch:
+
+    trending_score = log(sum(weight * exp((created_at - EPOCH) / tau)))
+
+Decaying every product by the same factor doesn't change their order, so
+this sorts exactly like the decayed sum, and a new event is folded in with
+a logaddexp. The periodic job therefore only touches products with new
+events. 0 means no activity (event times are after the epoch and weights
+at least 1, so real scores are positive).
+"""
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .cache import invalidate_tags
+from .models import Product, ProductReview, Wishlist
+
+EPOCH = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+HALF_LIFE = timedelta(days=3)
+# Events older than this add less than 0.1% of a new one, skipped on the first run
+WINDOW = HALF_LIFE * 10
+ORDER_WEIGHT = 3.0
+WISHLIST_WEIGHT = 2.0
+REVIEW_WEIGHT = 1.0
+BATCH_SIZE = 500
+
+
+def event_exponent(created_at, weight):
+    tau = HALF_LIFE.total_seconds() / math.log(2)
+    return math.log(weight) + (created_at - EPOCH).total_seconds() / tau
+
+
+def logaddexp(a, b):
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def iter_events(since, until):
+    """Yields (product id, created_at, weight) for the events in (since, until]."""
+    from order.models import OrderItem
+
+    window = {'created_at__gt': since, 'created_at__lte': until}
+    items = OrderItem.objects.filter(**window).exclude(order__status='cancelled')
+    for pk, created_at, quantity in items.values_list(
+            'product_id', 'created_at', 'quantity').iterator():
+        yield pk, created_at, ORDER_WEIGHT * max(quantity, 1)
+    for pk, created_at in Wishlist.objects.filter(**window).values_list(
+            'product_id', 'created_at').iterator():
+        yield pk, created_at, WISHLIST_WEIGHT
+    for pk, created_at in ProductReview.objects.filter(**window).values_list(
+            'product_id', 'created_at').iterator():
+        yield pk, created_at, REVIEW_WEIGHT
+
+
+def update_trending_scores(full=False):
+    """
+    Folds the events since the last run into the scores of their products.
+    `full` recomputes every score from the last WINDOW of events. Returns
+    the number of products updated.
+    """
+    now = timezone.now()
+    since = None if full else Product.objects.aggregate(
+        last=Max('trending_updated_at'))['last']
+    if since is None:
+        since = now - WINDOW
+
+    added = {}
+    for pk, created_at, weight in iter_events(since, now):
+        exponent = event_exponent(created_at, weight)
+        added[pk] = logaddexp(added[pk], exponent) if pk in added else exponent
+
+    if full:
+        Product.objects.exclude(trending_score=0).update(trending_score=0)
+    products = []
+    pks = sorted(added)
+    for start in range(0, len(pks), BATCH_SIZE):
+        batch = pks[start:start + BATCH_SIZE]
+        for product in Product.objects.filter(pk__in=batch).only('trending_score'):
+            score = added[product.pk]
+            if product.trending_score:
+                score = logaddexp(product.trending_score, score)
+            product.trending_score = score
+            product.trending_updated_at = now
+            products.append(product)
+    # bulk_update leaves updated_at (and the save signals) alone
+    Product.objects.bulk_update(
+        products, ['trending_score', 'trending_updated_at'], batch_size=BATCH_SIZE)
+    if products or full:
+        invalidate_tags('trending')
+    return len(products)
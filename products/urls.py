@@ -1,13 +1,18 @@
 from django.urls import path
 from .views import (
     ProductListCreateView,
+    ProductAutocompleteView,
+    ProductFacetsView,
     ProductDetailView,
     CategoryListCreateView,
     CategoryDetailView,
+    CategoryTreeView,
     SimilarProductsView,
+    BoughtTogetherView,
     WishlistListCreateView,
     WishlistRetrieveUpdateDestroyView,
     ProductReviewView,
+    ProductReviewListView,
     ProductImageListCreateView,
     ProductImageRetrieveUpdateDestroyView,
     ProductReviewRetrieveUpdateDestroyView,
@@ -17,16 +22,25 @@ from .views import (
     SubCategoryListCreateView,
     SubCategoryRetrieveUpdateDestroyView,
     ProductExcelImportAPIView,
+    ProductExportAPIView,
     SubSubCategoryListCreateView,
     SubSubCategoryRetrieveUpdateDestroyView,
     CategoryExcelUploadView,
-    ProductGoogleSheetImportAPIView
+    ProductGoogleSheetImportAPIView,
+    ImportJobDetailView
 )
 
 urlpatterns = [
     path('products/', ProductListCreateView.as_view(), name='product-list-create'),
+    path('products/facets/', ProductFacetsView.as_view(), name='product-facets'),
+    path('products/autocomplete/', ProductAutocompleteView.as_view(),
+         name='product-autocomplete'),
     path('products/<slug:slug>/similar/',
          SimilarProductsView.as_view(), name='similar-products'),
+    path('products/<slug:slug>/bought-together/',
+         BoughtTogetherView.as_view(), name='bought-together-products'),
+    path('products/<slug:slug>/reviews/',
+         ProductReviewListView.as_view(), name='product-reviews'),
     path('products/<slug:subsubcategory_slug>/<slug:slug>/',
          ProductDetailView.as_view(), name='product-detail'),
     path('images/', ProductImageListCreateView.as_view(),
@@ -37,6 +51,7 @@ urlpatterns = [
          name='category-list-create'),
     path('categories/<slug:slug>/', CategoryDetailView.as_view(),
          name='category-detail'),
+    path('category-tree/', CategoryTreeView.as_view(), name='category-tree'),
     path('subcategories/', SubCategoryListCreateView.as_view(),
          name='subcategory-list-create'),
     path('subcategories/<slug:slug>/', SubCategoryRetrieveUpdateDestroyView.as_view(),
@@ -57,6 +72,7 @@ urlpatterns = [
     path('sizes/<int:id>/', SizeRetrieveUpdateDestroyView.as_view(),
          name='size-retrieve-update-destroy'),
 
+    path('download/products/', ProductExportAPIView.as_view(), name='product-export'),
     path('download/product-template/', ProductExcelExportWithDropdownAPIView.as_view(),
          name='product-template-download'),
     path('product/bulk-upload/',
@@ -65,5 +81,7 @@ urlpatterns = [
          CategoryExcelUploadView.as_view(), name='category-import'),
     path("import-products/",
          ProductGoogleSheetImportAPIView.as_view(), name="import-products"),
+    path('import-jobs/<uuid:token>/', ImportJobDetailView.as_view(),
+         name='import-job-detail'),
 
 ]
@@ -2,25 +2,26 @@ import re
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 import csv
+import json
 from .serializers import ImportSerializer, SubSubCategorySmallSerializer
 from .models import Product, ProductCategory, ProductSubCategory, Size, ProductImage
 import openpyxl
 from rest_framework.parsers import MultiPartParser
-from django.core.files.base import ContentFile
-import requests
 import os
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.utils.text import slugify
 from django.core.files.temp import NamedTemporaryFile
 from django.core.files import File
+from django.core.files.base import ContentFile
+from django.urls import reverse
 import pandas as pd
 import io
 from openpyxl.worksheet.datavalidation import DataValidation
 from openpyxl import Workbook
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import generics
-from .models import Product, ProductCategory, ProductSubCategory, Wishlist, ProductReview, ProductImage, Size, ProductSubSubCategory
-from .serializers import ProductSerializer, CategorySerializer, SubCategorySerializer, ProductDetailSerializer, WishlistSerializer, ProductReviewDetailSerializer, ProductReviewSerializer, ProductImageSerializer, ProductImageSmallSerializer, SizeSerializer, ImportSerializer, ProductListSerializer, CategorySmallSerializer, SubCategorySmallSerializer, SubSubCategorySerializer, SubSubCategoryListSerializer
+from .models import Product, ProductCategory, ProductSubCategory, Wishlist, ProductReview, ProductImage, Size, ProductSubSubCategory, ProductRecommendation, ImportJob
+from .serializers import ProductSerializer, CategorySerializer, SubCategorySerializer, ProductDetailSerializer, WishlistSerializer, ProductReviewDetailSerializer, ProductReviewSerializer, ProductImageSerializer, ProductImageSmallSerializer, SizeSerializer, ImportSerializer, ProductListSerializer, CategorySmallSerializer, SubCategorySmallSerializer, SubSubCategorySerializer, SubSubCategoryListSerializer, ProductReviewSmallSerializer, ImportJobSerializer
 from django_filters import rest_framework as django_filters
 from rest_framework import filters
 from django.http import Http404
@@ -28,6 +29,16 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
+from django.db.models import Case, Count, Max, Min, Q, When
+from django.db.models.functions import Coalesce
+from decimal import Decimal, InvalidOperation
+from ecommerce.queryset_optimizer import OptimizedQuerysetMixin
+from .cache import CachedListMixin, cached_download, get_wishlisted_product_ids, invalidate_wishlisted_product_ids
+from .pagination import ProductCursorPagination, ReviewCursorPagination
+from .search import ProductSearchFilter
+from .autocomplete import get_index as get_autocomplete_index
+from .importer import dry_run_import, import_categories, read_upload
+from .exporter import EXPORT_COLUMNS, iter_product_rows, stream_csv, stream_xlsx
 # Create your views here.
 
 
@@ -37,10 +48,25 @@ class CustomPagination(PageNumberPagination):
     max_page_size = 100
 
 
-class CategoryListCreateView(generics.ListCreateAPIView):
-    queryset = ProductCategory.objects.only(
-        'id', 'name', 'slug', 'description', 'image')
+class WishlistContextMixin:
+    """
+    Loads the user's wishlisted product ids once per request for
+    `is_wishlisted`, when the serializer in use has that field.
+    """
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        user = self.request.user
+        if user.is_authenticated and 'is_wishlisted' in self.get_serializer_class()._declared_fields:
+            context['wishlisted_product_ids'] = get_wishlisted_product_ids(
+                user)
+        return context
+
+
+class CategoryListCreateView(CachedListMixin, OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = ProductCategory.objects.all()
     serializer_class = CategorySerializer
+    cache_collection_tags = ['categories']
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -48,9 +74,8 @@ class CategoryListCreateView(generics.ListCreateAPIView):
         return CategorySerializer
 
 
-class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ProductCategory.objects.only(
-        'id', 'name', 'slug', 'description', 'image')
+class CategoryDetailView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = ProductCategory.objects.all()
     serializer_class = CategorySerializer
     lookup_field = 'slug'
 
@@ -69,12 +94,22 @@ class SubCategoryFilter(django_filters.FilterSet):
         fields = ['category']
 
 
-class SubCategoryListCreateView(generics.ListCreateAPIView):
-    queryset = ProductSubCategory.objects.only(
-        'id', 'name', 'slug', 'category', 'image', 'description').select_related('category')
+class SubCategoryListCreateView(CachedListMixin, OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = ProductSubCategory.objects.all()
     serializer_class = SubCategorySerializer
     filter_backends = [django_filters.DjangoFilterBackend]
     filterset_class = SubCategoryFilter
+    cache_collection_tags = ['subcategories']
+
+    def get_cache_collection_tags(self):
+        tags = super().get_cache_collection_tags()
+        params = self.request.query_params
+        if 'category' in params or 'category_slug' in params:
+            tags.add('categories')
+        return tags
+
+    def get_cache_tags(self, objects):
+        return {f'category:{obj.category_id}' for obj in objects}
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -84,14 +119,12 @@ class SubCategoryListCreateView(generics.ListCreateAPIView):
     def get_queryset(self):
         category_slug = self.request.query_params.get('category_slug')
         if category_slug:
-            return ProductSubCategory.objects.filter(category__slug=category_slug).only('id', 'name', 'slug', 'category', 'image').select_related('category')
-        return ProductSubCategory.objects.only(
-            'id', 'name', 'slug', 'category', 'image').select_related('category')
+            return ProductSubCategory.objects.filter(category__slug=category_slug)
+        return ProductSubCategory.objects.all()
 
 
-class SubCategoryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ProductSubCategory.objects.only(
-        'id', 'name', 'slug', 'category', 'image').select_related('category')
+class SubCategoryRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = ProductSubCategory.objects.all()
     serializer_class = SubCategorySerializer
     lookup_field = 'slug'
 
@@ -101,10 +134,19 @@ class SubCategoryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView
         return SubCategorySerializer
 
 
-class SubSubCategoryListCreateView(generics.ListCreateAPIView):
-    queryset = ProductSubSubCategory.objects.only(
-        'id', 'name', 'slug', 'subcategory', 'image', 'description').select_related('subcategory')
+class SubSubCategoryListCreateView(CachedListMixin, OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = ProductSubSubCategory.objects.all()
     serializer_class = SubSubCategorySerializer
+    cache_collection_tags = ['subsubcategories']
+
+    def get_cache_collection_tags(self):
+        tags = super().get_cache_collection_tags()
+        if 'subcategory_slug' in self.request.query_params:
+            tags.add('subcategories')
+        return tags
+
+    def get_cache_tags(self, objects):
+        return {f'subcategory:{obj.subcategory_id}' for obj in objects}
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -114,41 +156,79 @@ class SubSubCategoryListCreateView(generics.ListCreateAPIView):
     def get_queryset(self):
         subcategory_slug = self.request.query_params.get('subcategory_slug')
         if subcategory_slug:
-            return ProductSubSubCategory.objects.filter(subcategory__slug=subcategory_slug).only('id', 'name', 'slug', 'subcategory', 'image').select_related('subcategory')
-        return ProductSubSubCategory.objects.only(
-            'id', 'name', 'slug', 'subcategory', 'image').select_related('subcategory')
+            return ProductSubSubCategory.objects.filter(subcategory__slug=subcategory_slug)
+        return ProductSubSubCategory.objects.all()
 
 
-class SubSubCategoryRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ProductSubSubCategory.objects.only(
-        'id', 'name', 'slug', 'subcategory', 'image').select_related('subcategory')
+class SubSubCategoryRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = ProductSubSubCategory.objects.all()
     serializer_class = SubSubCategorySerializer
     lookup_field = 'slug'
 
 
-class SizeListCreateView(generics.ListCreateAPIView):
-    queryset = Size.objects.only('id', 'name', 'description')
+class CategoryTreeView(CachedListMixin, APIView):
+    """
+    The whole category -> subcategory -> subsubcategory tree with active
+    product counts, built from one query per level.
+    """
+    cache_collection_tags = ['categories', 'subcategories', 'subsubcategories', 'products']
+
+    def get(self, request):
+        return self.cached_response(request, self.get_tree)
+
+    def get_tree(self):
+        active = Q(products__is_active=True)
+        categories = ProductCategory.objects.annotate(
+            product_count=Count('products', filter=active)
+        ).values('id', 'name', 'slug', 'product_count').order_by('name')
+        subcategories = ProductSubCategory.objects.annotate(
+            product_count=Count('products', filter=active)
+        ).values('id', 'name', 'slug', 'category_id', 'product_count').order_by('name')
+        subsubcategories = ProductSubSubCategory.objects.filter(subcategory__isnull=False).annotate(
+            product_count=Count('products', filter=active)
+        ).values('id', 'name', 'slug', 'subcategory_id', 'product_count').order_by('name')
+
+        tree = []
+        category_nodes = {}
+        for category in categories:
+            node = {**category, 'subcategories': []}
+            category_nodes[category['id']] = node
+            tree.append(node)
+        subcategory_nodes = {}
+        for subcategory in subcategories:
+            category_id = subcategory.pop('category_id')
+            node = {**subcategory, 'subsubcategories': []}
+            subcategory_nodes[subcategory['id']] = node
+            category_nodes[category_id]['subcategories'].append(node)
+        for subsubcategory in subsubcategories:
+            subcategory_id = subsubcategory.pop('subcategory_id')
+            subcategory_nodes[subcategory_id]['subsubcategories'].append(subsubcategory)
+        return Response(tree)
+
+
+class SizeListCreateView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = Size.objects.all()
     serializer_class = SizeSerializer
 
 
-class SizeRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Size.objects.only('id', 'name', 'description')
+class SizeRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Size.objects.all()
     serializer_class = SizeSerializer
     lookup_field = 'id'
 
 
-class ProductImageListCreateView(generics.ListCreateAPIView):
+class ProductImageListCreateView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
     queryset = ProductImage.objects.all()
     serializer_class = ProductImageSmallSerializer
 
 
-class ProductImageRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+class ProductImageRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = ProductImage.objects.all()
     lookup_field = 'id'
 
     def get_object(self):
         try:
-            return ProductImage.objects.get(id=self.kwargs['id'])
+            return self.filter_queryset(self.get_queryset()).get(id=self.kwargs['id'])
         except ProductImage.DoesNotExist:
             raise Http404("Product image not found")
 
@@ -174,26 +254,83 @@ class ProductFilter(django_filters.FilterSet):
         field_name='is_popular', lookup_expr='exact')
     is_featured = django_filters.BooleanFilter(
         field_name='is_featured', lookup_expr='exact')
+    min_rating = django_filters.NumberFilter(
+        field_name='rating_stats__average_rating', lookup_expr='gte')
 
     class Meta:
         model = Product
         fields = ['name', 'min_price', 'max_price', 'category',
-                  'subcategory', 'subsubcategory', 'is_popular', 'is_featured']
-
-
-class ProductListCreateView(generics.ListCreateAPIView):
-    queryset = Product.objects.only(
-        'id', 'name', 'slug', 'market_price', 'price', 'is_popular', 'is_featured', 'stock',
-        'thumbnail_image', 'thumbnail_image_alt_description', 'category', 'subcategory', 'subsubcategory', 'is_featured', 'is_popular', 'is_active'
-    ).select_related('category', 'subcategory', 'subsubcategory').order_by('-created_at')
+                  'subcategory', 'subsubcategory', 'is_popular', 'is_featured', 'min_rating']
+
+
+def product_filter_cache_tags(params):
+    """Tags for the ProductFilter/ordering parameters of a product listing."""
+    tags = set()
+    if 'rating' in params.get('ordering', '') or 'min_rating' in params:
+        tags.add('product-ratings')
+    if 'trending' in params.get('ordering', ''):
+        tags.add('trending')
+    # Slug filters go stale when a category is renamed
+    for param, tag in (('category', 'categories'),
+                       ('subcategory', 'subcategories'),
+                       ('subsubcategory', 'subsubcategories')):
+        if param in params:
+            tags.add(tag)
+    return tags
+
+
+class ProductOrderingFilter(filters.OrderingFilter):
+    """OrderingFilter plus `?ordering=trending` (most trending first)."""
+    aliases = {'trending': ['-trending_score', '-id']}
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_param, '').strip()
+        if ordering in self.aliases:
+            return self.aliases[ordering]
+        return super().get_ordering(request, queryset, view)
+
+
+class ProductListCreateView(CachedListMixin, WishlistContextMixin, OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = Product.objects.annotate(
+        rating=Coalesce('rating_stats__average_rating', 0.0)
+    ).order_by('-created_at')
     serializer_class = ProductSerializer
     filter_backends = [django_filters.DjangoFilterBackend,
-                       filters.SearchFilter, filters.OrderingFilter]
+                       ProductSearchFilter, ProductOrderingFilter]
+    # Only used where the database has no full-text index
     search_fields = ['name']
-    ordering_fields = ['name', 'price', '-name', '-price', '-created_at']
+    ordering_fields = ['name', 'price', 'rating',
+                       '-name', '-price', '-rating', '-created_at']
     filterset_class = ProductFilter
     pagination_class = CustomPagination
+    cursor_pagination_class = ProductCursorPagination
     parser_classes = [MultiPartParser, FormParser, JSONParser]
+    cache_collection_tags = ['products']
+
+    def get_cache_collection_tags(self):
+        return super().get_cache_collection_tags() | product_filter_cache_tags(
+            self.request.query_params)
+
+    def get_cache_tags(self, objects):
+        tags = set()
+        for product in objects:
+            tags.add(f'product:{product.pk}')
+            tags.update(f'{name}:{pk}' for name, pk in (
+                ('category', product.category_id),
+                ('subcategory', product.subcategory_id),
+                ('subsubcategory', product.subsubcategory_id)) if pk)
+            tags.update(f'size:{size.pk}' for size in product.size.all())
+        return tags
+
+    @property
+    def paginator(self):
+        # ?cursor= (empty for the first page) switches to keyset pagination
+        if not hasattr(self, '_paginator'):
+            if self.cursor_pagination_class.cursor_query_param in self.request.query_params:
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -201,7 +338,106 @@ class ProductListCreateView(generics.ListCreateAPIView):
         return ProductSerializer
 
 
-class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
+class ProductFacetsView(CachedListMixin, APIView):
+    """
+    Product counts per subcategory, subsubcategory, size, image color and
+    price range for the products matching the ProductFilter parameters.
+    """
+    # Upper bounds of the price ranges, the last range is open ended
+    price_buckets = [1000, 2500, 5000, 10000, 25000]
+    cache_collection_tags = ['products', 'subcategories', 'subsubcategories',
+                             'sizes', 'product-images']
+
+    def get_cache_collection_tags(self):
+        return super().get_cache_collection_tags() | product_filter_cache_tags(
+            self.request.query_params)
+
+    def get(self, request):
+        return self.cached_response(request, self.get_facets)
+
+    def get_price_buckets(self):
+        buckets = self.request.query_params.get('price_buckets')
+        if not buckets:
+            return self.price_buckets
+        return sorted({Decimal(bound) for bound in buckets.split(',') if bound.strip()})
+
+    def get_facets(self):
+        request = self.request
+        filterset = ProductFilter(
+            request.query_params, queryset=Product.objects.all(), request=request)
+        if not filterset.is_valid():
+            return Response({'error': filterset.errors}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            bounds = self.get_price_buckets()
+        except InvalidOperation:
+            return Response({'error': 'price_buckets must be comma separated numbers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        products = filterset.qs.order_by()
+
+        subcategories = products.filter(subcategory__isnull=False).values(
+            'subcategory_id', 'subcategory__name', 'subcategory__slug'
+        ).annotate(count=Count('id', distinct=True)).order_by('-count', 'subcategory__name')
+        subsubcategories = products.filter(subsubcategory__isnull=False).values(
+            'subsubcategory_id', 'subsubcategory__name', 'subsubcategory__slug'
+        ).annotate(count=Count('id', distinct=True)).order_by('-count', 'subsubcategory__name')
+        sizes = products.values('size__id', 'size__name').annotate(
+            count=Count('id', distinct=True)).order_by('-count', 'size__name')
+        colors = ProductImage.objects.filter(
+            product__in=products.values('pk')
+        ).exclude(color__isnull=True).exclude(color='').values('color').annotate(
+            count=Count('product', distinct=True)).order_by('-count', 'color')
+
+        # Every price range and the totals in one aggregate
+        ranges = list(zip([0, *bounds], [*bounds, None]))
+        aggregates = {'total': Count('id', distinct=True),
+                      'min_price': Min('price'), 'max_price': Max('price')}
+        for i, (low, high) in enumerate(ranges):
+            condition = Q(price__gte=low)
+            if high is not None:
+                condition &= Q(price__lt=high)
+            aggregates[f'range_{i}'] = Count('id', distinct=True, filter=condition)
+        totals = products.aggregate(**aggregates)
+
+        return Response({
+            'count': totals['total'],
+            'subcategories': [
+                {'id': row['subcategory_id'], 'name': row['subcategory__name'],
+                 'slug': row['subcategory__slug'], 'count': row['count']}
+                for row in subcategories],
+            'subsubcategories': [
+                {'id': row['subsubcategory_id'], 'name': row['subsubcategory__name'],
+                 'slug': row['subsubcategory__slug'], 'count': row['count']}
+                for row in subsubcategories],
+            'sizes': [
+                {'id': row['size__id'], 'name': row['size__name'], 'count': row['count']}
+                for row in sizes if row['size__id'] is not None],
+            'colors': [
+                {'color': row['color'], 'count': row['count']} for row in colors],
+            'price': {'min': totals['min_price'], 'max': totals['max_price']},
+            'price_ranges': [
+                {'min': low, 'max': high, 'count': totals[f'range_{i}']}
+                for i, (low, high) in enumerate(ranges)],
+        })
+
+
+class ProductAutocompleteView(APIView):
+    """Search box suggestions, answered from the in-process prefix index."""
+    default_limit = 8
+    max_limit = 20
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        limit = max(1, min(limit, self.max_limit))
+        if not query:
+            return Response({'results': []})
+        return Response({'results': get_autocomplete_index().search(query, limit)})
+
+
+class ProductDetailView(WishlistContextMixin, OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Product.objects.all()
     lookup_field = 'slug'
 
@@ -210,7 +446,7 @@ class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
         slug = self.kwargs.get('slug')
 
         try:
-            return Product.objects.get(subsubcategory__slug=subsubcategory_slug, slug=slug)
+            return self.filter_queryset(self.get_queryset()).get(subsubcategory__slug=subsubcategory_slug, slug=slug)
         except Product.DoesNotExist:
             raise Http404("Product not found")
 
@@ -220,65 +456,85 @@ class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
         return ProductSerializer
 
 
-class SimilarProductsView(generics.ListAPIView):
+class RecommendedProductsView(OptimizedQuerysetMixin, generics.ListAPIView):
+    """Products stored as ProductRecommendation rows of `kind` for the product."""
     serializer_class = ProductListSerializer
+    kind = None
+    limit = 3
 
     def get_queryset(self):
         slug = self.kwargs.get('slug')
         try:
             product = Product.objects.only('id', 'category').get(slug=slug)
-            # Get products from the same category, excluding the current product
-            similar_products = Product.objects.only(
-                'id', 'name', 'slug', 'market_price', 'price', 'is_popular', 'is_featured',
-                'thumbnail_image', 'thumbnail_image_alt_description'
-            ).filter(
-                category=product.category,
-                is_active=True
-            ).exclude(
-                id=product.id
-            ).order_by('-created_at')[:3]
-            return similar_products
         except Product.DoesNotExist:
             return Product.objects.none()
 
+        recommended_ids = list(ProductRecommendation.objects.filter(
+            product=product, kind=self.kind
+        ).order_by('rank').values_list('recommended_id', flat=True)[:self.limit])
+        if recommended_ids:
+            return Product.objects.filter(id__in=recommended_ids, is_active=True).order_by(
+                Case(*[When(id=pk, then=rank) for rank, pk in enumerate(recommended_ids)]))
+        return self.get_fallback_queryset(product)
+
+    def get_fallback_queryset(self, product):
+        return Product.objects.none()
+
+
+class SimilarProductsView(RecommendedProductsView):
+    # Precomputed by the build_similar_products command
+    kind = ProductRecommendation.SIMILAR
+
+    def get_fallback_queryset(self, product):
+        # Not built yet: products from the same category, excluding the current product
+        return Product.objects.filter(
+            category=product.category_id,
+            is_active=True
+        ).exclude(
+            id=product.id
+        ).order_by('-created_at')[:self.limit]
+
+
+class BoughtTogetherView(RecommendedProductsView):
+    # Precomputed from orders by the build_bought_together command
+    kind = ProductRecommendation.BOUGHT_TOGETHER
+    limit = 6
 
-class WishlistListCreateView(generics.ListCreateAPIView):
-    queryset = Wishlist.objects.only(
-        'id', 'user', 'product', 'created_at', 'updated_at'
-    ).select_related(
-        'user',
-        'product'
-    )
+
+class WishlistListCreateView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = Wishlist.objects.all()
     serializer_class = WishlistSerializer
 
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        return self.queryset.filter(user=self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+        invalidate_wishlisted_product_ids(self.request.user)
 
 
-class WishlistRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Wishlist.objects.only(
-        'id', 'user', 'product', 'created_at', 'updated_at'
-    ).select_related(
-        'user',
-        'product'
-    )
+class WishlistRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Wishlist.objects.all()
     serializer_class = WishlistSerializer
 
     def get_object(self):
         try:
-            return Wishlist.objects.get(user=self.request.user)
+            return self.filter_queryset(self.get_queryset()).get(
+                user=self.request.user, id=self.kwargs.get('id'))
         except Wishlist.DoesNotExist:
             raise Http404("Wishlist not found")
 
+    def perform_update(self, serializer):
+        serializer.save()
+        invalidate_wishlisted_product_ids(self.request.user)
+
     def delete(self, request, *args, **kwargs):
         try:
             id = self.kwargs.get('id')
             wishlist = Wishlist.objects.get(
                 user=self.request.user, id=id)
             wishlist.delete()
+            invalidate_wishlisted_product_ids(self.request.user)
             return Response({"message": "Product removed from wishlist"}, status=status.HTTP_204_NO_CONTENT)
         except Wishlist.DoesNotExist:
             raise Http404("Wishlist not found")
@@ -293,10 +549,8 @@ class ProductReviewFilter(django_filters.FilterSet):
         fields = ['rating']
 
 
-class ProductReviewView(generics.ListCreateAPIView):
-    queryset = ProductReview.objects.only(
-        'id', 'product', 'user', 'review', 'rating', 'created_at'
-    ).select_related('product', 'user').order_by('-created_at')
+class ProductReviewView(OptimizedQuerysetMixin, generics.ListCreateAPIView):
+    queryset = ProductReview.objects.order_by('-created_at')
     serializer_class = ProductReviewSerializer
     pagination_class = CustomPagination
     filter_backends = [django_filters.DjangoFilterBackend,]
@@ -311,24 +565,47 @@ class ProductReviewView(generics.ListCreateAPIView):
         slug = self.request.query_params.get('slug')
         try:
             product = Product.objects.only('id').get(slug=slug)
-            return ProductReview.objects.filter(product=product)
+            return self.queryset.filter(product=product)
         except Product.DoesNotExist:
-            return ProductReview.objects.all()
+            return self.queryset.all()
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
-class ProductReviewRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ProductReview.objects.only(
-        'id', 'product', 'user', 'review', 'rating', 'created_at', 'updated_at'
-    ).select_related('product', 'user')
+class ProductReviewListView(OptimizedQuerysetMixin, generics.ListAPIView):
+    """All reviews of a product, newest first, keyset paginated."""
+    queryset = ProductReview.objects.all()
+    serializer_class = ProductReviewSmallSerializer
+    pagination_class = ReviewCursorPagination
+    filter_backends = [django_filters.DjangoFilterBackend,]
+    filterset_class = ProductReviewFilter
+
+    def get_queryset(self):
+        product_id = Product.objects.filter(
+            slug=self.kwargs.get('slug')).values_list('id', flat=True).first()
+        if product_id is None:
+            raise Http404("Product not found")
+        # Filter on the id so the (product, created_at) index is used
+        return self.queryset.filter(product_id=product_id)
+
+
+class ProductReviewRetrieveUpdateDestroyView(OptimizedQuerysetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = ProductReview.objects.all()
     serializer_class = ProductReviewSerializer
     lookup_field = 'id'
 
 
 class ProductExcelExportWithDropdownAPIView(APIView):
+    # The dropdowns list the categories, rebuilt only when they change
+    cache_tags = ['categories', 'subcategories', 'subsubcategories', 'sizes']
+
     def get(self, request, format=None):
+        return cached_download(
+            request, 'products_export.xlsx', self.cache_tags, self.build_template,
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+    def build_template(self):
         categories = list(
             ProductCategory.objects.values_list('name', flat=True))
 
@@ -361,12 +638,7 @@ class ProductExcelExportWithDropdownAPIView(APIView):
             ref_ws.cell(row=idx, column=3, value=value)
 
         # Define headers
-        headers = [
-            'Product Name', 'Category', 'Sub Category', 'Sub Sub Category', 'Price', 'Market Price', 'Discount',
-            'Product Stock', 'Is popular', 'Is featured', 'Description', 'Highlight Description', 'Extra Description', 'Specifications', 'Meta Title', 'Meta Description',
-            'Size', 'Thumbnail image', 'Thumbnail Image Alt Description',
-            'Color', 'Stock (Color)', 'Images', 'Image Alt Description'
-        ]
+        headers = EXPORT_COLUMNS
         ws.append(headers)
 
         # Sample common data (only on first row)
@@ -451,12 +723,28 @@ class ProductExcelExportWithDropdownAPIView(APIView):
             ws.column_dimensions[col[0].column_letter].width = max_len + 2
 
         wb.save(output)
-        output.seek(0)
-        response = HttpResponse(
-            output.read(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = 'attachment; filename="products_export.xlsx"'
+        return output.getvalue()
+
+
+class ProductExportAPIView(APIView):
+    """Every product in the import layout, ?format=csv or xlsx (the default)."""
+    formats = {
+        'csv': (stream_csv, 'text/csv; charset=utf-8'),
+        'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    }
+
+    def perform_content_negotiation(self, request, force=False):
+        # ?format= picks the file type here, not a DRF renderer
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        export_format = request.query_params.get('format', 'xlsx').lower()
+        if export_format not in self.formats:
+            return Response({'error': "format must be 'csv' or 'xlsx'"}, status=status.HTTP_400_BAD_REQUEST)
+        stream, content_type = self.formats[export_format]
+        response = StreamingHttpResponse(
+            stream(iter_product_rows(request.build_absolute_uri)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{export_format}"'
         return response
 
 
@@ -474,123 +762,34 @@ class CategoryExcelUploadView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        for _, row in df.iterrows():
-            cat1_name = str(row.get('Category①')).strip()
-            cat2_name = str(row.get('Category②')).strip()
-            cat3_name = str(row.get('Category③')).strip(
-            ) if pd.notna(row.get('Category③')) else None
-
-            # Create or get Category①
-            cat1, _ = ProductCategory.objects.get_or_create(name=cat1_name)
-
-            # Create or get Category②
-            cat2, _ = ProductSubCategory.objects.get_or_create(
-                name=cat2_name,
-                category=cat1
-            )
-
-            # Create or get Category③ if present
-            if cat3_name:
-                ProductSubSubCategory.objects.get_or_create(
-                    name=cat3_name,
-                    subcategory=cat2
-                )
-
-        return Response({'message': 'Categories imported successfully'}, status=status.HTTP_201_CREATED)
-
-
-def clean_name(name):
-    """Removes content within parentheses and trims spaces."""
-    return re.sub(r'\s*\(.*?\)', '', name or '').strip()
+        created = import_categories(df)
+        return Response({'message': 'Categories imported successfully', 'created': created},
+                        status=status.HTTP_201_CREATED)
 
 
-def get_or_create_category_hierarchy(row):
-    category_name = clean_name(row.get('Category'))
-    subcategory_name = clean_name(row.get('Sub Category'))
-    subsubcategory_name = clean_name(row.get('Sub Sub Category'))
+def import_job_options(request):
+    """mode and deactivate_missing for a new ImportJob, None if the mode is unknown."""
+    mode = request.data.get('mode') or ImportJob.CREATE
+    if mode not in dict(ImportJob.MODE_CHOICES):
+        return None
+    return {
+        'mode': mode,
+        'deactivate_missing': str(request.data.get('deactivate_missing')).lower() in ('1', 'true'),
+    }
 
-    category, _ = ProductCategory.objects.get_or_create(name=category_name)
-    subcategory, _ = ProductSubCategory.objects.get_or_create(
-        name=subcategory_name, category=category)
-    subsubcategory, _ = ProductSubSubCategory.objects.get_or_create(
-        name=subsubcategory_name, subcategory=subcategory)
-    return category, subcategory, subsubcategory
 
+def is_dry_run(request):
+    return request.query_params.get('dry_run', '').lower() in ('1', 'true')
 
-def assign_sizes(product, size_str):
-    sizes = [s.strip() for s in str(size_str or '').split(',') if s.strip()]
-    for size_name in sizes:
-        size_obj, _ = Size.objects.get_or_create(name=size_name)
-        product.size.add(size_obj)
 
-
-def save_image_from_url(instance, field_name, url, fallback_name):
-    if url:
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                filename = url.split("/")[-1].split("?")[0] or fallback_name
-                getattr(instance, field_name).save(
-                    filename, ContentFile(response.content), save=True)
-        except Exception as e:
-            print(
-                f"[{field_name}] Failed for {getattr(instance, 'name', 'unknown')}: {e}")
-
-
-def create_product_from_row(row, category, subcategory, subsubcategory):
-    product = Product.objects.create(
-        name=row.get('Product Name'),
-        slug=slugify(row.get('Product Name')),
-        price=row.get('Price') or 0,
-        market_price=row.get('Market Price') or 0,
-        discount=row.get('Discount') or 0,
-        stock=row.get('Product Stock') or 0,
-        is_popular=str(row.get('Is popular')).lower() == 'true',
-        is_featured=str(row.get('Is featured')).lower() == 'true',
-        description=row.get('Description') or '',
-        highlight_description=row.get('Highlight Description') or row.get(
-            'Product Hightlight Description') or '',
-        extra_description=row.get('Extra Description') or row.get(
-            'Product Extra Description') or '',
-        specifications=row.get('Specifications') or row.get(
-            'Product Specifications') or '',
-        meta_title=row.get('Meta Title') or row.get(
-            'Product Meta Title') or '',
-        meta_description=row.get('Meta Description') or row.get(
-            'Product Meta Description') or '',
-        thumbnail_image_alt_description=row.get(
-            'Thumbnail Image Alt Description') or '',
-        category=category,
-        subcategory=subcategory,
-        subsubcategory=subsubcategory
-    )
-    assign_sizes(product, row.get('Size'))
-    save_image_from_url(product, 'thumbnail_image', row.get(
-        'Thumbnail image'), f"{slugify(product.name)}-thumb.jpg")
-    return product
-
-
-def create_product_image(product, img_data):
-    img_url = img_data.get('Images')
-    if img_url:
-        try:
-            response = requests.get(img_url)
-            if response.status_code == 200:
-                image_file = ContentFile(response.content)
-                image_filename = img_url.split(
-                    "/")[-1].split("?")[0] or f"{slugify(product.name)}.jpg"
-                image_instance = ProductImage.objects.create(
-                    product=product,
-                    color=img_data.get('Color', ''),
-                    stock=img_data.get('Stock', 0) or img_data.get(
-                        'Stock (Color)', 0) or 0,
-                    image_alt_description=img_data.get(
-                        'Image Alt Description', '') or img_data.get('Image Alt Description') or '',
-                )
-                image_instance.image.save(
-                    image_filename, image_file, save=True)
-        except Exception as e:
-            print(f"[Image] Failed for {product.name}: {e}")
+def import_job_response(request, job):
+    return Response({
+        'message': 'Import queued',
+        'job_id': job.pk,
+        'status': job.status,
+        'status_url': request.build_absolute_uri(
+            reverse('import-job-detail', args=[job.token])),
+    }, status=status.HTTP_202_ACCEPTED)
 
 
 class ProductExcelImportAPIView(APIView):
@@ -601,61 +800,26 @@ class ProductExcelImportAPIView(APIView):
         file = request.FILES.get('file')
         if not file:
             return Response({'error': 'No file uploaded'}, status=400)
-
-        file_name = file.name.lower()
-        try:
-            if file_name.endswith('.csv'):
-                rows = self.read_csv(file)
-            elif file_name.endswith(('.xlsx', '.xls')):
-                rows = self.read_excel(file)
-            else:
-                return Response({'error': 'Unsupported file type. Use CSV or Excel.'}, status=400)
-            return self.process_rows(rows)
-        except Exception as e:
-            return Response({'error': str(e)}, status=500)
-
-    def read_csv(self, file):
-        decoded_file = file.read().decode('utf-8-sig')  # ✅ decode with BOM-aware codec
-        io_string = io.StringIO(decoded_file)
-        reader = csv.DictReader(io_string)
-        cleaned_rows = []
-
-        for row in reader:
-            cleaned_row = {key.strip(): (value.strip() if isinstance(value, str) else value)
-                           for key, value in row.items()}
-            cleaned_rows.append(cleaned_row)
-
-        return cleaned_rows
-
-    def read_excel(self, file):
-        wb = openpyxl.load_workbook(file)
-        ws = wb.active
-        header = [cell.value for cell in ws[1]]
-        rows = []
-        for row in ws.iter_rows(min_row=2, values_only=True):
-            row_data = dict(zip(header, row))
-            rows.append(row_data)
-        return rows
-
-    def process_rows(self, rows):
-        last_product = None
-        for row_data in rows:
-            name = row_data.get('Product Name')
-            if name:
-                category, subcategory, subsubcategory = get_or_create_category_hierarchy(
-                    row_data)
-                # Check if product with same name and subcategory exists
-                if Product.objects.filter(name=name, subcategory=subcategory).exists():
-                    last_product = None
-                    continue
-                product = create_product_from_row(
-                    row_data, category, subcategory, subsubcategory)
-                last_product = product
-            product = last_product
-            if not product:
-                continue
-            create_product_image(product, row_data)
-        return Response({'message': 'Products imported successfully'}, status=201)
+        if not file.name.lower().endswith(('.csv', '.xlsx', '.xls', '.zip')):
+            return Response({'error': 'Unsupported file type. Use CSV, Excel or a .zip bundle.'},
+                            status=400)
+        options = import_job_options(request)
+        if options is None:
+            return Response({'error': "mode must be 'create' or 'sync'"}, status=400)
+
+        if is_dry_run(request):
+            # Validated right away, nothing is stored or downloaded
+            try:
+                with read_upload(file, file.name) as (rows, total, bundle):
+                    return Response(dry_run_import(rows, bundle=bundle, **options))
+            except Exception as e:
+                return Response({'error': str(e)}, status=400)
+
+        # Imported by the run_import_jobs command
+        job = ImportJob.objects.create(
+            file=file, original_name=file.name,
+            created_by=request.user if request.user.is_authenticated else None, **options)
+        return import_job_response(request, job)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -664,44 +828,27 @@ class ProductGoogleSheetImportAPIView(APIView):
         rows = request.data.get('rows')
         if not rows:
             return Response({'error': 'No data received'}, status=400)
-
-        products = []
-        current_product_data = None
-
-        for row in rows:
-            name = row.get('Product Name')
-            if name:
-                if current_product_data:
-                    products.append(current_product_data)
-                current_product_data = {
-                    'product_data': row,
-                    'images': [{
-                        'Color': row.get('Color'),
-                        'Stock': row.get('Stock (Color)', 0),
-                        'Images': row.get('Images'),
-                        'Image Alt Description': row.get('Image Alt Description')
-                    }]
-                }
-            else:
-                if current_product_data:
-                    current_product_data['images'].append({
-                        'Color': row.get('Color'),
-                        'Stock': row.get('Stock (Color)', 0),
-                        'Images': row.get('Images'),
-                        'Image Alt Description': row.get('Image Alt Description')
-                    })
-        if current_product_data:
-            products.append(current_product_data)
-
-        for p in products:
-            row = p['product_data']
-            category, subcategory, subsubcategory = get_or_create_category_hierarchy(
-                row)
-            # Check if product with same name and subcategory exists
-            if Product.objects.filter(name=row.get('Product Name'), subcategory=subcategory).exists():
-                continue
-            product = create_product_from_row(
-                row, category, subcategory, subsubcategory)
-            for img in p['images']:
-                create_product_image(product, img)
-        return Response({'message': '✅ Products imported successfully!'})
+        options = import_job_options(request)
+        if options is None:
+            return Response({'error': "mode must be 'create' or 'sync'"}, status=400)
+        if is_dry_run(request):
+            return Response(dry_run_import(rows, **options))
+
+        job = ImportJob(
+            original_name='google-sheet.jsonl',
+            created_by=request.user if request.user.is_authenticated else None, **options)
+        # One row per line so the worker can stream it
+        job.file.save('google-sheet.jsonl', ContentFile(''.join(
+            json.dumps(row, default=str) + '\n' for row in rows).encode()), save=True)
+        return import_job_response(request, job)
+
+
+class ImportJobDetailView(generics.RetrieveAPIView):
+    """
+    Progress and per-row errors of a product import, found by the token of
+    the status URL its import request returned, not by its guessable id.
+    """
+    permission_classes = ProductExcelImportAPIView.permission_classes
+    queryset = ImportJob.objects.all()
+    serializer_class = ImportJobSerializer
+    lookup_field = 'token'